@@ -0,0 +1,81 @@
+"""
+Micro-benchmark do classificador de intenção jurídica (texto livre)
+
+Compara o classificador compilado (trie em expressão regular sobre texto sem
+acento) com a varredura de palavras-chave usada anteriormente, tanto com a
+lista antiga (8 palavras) quanto com o dicionário completo: o custo da
+varredura cresce com o dicionário, o do classificador só com o texto.
+
+Exemplo:
+    python -m benchmarks.bench_intent --messages 20000
+"""
+import os
+import sys
+import random
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from legal_database.intent import LegalIntentClassifier, DEFAULT_KEYWORDS
+
+LEGACY_KEYWORDS = ['lei ', 'direito ', 'jurídico', 'processo', 'recurso', 'contrato', 'penal', 'trabalhista']
+
+LEGAL_MESSAGES = [
+    "Qual o prazo para entrar com recurso trabalhista?",
+    "Fui demitido sem justa causa, quais são meus direitos?",
+    "O que diz o Art. 5º da Constituição sobre liberdade de expressão?",
+    "Meu contrato de locação prevê multa por rescisão antecipada, é legal?",
+    "Como funciona a pensão alimentícia após o divórcio?",
+    "Quero saber se cabe indenização por danos morais",
+]
+
+CASUAL_MESSAGES = [
+    "Bom dia! Tudo bem com você?",
+    "Estou participando de um processo seletivo amanhã",
+    "Obrigado pela ajuda, até mais",
+    "kkkkk valeu",
+    "Você pode me mandar o link de novo?",
+    "Vou falar com o pessoal de recursos humanos depois do almoço",
+]
+
+
+def legacy_is_legal(text: str) -> bool:
+    return any(keyword in text.lower() for keyword in LEGACY_KEYWORDS)
+
+
+def scan_full_dictionary(text: str) -> bool:
+    return any(keyword in text.lower() for keyword in DEFAULT_KEYWORDS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--legal-ratio', type=float, default=0.3)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    messages = [
+        rng.choice(LEGAL_MESSAGES if rng.random() < args.legal_ratio else CASUAL_MESSAGES)
+        for _ in range(args.messages)
+    ]
+    classifier = LegalIntentClassifier()
+
+    candidates = (
+        ('varredura (lista antiga)', legacy_is_legal),
+        ('varredura (dicionário)', scan_full_dictionary),
+        ('compilado (dicionário)', classifier.is_legal),
+    )
+    for name, func in candidates:
+        best = min(timeit.repeat(lambda: [func(m) for m in messages], number=1, repeat=args.repeat))
+        print(f"{name:25} {best / len(messages) * 1e6:6.2f} µs/mensagem")
+
+    print("\nClassificação dos exemplos (anterior / compilado):")
+    for message in LEGAL_MESSAGES + CASUAL_MESSAGES:
+        print(f"  {legacy_is_legal(message)!s:5} / {classifier.is_legal(message)!s:5}  "
+              f"{classifier.score(message):4.1f}  {message}")
+
+
+if __name__ == '__main__':
+    main()
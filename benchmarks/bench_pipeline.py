@@ -0,0 +1,282 @@
+"""
+Benchmark de ponta a ponta do pipeline de consultas e análise de documentos
+
+Executa `LegalConsult.process_legal_query` e `DocumentAnalyzer.handle_document`
+com objetos do Telegram simulados e um backend de modelo local (fake ou replay),
+reportando latência p50/p95/p99 e vazão.
+
+Exemplos:
+    python -m benchmarks.bench_pipeline --scenario consult --requests 500 --concurrency 50
+    python -m benchmarks.bench_pipeline --scenario document --latency lognormal:0,0.4
+    python -m benchmarks.bench_pipeline --scenario document --doc-pages 20 --concurrency 2
+    LLM_RECORD_PATH=gravacao.jsonl python -m benchmarks.bench_pipeline --backend replay
+
+Por padrão MongoDB e caches persistentes são substituídos por equivalentes em
+memória; use --mongo para medir contra o banco configurado em MONGODB_URI.
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.entitlements import Entitlement
+from database.usage import QuotaReservation
+from utils.cache import TTLCache
+from utils.llm_backends import FakeBackend, create_backend, set_llm_backend
+from utils.llm_executor import get_llm_executor
+
+QUESTIONS = [
+    "Qual o prazo para entrada de recurso em ação trabalhista?",
+    "Como funciona o aviso prévio na demissão sem justa causa?",
+    "Quais verbas rescisórias são devidas na dispensa imotivada?",
+    "Qual a pena para o crime de estelionato?",
+    "Como contestar uma multa de trânsito?",
+    "Quais os requisitos do contrato de locação residencial?",
+    "O que caracteriza assédio moral no trabalho?",
+    "Qual o prazo de prescrição para cobrança de dívida?",
+]
+
+SAMPLE_DOCUMENT = (
+    "CLÁUSULA PRIMEIRA - DO OBJETO. O presente contrato tem por objeto a prestação "
+    "de serviços de consultoria. CLÁUSULA SEGUNDA - DO PRAZO. O prazo de vigência é "
+    "de doze meses. CLÁUSULA TERCEIRA - DO PAGAMENTO. O valor mensal será pago até o "
+    "quinto dia útil. "
+) * 40
+
+
+class FakeMessage:
+    """Mensagem do Telegram simulada (envio/edição com latência configurável)"""
+
+    def __init__(self, latency: float, document=None, text: str = ''):
+        self.latency = latency
+        self.document = document
+        self.text = text
+        self.edits = 0
+
+    async def reply_text(self, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        return FakeMessage(self.latency, text=text)
+
+    async def edit_text(self, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.text = text
+        self.edits += 1
+        return self
+
+
+class FakeFile:
+    def __init__(self, content: bytes, latency: float):
+        self.content = content
+        self.latency = latency
+
+    async def download_to_memory(self, out):
+        await asyncio.sleep(self.latency)
+        out.write(self.content)
+
+
+class FakeDocument:
+    def __init__(self, file_unique_id: str, content: bytes, latency: float):
+        self.file_name = f'{file_unique_id}.txt'
+        self.file_unique_id = file_unique_id
+        self.file_size = len(content)
+        self._file = FakeFile(content, latency)
+
+    async def get_file(self):
+        return self._file
+
+
+class InMemoryDatabase:
+    """Equivalente em memória das operações de cota usadas pelos handlers"""
+
+    def __init__(self, plan: str, latency: float):
+        self.plan = plan
+        self.latency = latency
+
+    async def _io(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def get_entitlement_async(self, user_id):
+        await self._io()
+        return Entitlement(user_id, self.plan)
+
+    async def get_user_plan_async(self, user_id):
+        await self._io()
+        return self.plan
+
+    async def reserve_usage_async(self, user_id):
+        await self._io()
+        return QuotaReservation(user_id, self.plan, 1, 2024)
+
+    async def commit_usage_async(self, reservation):
+        pass
+
+    async def refund_usage_async(self, reservation):
+        pass
+
+
+class InMemoryCache:
+    """Substitui o PersistentCache mantendo apenas o nível em memória"""
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.memory = TTLCache(maxsize=10000, ttl=3600)
+
+    def get_cached(self, key):
+        return self.memory.get(key) if self.enabled else None
+
+    async def get_async(self, key):
+        return self.get_cached(key)
+
+    async def set_async(self, key, value):
+        if self.enabled:
+            self.memory.set(key, value)
+
+    def stats(self):
+        return {'hit_ratio': self.memory.hit_ratio}
+
+
+def make_offline(args, legal_consult=None, document_analyzer=None):
+    """Troca MongoDB e caches persistentes por equivalentes em memória"""
+    db = InMemoryDatabase(args.plan, args.db_latency)
+    if legal_consult is not None:
+        import legal_database.legal_analyzer as legal_analyzer_module
+        legal_analyzer_module.answer_cache = InMemoryCache(args.cache)
+        legal_analyzer_module._corpus_version_cache.set('version', 0, ttl=float('inf'))
+        legal_consult.db = db
+        analyzer = legal_consult.legal_analyzer
+        analyzer.db = db
+        for i, question in enumerate(QUESTIONS * 25):
+            analyzer.index.add(f'doc{i}', f'Documento {i}', f'{question} Texto legal de referência {i}.')
+        analyzer.index_refresh_interval = float('inf')
+        analyzer._index_loaded_at = time.monotonic()
+    if document_analyzer is not None:
+        import modules.document_analyser as document_analyser_module
+        document_analyser_module.document_cache = InMemoryCache(args.cache)
+        document_analyzer.db = db
+    return db
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+async def run_load(handler, make_request, requests: int, concurrency: int):
+    """Executa `requests` chamadas com no máximo `concurrency` simultâneas"""
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+
+    async def worker():
+        nonlocal errors
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            try:
+                await handler(*make_request(i))
+                latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                errors += 1
+                print(f"erro: {e}", file=sys.stderr)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def report(name: str, latencies: list, errors: int, elapsed: float):
+    print(f"\n== {name} ==")
+    print(f"requisições: {len(latencies)} ok, {errors} erros em {elapsed:.2f}s")
+    print(f"vazão:       {len(latencies) / elapsed:.1f} req/s")
+    for label, p in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99)):
+        print(f"{label}:         {percentile(latencies, p) * 1000:.1f} ms")
+    print(f"máx:         {max(latencies, default=0) * 1000:.1f} ms")
+    print(f"executor:    {get_llm_executor().stats()}")
+
+
+async def bench_consult(args):
+    from modules.legal_consult import LegalConsult
+    consult = LegalConsult(None)
+    consult.streaming = args.streaming
+    if not args.mongo:
+        make_offline(args, legal_consult=consult)
+
+    def make_request(i):
+        question = f"{QUESTIONS[i % len(QUESTIONS)]} #{i % args.distinct}"
+        user_id = random.randint(1, 10 ** 6)
+        update = SimpleNamespace(
+            effective_user=SimpleNamespace(id=user_id),
+            message=FakeMessage(args.telegram_latency)
+        )
+        return update, question, user_id
+
+    return await run_load(consult.process_legal_query, make_request, args.requests, args.concurrency)
+
+
+async def bench_document(args):
+    from modules.document_analyser import DocumentAnalyzer
+    analyzer = DocumentAnalyzer(None)
+    if not args.mongo:
+        make_offline(args, document_analyzer=analyzer)
+    content = (SAMPLE_DOCUMENT * args.doc_pages).encode('utf-8')
+
+    def make_request(i):
+        document = FakeDocument(f'file{i % args.distinct}', content, args.telegram_latency)
+        update = SimpleNamespace(
+            effective_user=SimpleNamespace(id=random.randint(1, 10 ** 6)),
+            message=FakeMessage(args.telegram_latency, document=document)
+        )
+        return update, SimpleNamespace(user_data={}, args=[])
+
+    return await run_load(analyzer.handle_document, make_request, args.requests, args.concurrency)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=['consult', 'document', 'all'], default='all')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--distinct', type=int, default=10 ** 9,
+                        help='quantidade de perguntas/arquivos distintos (repetição exercita cache e coalescência)')
+    parser.add_argument('--backend', choices=['fake', 'replay'], default='fake')
+    parser.add_argument('--latency', default='lognormal:-0.7,0.5', help='distribuição de latência do backend fake')
+    parser.add_argument('--telegram-latency', type=float, default=0.02)
+    parser.add_argument('--db-latency', type=float, default=0.002)
+    parser.add_argument('--doc-pages', type=int, default=1,
+                        help='multiplicador do documento de exemplo (~10 mil caracteres cada)')
+    parser.add_argument('--plan', default='premium')
+    parser.add_argument('--streaming', action='store_true')
+    parser.add_argument('--cache', action='store_true', help='habilita os caches de respostas e de análises em memória')
+    parser.add_argument('--mongo', action='store_true', help='usa o MongoDB real em vez do banco em memória')
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    if args.backend == 'fake':
+        set_llm_backend(FakeBackend(latency=args.latency))
+    else:
+        set_llm_backend(create_backend('replay'))
+
+    if args.scenario in ('consult', 'all'):
+        report('consultas (/consultar)', *await bench_consult(args))
+    if args.scenario in ('document', 'all'):
+        report('documentos (/analisar)', *await bench_document(args))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,126 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+from .connection import get_client, run_in_executor
+from utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class PersistentCache:
+    """
+    Cache em dois níveis: LRU em memória na frente de uma coleção MongoDB
+    As entradas persistidas expiram via índice TTL em 'expires_at'; com max_entries
+    a coleção também é limitada, removendo as entradas usadas há mais tempo
+    """
+
+    # Intervalo (em gravações) entre verificações do tamanho da coleção
+    TRIM_EVERY = 100
+
+    def __init__(self, collection_name: str, maxsize: int = 5000, ttl: float = 3600,
+                 memory_ttl: float = None, max_entries: int = None):
+        self.collection_name = collection_name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._writes = 0
+        self.memory = TTLCache(maxsize=maxsize, ttl=memory_ttl or ttl)
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self._indexes_ready = False
+        self._lock = threading.Lock()
+
+    @property
+    def collection(self):
+        return get_client().juridical_bot[self.collection_name]
+
+    def _ensure_indexes(self):
+        if self._indexes_ready:
+            return
+        self.collection.create_index('expires_at', expireAfterSeconds=0)
+        if self.max_entries:
+            self.collection.create_index('used_at')
+        self._indexes_ready = True
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get_cached(self, key):
+        """Consulta apenas o nível em memória (sem I/O)"""
+        value = self.memory.get(key)
+        if value is not None:
+            self._count('memory_hits')
+        return value
+
+    def get(self, key):
+        """Consulta memória e, em caso de falta, a coleção persistente"""
+        value = self.get_cached(key)
+        if value is not None:
+            return value
+
+        entry = self.collection.find_one({'_id': key, 'expires_at': {'$gt': datetime.utcnow()}})
+        if entry is None:
+            self._count('misses')
+            return None
+
+        self._count('persistent_hits')
+        self.memory.set(key, entry['value'])
+        if self.max_entries:
+            self.collection.update_one({'_id': key}, {'$set': {'used_at': datetime.utcnow()}})
+        return entry['value']
+
+    def set(self, key, value):
+        """Grava nos dois níveis"""
+        self.memory.set(key, value)
+        self._ensure_indexes()
+        now = datetime.utcnow()
+        self.collection.update_one(
+            {'_id': key},
+            {'$set': {
+                'value': value,
+                'created_at': now,
+                'used_at': now,
+                'expires_at': now + timedelta(seconds=self.ttl)
+            }},
+            upsert=True
+        )
+        if self.max_entries:
+            with self._lock:
+                self._writes += 1
+                trim = self._writes % self.TRIM_EVERY == 0
+            if trim:
+                self.trim()
+
+    def trim(self) -> int:
+        """Remove as entradas usadas há mais tempo além de max_entries"""
+        excess = self.collection.estimated_document_count() - self.max_entries
+        if excess <= 0:
+            return 0
+        oldest = self.collection.find({}, {'_id': 1}).sort('used_at', 1).limit(excess)
+        ids = [entry['_id'] for entry in oldest]
+        removed = self.collection.delete_many({'_id': {'$in': ids}}).deleted_count
+        logger.info(f"Cache {self.collection_name}: {removed} entradas antigas removidas")
+        return removed
+
+    async def get_async(self, key):
+        """Variante assíncrona de `get` (acerto em memória não troca de thread)"""
+        value = self.get_cached(key)
+        if value is not None:
+            return value
+        return await run_in_executor(self.get, key)
+
+    async def set_async(self, key, value):
+        await run_in_executor(self.set, key, value)
+
+    def stats(self) -> dict:
+        """Contadores de acerto/falta para monitoramento"""
+        hits = self.memory_hits + self.persistent_hits
+        total = hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'persistent_hits': self.persistent_hits,
+            'misses': self.misses,
+            'hit_ratio': hits / total if total else 0.0,
+            'memory_size': len(self.memory)
+        }
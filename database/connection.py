@@ -0,0 +1,108 @@
+import os
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import MongoClient
+from utils.metrics import REGISTRY, timed
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_executor = None
+_lock = threading.Lock()
+
+
+def get_client() -> MongoClient:
+    """
+    Retorna o MongoClient compartilhado pelo processo
+    O pool de conexões é configurado por variáveis de ambiente
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = MongoClient(
+                    os.getenv('MONGODB_URI'),
+                    maxPoolSize=int(os.getenv('MONGO_MAX_POOL_SIZE', 50)),
+                    minPoolSize=int(os.getenv('MONGO_MIN_POOL_SIZE', 0)),
+                    maxIdleTimeMS=int(os.getenv('MONGO_MAX_IDLE_MS', 300000)),
+                    waitQueueTimeoutMS=int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 10000)),
+                )
+                logger.info("Cliente MongoDB compartilhado criado")
+    return _client
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Pool de threads usado pelas variantes assíncronas das operações de banco"""
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv('MONGO_EXECUTOR_WORKERS', 16)),
+                    thread_name_prefix='mongo'
+                )
+    return _executor
+
+
+async def run_in_executor(func, *args, **kwargs):
+    """Executa uma chamada bloqueante do PyMongo fora do event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+def close_client():
+    """Fecha o cliente compartilhado e o pool de threads"""
+    global _client, _executor
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+
+MONGO_LATENCY = REGISTRY.histogram(
+    'mongo_operation_seconds', 'Duração dos métodos do DatabaseManager', ('method',)
+)
+MONGO_ERRORS = REGISTRY.counter('mongo_operation_errors_total', 'Erros nos métodos do DatabaseManager', ('method',))
+
+
+def instrument_methods(cls):
+    """Mede a duração de cada método público síncrono definido na classe"""
+    for name, attr in list(vars(cls).items()):
+        if name.startswith('_') or not callable(attr) or getattr(attr, '_instrumented', False):
+            continue
+        if isinstance(attr, (staticmethod, classmethod, property)) or asyncio.iscoroutinefunction(attr):
+            continue
+        wrapper = timed(MONGO_LATENCY.labels(name), MONGO_ERRORS.labels(name))(attr)
+        wrapper._instrumented = True
+        setattr(cls, name, wrapper)
+    return cls
+
+
+def add_async_variants(cls):
+    """
+    Gera `<metodo>_async` para cada método público definido na classe
+    Ex: db.get_user_plan_async(user_id) não bloqueia o event loop
+    """
+    for name, attr in list(vars(cls).items()):
+        if name.startswith('_') or name.endswith('_async') or not callable(attr):
+            continue
+        if isinstance(attr, (staticmethod, classmethod, property)):
+            continue
+        if asyncio.iscoroutinefunction(attr) or f'{name}_async' in vars(cls):
+            continue
+        setattr(cls, f'{name}_async', _make_async(name))
+    return cls
+
+
+def _make_async(name):
+    async def method(self, *args, **kwargs):
+        return await run_in_executor(getattr(self, name), *args, **kwargs)
+    method.__name__ = f'{name}_async'
+    method.__doc__ = f"Variante assíncrona de `{name}` (executada fora do event loop)"
+    return method
@@ -0,0 +1,44 @@
+import os
+from dataclasses import dataclass
+from utils.cache import TTLCache
+from utils.metrics import register_cache
+
+# 10 consultas gratuitas por mês
+FREE_MONTHLY_LIMIT = 10
+PAID_PLANS = ('premium', 'enterprise')
+
+# Cache compartilhado pelo processo, invalidado ao mudar plano ou uso
+entitlement_cache = TTLCache(
+    maxsize=int(os.getenv('ENTITLEMENT_CACHE_SIZE', 50000)),
+    ttl=float(os.getenv('ENTITLEMENT_CACHE_TTL', 30))
+)
+register_cache('entitlements', entitlement_cache)
+
+
+@dataclass(frozen=True)
+class Entitlement:
+    """Plano, uso mensal e cota restante de um usuário"""
+    user_id: int
+    plan: str = 'free'
+    monthly_usage: int = 0
+    exists: bool = True
+
+    @property
+    def is_free(self) -> bool:
+        return self.plan == 'free'
+
+    @property
+    def remaining(self):
+        """Consultas restantes no mês (None = ilimitado)"""
+        if not self.is_free:
+            return None
+        return max(FREE_MONTHLY_LIMIT - self.monthly_usage, 0)
+
+    @property
+    def allowed(self) -> bool:
+        """Indica se o usuário pode realizar uma nova consulta"""
+        if not self.exists:
+            return False
+        if self.is_free:
+            return self.remaining > 0
+        return self.plan in PAID_PLANS
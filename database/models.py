@@ -1,11 +1,30 @@
-from pymongo import MongoClient
 from datetime import datetime, timedelta
+from dataclasses import replace
 import os
+from pymongo import ReturnDocument, ASCENDING
+from pymongo.errors import DuplicateKeyError
+from .connection import get_client, add_async_variants, instrument_methods, run_in_executor
+from .entitlements import Entitlement, FREE_MONTHLY_LIMIT, entitlement_cache
+from .usage import QuotaReservation, usage_buffer
+from .stats import stats_counters, usage_field, plan_field
+
+_indexes_ready = False
 
 class DatabaseManager:
-    def __init__(self):
-        self.client = MongoClient(os.getenv('MONGODB_URI'))
-        self.db = self.client.juridical_bot
+    # Cliente compartilhado por todo o processo (um único pool de conexões),
+    # criado apenas na primeira operação no banco
+    @property
+    def client(self):
+        return get_client()
+    
+    @property
+    def db(self):
+        return get_client().juridical_bot
+    
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        instrument_methods(cls)
+        add_async_variants(cls)
     
     # Coleções
     @property
@@ -24,6 +43,18 @@ class DatabaseManager:
     def user_usage(self):
         return self.db.user_usage
     
+    def ensure_indexes(self):
+        """Cria os índices necessários (uma vez por processo)"""
+        global _indexes_ready
+        if _indexes_ready:
+            return
+        # Índice único garante a reserva atômica de cota
+        self.user_usage.create_index(
+            [('user_id', ASCENDING), ('year', ASCENDING), ('month', ASCENDING)],
+            unique=True
+        )
+        _indexes_ready = True
+    
     def init_user(self, user_id, username, first_name):
         """Inicializa usuário no sistema"""
         user_data = {
@@ -34,35 +65,67 @@ class DatabaseManager:
             'joined_date': datetime.utcnow(),
             'monthly_usage': 0
         }
-        self.users.update_one(
+        # Quem volta ao bot (ex: desbloqueou e enviou /start) volta a receber broadcasts
+        result = self.users.update_one(
             {'user_id': user_id},
-            {'$setOnInsert': user_data},
+            {'$setOnInsert': user_data, '$unset': {'blocked': ''}},
             upsert=True
         )
+        if result.upserted_id is not None:
+            stats_counters.add('users_total')
+            stats_counters.add(plan_field('free'))
     
-    def check_user_subscription(self, user_id):
-        """Verifica assinatura do usuário"""
-        user = self.users.find_one({'user_id': user_id})
-        if not user:
-            return False
+    def get_entitlement(self, user_id) -> Entitlement:
+        """
+        Resolve plano e uso mensal do usuário em uma única ida ao banco
+        O resultado fica em cache até expirar ou ser invalidado
+        """
+        entitlement = entitlement_cache.get(user_id)
+        if entitlement is not None:
+            return entitlement
+        
+        now = datetime.utcnow()
+        result = list(self.users.aggregate([
+            {'$match': {'user_id': user_id}},
+            {'$limit': 1},
+            {'$lookup': {
+                'from': 'user_usage',
+                'pipeline': [
+                    {'$match': {'user_id': user_id, 'month': now.month, 'year': now.year}},
+                    {'$project': {'_id': 0, 'count': 1}}
+                ],
+                'as': 'usage'
+            }}
+        ]))
         
-        if user['subscription_plan'] == 'free':
-            return self.check_free_usage(user_id)
+        if result:
+            user = result[0]
+            usage = user['usage'][0].get('count', 0) if user['usage'] else 0
+            entitlement = Entitlement(user_id, user.get('subscription_plan', 'free'), usage)
+        else:
+            entitlement = Entitlement(user_id, exists=False)
         
-        return user['subscription_plan'] in ['premium', 'enterprise']
+        entitlement_cache.set(user_id, entitlement)
+        return entitlement
+    
+    async def get_entitlement_async(self, user_id) -> Entitlement:
+        """Variante assíncrona de `get_entitlement` (sem troca de thread em cache hit)"""
+        entitlement = entitlement_cache.get(user_id)
+        if entitlement is not None:
+            return entitlement
+        return await run_in_executor(self.get_entitlement, user_id)
+    
+    def invalidate_entitlement(self, user_id):
+        """Descarta o entitlement em cache do usuário"""
+        entitlement_cache.invalidate(user_id)
+    
+    def check_user_subscription(self, user_id):
+        """Verifica assinatura do usuário"""
+        return self.get_entitlement(user_id).allowed
     
     def check_free_usage(self, user_id):
         """Verifica se usuário free não excedeu limite"""
-        usage = self.user_usage.find_one({
-            'user_id': user_id,
-            'month': datetime.utcnow().month,
-            'year': datetime.utcnow().year
-        })
-        
-        free_limit = 10  # 10 consultas gratuitas por mês
-        current_usage = usage['count'] if usage else 0
-        
-        return current_usage < free_limit
+        return self.get_entitlement(user_id).monthly_usage < FREE_MONTHLY_LIMIT
     
     def increment_usage(self, user_id):
         """Incrementa contador de uso"""
@@ -75,3 +138,82 @@ class DatabaseManager:
             {'$inc': {'count': 1}},
             upsert=True
         )
+        stats_counters.add(usage_field(datetime.utcnow().month, datetime.utcnow().year))
+        self.invalidate_entitlement(user_id)
+    
+    def reserve_usage(self, user_id):
+        """
+        Reserva uma consulta na cota do usuário
+        Plano free: incremento atômico condicionado ao limite (uma operação no servidor)
+        Planos pagos: nenhuma escrita, o uso é contabilizado em lote no commit
+        Retorna QuotaReservation ou None se o usuário não puder consultar
+        """
+        entitlement = self.get_entitlement(user_id)
+        if not entitlement.exists:
+            return None
+        
+        now = datetime.utcnow()
+        if not entitlement.is_free:
+            if not entitlement.allowed:
+                return None
+            return QuotaReservation(user_id, entitlement.plan, now.month, now.year)
+        
+        self.ensure_indexes()
+        usage_filter = {
+            'user_id': user_id,
+            'month': now.month,
+            'year': now.year,
+            'count': {'$lt': FREE_MONTHLY_LIMIT}
+        }
+        try:
+            usage = self.user_usage.find_one_and_update(
+                usage_filter,
+                {'$inc': {'count': 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Documento do mês já existe com count no limite, ou upsert concorrente
+            usage = self.user_usage.find_one_and_update(
+                usage_filter,
+                {'$inc': {'count': 1}},
+                return_document=ReturnDocument.AFTER
+            )
+        
+        if usage is None:
+            entitlement_cache.set(user_id, replace(entitlement, monthly_usage=FREE_MONTHLY_LIMIT))
+            return None
+        
+        entitlement_cache.set(user_id, replace(entitlement, monthly_usage=usage['count']))
+        stats_counters.add(usage_field(now.month, now.year))
+        return QuotaReservation(user_id, entitlement.plan, now.month, now.year, counted=True)
+    
+    def commit_usage(self, reservation):
+        """Confirma a consulta reservada"""
+        if not reservation.counted:
+            usage_buffer.add(reservation.user_id, reservation.month, reservation.year)
+            stats_counters.add(usage_field(reservation.month, reservation.year))
+    
+    def refund_usage(self, reservation):
+        """Devolve a consulta reservada (ex: erro ao processar)"""
+        if not reservation.counted:
+            return
+        result = self.user_usage.update_one(
+            {
+                'user_id': reservation.user_id,
+                'month': reservation.month,
+                'year': reservation.year,
+                'count': {'$gt': 0}
+            },
+            {'$inc': {'count': -1}}
+        )
+        if result.modified_count:
+            stats_counters.add(usage_field(reservation.month, reservation.year), -1)
+        self.invalidate_entitlement(reservation.user_id)
+    
+    def flush_usage(self):
+        """Grava imediatamente os contadores de uso pendentes"""
+        return usage_buffer.flush()
+
+instrument_methods(DatabaseManager)
+add_async_variants(DatabaseManager)
@@ -1,11 +1,24 @@
 from datetime import datetime
+from pymongo import ReturnDocument
 from .models import DatabaseManager
+from .stats import stats_counters, plan_field, get_snapshot, reconcile
 
 class DatabaseManager(DatabaseManager):
     def get_user_plan(self, user_id: int) -> str:
         """Obtém o plano do usuário"""
-        user = self.users.find_one({'user_id': user_id})
-        return user.get('subscription_plan', 'free') if user else 'free'
+        return self.get_entitlement(user_id).plan
+
+    async def get_user_plan_async(self, user_id: int) -> str:
+        """Variante assíncrona de `get_user_plan`"""
+        return (await self.get_entitlement_async(user_id)).plan
+
+    def get_user_usage(self, user_id: int) -> dict:
+        """Obtém o uso do mês corrente e a cota restante"""
+        entitlement = self.get_entitlement(user_id)
+        return {
+            'monthly_usage': entitlement.monthly_usage,
+            'remaining': entitlement.remaining
+        }
 
     def get_user_data(self, user_id: int) -> dict:
         """Obtém todos os dados do usuário"""
@@ -20,7 +33,21 @@ class DatabaseManager(DatabaseManager):
 
     def update_user_plan(self, user_id: int, plan: str):
         """Atualiza plano do usuário"""
-        self.users.update_one(
+        previous = self.users.find_one_and_update(
             {'user_id': user_id},
-            {'$set': {'subscription_plan': plan}}
+            {'$set': {'subscription_plan': plan}},
+            projection={'subscription_plan': 1},
+            return_document=ReturnDocument.BEFORE
         )
+        if previous is not None and previous.get('subscription_plan', 'free') != plan:
+            stats_counters.add(plan_field(previous.get('subscription_plan')), -1)
+            stats_counters.add(plan_field(plan))
+        self.invalidate_entitlement(user_id)
+
+    def get_system_stats(self) -> dict:
+        """Estatísticas do sistema a partir dos contadores mantidos incrementalmente"""
+        return get_snapshot(self)
+
+    def reconcile_system_stats(self) -> dict:
+        """Recalcula os contadores a partir das coleções"""
+        return reconcile(self)
@@ -0,0 +1,198 @@
+import os
+import copy
+import time
+import logging
+from datetime import datetime, timedelta
+from pymongo import ReplaceOne, DeleteOne
+from .connection import get_client
+from .write_behind import WriteBehindBuffer
+from utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Estado de conversa abandonado expira (no banco e na memória) após CONVERSATION_TTL
+CONVERSATION_TTL = float(os.getenv('CONVERSATION_TTL', 3600))
+USER_DATA_TTL = float(os.getenv('USER_DATA_TTL', 30 * 86400))
+# Idade máxima do estado de um usuário em memória antes de reler do banco;
+# 0 relê a cada atualização (necessário se o mesmo usuário pode cair em outro processo)
+STATE_CACHE_TTL = float(os.getenv('STATE_CACHE_TTL', 0))
+REFRESH_ATTEMPTS = 3
+
+_MISSING = object()
+
+
+def user_data_id(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def conversation_id(name: str, key: tuple) -> str:
+    return f"conv:{name}:{':'.join(str(part) for part in key)}"
+
+
+class _Snapshot:
+    """Documentos de estado de um usuário carregados do banco"""
+    __slots__ = ('loaded_at', 'entries')
+
+    def __init__(self, loaded_at: float = 0.0):
+        self.loaded_at = loaded_at
+        self.entries = {}
+
+
+class SharedStateStore(WriteBehindBuffer):
+    """
+    Estado de conversa e user_data compartilhado entre processos (coleção MongoDB)
+    Leituras e gravações passam pela memória: o estado de cada usuário é lido
+    de uma vez (um find por user_id) e as gravações atualizam a memória na hora
+    e vão ao banco em lote, pela thread de flush. Os documentos expiram via
+    índice TTL em 'expires_at'
+    Gravações pendentes: _id -> (user_id, documento) ou (user_id, None) para remoção
+    """
+
+    thread_name = 'state-flush'
+
+    def __init__(self, collection_getter, interval: float = None, cache_ttl: float = None,
+                 maxsize: int = None):
+        super().__init__(collection_getter, interval or float(os.getenv('STATE_FLUSH_INTERVAL', 1)))
+        self.cache_ttl = STATE_CACHE_TTL if cache_ttl is None else cache_ttl
+        self.memory = TTLCache(maxsize=maxsize or int(os.getenv('STATE_CACHE_SIZE', 10000)), ttl=USER_DATA_TTL)
+        self._indexes_ready = False
+
+    def prepare(self, collection):
+        if self._indexes_ready:
+            return
+        collection.create_index('expires_at', expireAfterSeconds=0)
+        collection.create_index('user_id')
+        self._indexes_ready = True
+
+    def merge(self, older, newer):
+        # Vale a gravação mais recente do documento
+        return newer
+
+    def operations(self, pending: dict) -> list:
+        return [
+            ((doc_id,), DeleteOne({'_id': doc_id}) if doc is None else ReplaceOne({'_id': doc_id}, doc, upsert=True))
+            for doc_id, (_, doc) in pending.items()
+        ]
+
+    # Leitura
+
+    def refresh(self, user_id: int):
+        """
+        Relê do banco o estado do usuário se a cópia em memória for mais antiga
+        que cache_ttl (bloqueante - usar fora do event loop)
+        """
+        snapshot = self.memory.get(user_id)
+        if snapshot is not None and time.monotonic() - snapshot.loaded_at < self.cache_ttl:
+            return
+
+        # Um flush concluído durante a leitura pode ter tirado da fila uma gravação
+        # que o find não viu: nesse caso a leitura é refeita, e na última
+        # tentativa o find é feito com o lock (nenhum flush conclui no meio)
+        for attempt in range(REFRESH_ATTEMPTS):
+            locked = attempt == REFRESH_ATTEMPTS - 1
+            if locked:
+                self._lock.acquire()
+            try:
+                with self._lock:
+                    generation = self.generation
+                fresh = _Snapshot(time.monotonic())
+                for doc in self._collection_getter().find(
+                    {'user_id': user_id, 'expires_at': {'$gt': datetime.utcnow()}}
+                ):
+                    fresh.entries[doc['_id']] = doc
+                with self._lock:
+                    if self.generation != generation and not locked:
+                        continue
+                    # Gravações locais ainda não confirmadas pelo banco prevalecem
+                    for doc_id, (_, doc) in self.unsaved(lambda doc_id, entry: entry[0] == user_id).items():
+                        if doc is None:
+                            fresh.entries.pop(doc_id, None)
+                        else:
+                            fresh.entries[doc_id] = doc
+                    self.memory.set(user_id, fresh)
+                    return
+            finally:
+                if locked:
+                    self._lock.release()
+
+    def flush_user(self, user_id: int) -> int:
+        """Grava imediatamente as alterações pendentes do usuário"""
+        return self.flush(select=lambda doc_id, entry: entry[0] == user_id)
+
+    def _get(self, user_id: int, doc_id: str):
+        """Documento em memória; _MISSING se o estado do usuário não foi carregado"""
+        snapshot = self.memory.get(user_id)
+        if snapshot is None:
+            return _MISSING
+        doc = snapshot.entries.get(doc_id)
+        if doc is None or doc['expires_at'] <= datetime.utcnow():
+            return None
+        return doc
+
+    def user_data(self, user_id: int) -> dict:
+        doc = self._get(user_id, user_data_id(user_id))
+        if doc is _MISSING or doc is None:
+            return {}
+        return copy.deepcopy(doc['data'])
+
+    def conversation_state(self, name: str, key: tuple, user_id: int):
+        """Estado da conversa; None se não há conversa e _MISSING se o usuário não foi carregado"""
+        doc = self._get(user_id, conversation_id(name, key))
+        if doc is _MISSING or doc is None:
+            return doc
+        return doc['state']
+
+    # Gravação
+
+    def _write(self, user_id: int, doc_id: str, doc):
+        with self._lock:
+            snapshot = self.memory.get(user_id)
+            if snapshot is None:
+                # Estado parcial: a próxima leitura ainda precisa ir ao banco
+                snapshot = _Snapshot()
+                self.memory.set(user_id, snapshot)
+            if doc is None:
+                snapshot.entries.pop(doc_id, None)
+            else:
+                snapshot.entries[doc_id] = doc
+            self.put(doc_id, (user_id, doc))
+
+    def set_user_data(self, user_id: int, data: dict):
+        if not data:
+            self.drop_user_data(user_id)
+            return
+        now = datetime.utcnow()
+        self._write(user_id, user_data_id(user_id), {
+            '_id': user_data_id(user_id),
+            'kind': 'user_data',
+            'user_id': user_id,
+            'data': data,
+            'updated_at': now,
+            'expires_at': now + timedelta(seconds=USER_DATA_TTL)
+        })
+
+    def drop_user_data(self, user_id: int):
+        self._write(user_id, user_data_id(user_id), None)
+
+    def set_conversation(self, name: str, key: tuple, state, user_id: int):
+        """Grava o estado da conversa (None encerra a conversa)"""
+        doc_id = conversation_id(name, key)
+        if state is None:
+            self._write(user_id, doc_id, None)
+            return
+        now = datetime.utcnow()
+        self._write(user_id, doc_id, {
+            '_id': doc_id,
+            'kind': 'conversation',
+            'name': name,
+            'key': list(key),
+            'user_id': user_id,
+            'state': state,
+            'updated_at': now,
+            'expires_at': now + timedelta(seconds=CONVERSATION_TTL)
+        })
+
+
+# Armazenamento compartilhado pelo processo (gravado no encerramento por flush_all)
+state_store = SharedStateStore(lambda: get_client().juridical_bot.bot_state)
+
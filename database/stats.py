@@ -0,0 +1,133 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from pymongo import ReadPreference, UpdateOne
+from .connection import get_client
+from .write_behind import WriteBehindBuffer
+from utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+STATS_DOC_ID = 'system'
+STATS_CACHE_TTL = float(os.getenv('STATS_CACHE_TTL', 60))
+STATS_RECONCILE_INTERVAL = float(os.getenv('STATS_RECONCILE_INTERVAL', 6 * 3600))
+
+
+def usage_field(month: int, year: int) -> str:
+    """Campo do total de consultas do mês no documento de estatísticas"""
+    return f"usage.{year}_{month:02d}"
+
+
+def plan_field(plan: str) -> str:
+    return f"plans.{plan or 'free'}"
+
+
+class StatsCounters(WriteBehindBuffer):
+    """
+    Contadores agregados do sistema (usuários por plano, consultas por mês,
+    documentos legais) mantidos incrementalmente
+    Os incrementos são acumulados em memória por segundo em que ocorreram e
+    gravados com um $inc por segundo, condicionado a 'reconciled_at': a
+    reconciliação feita em qualquer processo já contou os incrementos
+    anteriores a ela, que são descartados em vez de somados de novo
+    (a incerteza fica limitada ao segundo da reconciliação)
+    """
+
+    thread_name = 'stats-flush'
+
+    def __init__(self, collection_getter, interval: float = None):
+        super().__init__(collection_getter, interval or float(os.getenv('STATS_FLUSH_INTERVAL', 10)))
+
+    def add(self, field: str, count: int = 1):
+        """Registra um incremento a ser gravado no próximo flush"""
+        self.put((field, int(time.time())), count)
+
+    def merge(self, older: int, newer: int) -> int:
+        return older + newer
+
+    def operations(self, pending: dict) -> list:
+        by_second = {}
+        for (field, second), count in pending.items():
+            if count:
+                by_second.setdefault(second, {})[field] = count
+        # Sem upsert: antes do documento existir, a primeira reconciliação conta tudo
+        return [
+            (tuple((field, second) for field in increments), UpdateOne(
+                {'_id': STATS_DOC_ID, 'reconciled_at': {'$lt': datetime.utcfromtimestamp(second)}},
+                {'$inc': increments}
+            ))
+            for second, increments in sorted(by_second.items())
+        ]
+
+
+# Contadores compartilhados pelo processo (gravados no encerramento por flush_all)
+stats_counters = StatsCounters(lambda: get_client().juridical_bot.stats)
+
+_snapshot_cache = TTLCache(maxsize=1, ttl=STATS_CACHE_TTL)
+_reconcile_lock = threading.Lock()
+
+
+def reconcile(db) -> dict:
+    """
+    Recalcula os contadores a partir das coleções (preferindo secundários)
+    Usa uma agregação por plano em vez de uma contagem por plano
+    'reconciled_at' marca o início da contagem: incrementos ainda não gravados
+    por outros processos e ocorridos antes dele são descartados no flush deles
+    """
+    with _reconcile_lock:
+        stats_counters.flush()
+        now = datetime.utcnow()
+        secondary = {'read_preference': ReadPreference.SECONDARY_PREFERRED}
+
+        plans = {}
+        for row in db.users.with_options(**secondary).aggregate([
+            {'$group': {'_id': '$subscription_plan', 'count': {'$sum': 1}}}
+        ]):
+            # Plano ausente/None e 'free' são o mesmo plano
+            plan = row['_id'] or 'free'
+            plans[plan] = plans.get(plan, 0) + row['count']
+        usage = list(db.user_usage.with_options(**secondary).aggregate([
+            {'$match': {'month': now.month, 'year': now.year}},
+            {'$group': {'_id': None, 'total_usage': {'$sum': '$count'}}}
+        ]))
+
+        values = {
+            'users_total': sum(plans.values()),
+            'plans': plans,
+            usage_field(now.month, now.year): usage[0]['total_usage'] if usage else 0,
+            'legal_documents': db.legal_documents.estimated_document_count(),
+            'reconciled_at': now
+        }
+        db.db.stats.update_one({'_id': STATS_DOC_ID}, {'$set': values}, upsert=True)
+        _snapshot_cache.clear()
+        logger.info(f"Estatísticas reconciliadas: {values['users_total']} usuários")
+        return values
+
+
+def get_snapshot(db) -> dict:
+    """
+    Estatísticas atuais a partir do documento de contadores (uma leitura, em cache)
+    Reconcilia com as coleções na primeira vez e a cada STATS_RECONCILE_INTERVAL
+    """
+    snapshot = _snapshot_cache.get('snapshot')
+    if snapshot is not None:
+        return snapshot
+
+    doc = db.db.stats.find_one({'_id': STATS_DOC_ID}) or {}
+    reconciled_at = doc.get('reconciled_at')
+    if reconciled_at is None or datetime.utcnow() - reconciled_at > timedelta(seconds=STATS_RECONCILE_INTERVAL):
+        reconcile(db)
+        doc = db.db.stats.find_one({'_id': STATS_DOC_ID}) or {}
+
+    now = datetime.utcnow()
+    snapshot = {
+        'users_total': doc.get('users_total', 0),
+        'plans': doc.get('plans', {}),
+        'monthly_usage': doc.get('usage', {}).get(f"{now.year}_{now.month:02d}", 0),
+        'legal_documents': doc.get('legal_documents', 0),
+        'reconciled_at': doc.get('reconciled_at')
+    }
+    _snapshot_cache.set('snapshot', snapshot)
+    return snapshot
@@ -0,0 +1,54 @@
+import os
+import logging
+from dataclasses import dataclass
+from pymongo import UpdateOne
+from .connection import get_client
+from .write_behind import WriteBehindBuffer
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class QuotaReservation:
+    """
+    Reserva de uma consulta na cota mensal
+    Para o plano free a reserva já foi contabilizada no banco (counted=True)
+    """
+    user_id: int
+    plan: str
+    month: int
+    year: int
+    counted: bool = False
+
+
+class UsageBuffer(WriteBehindBuffer):
+    """
+    Acumula incrementos de uso em memória e grava em lote (write-behind)
+    Usado para planos pagos, onde o contador não limita o acesso
+    """
+
+    thread_name = 'usage-flush'
+
+    def __init__(self, collection_getter, interval: float = None):
+        super().__init__(collection_getter, interval or float(os.getenv('USAGE_FLUSH_INTERVAL', 10)))
+
+    def add(self, user_id: int, month: int, year: int, count: int = 1):
+        """Registra um incremento a ser gravado no próximo flush"""
+        self.put((user_id, month, year), count)
+
+    def merge(self, older: int, newer: int) -> int:
+        return older + newer
+
+    def operations(self, pending: dict) -> list:
+        return [
+            ((key,), UpdateOne(
+                {'user_id': key[0], 'month': key[1], 'year': key[2]},
+                {'$inc': {'count': count}},
+                upsert=True
+            ))
+            for key, count in pending.items() if count
+        ]
+
+
+# Buffer compartilhado pelo processo (gravado no encerramento por flush_all)
+usage_buffer = UsageBuffer(lambda: get_client().juridical_bot.user_usage)
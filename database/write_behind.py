@@ -0,0 +1,160 @@
+import logging
+import threading
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+# Buffers do processo, gravados no encerramento por flush_all
+_buffers = []
+
+
+class WriteBehindBuffer:
+    """
+    Acumula alterações em memória por chave e grava em lote (write-behind)
+    com um único bulk_write, por uma thread de fundo a cada `interval` segundos
+
+    Subclasses definem:
+    - `merge(older, newer)`: combina dois valores da mesma chave (soma para
+      contadores, o mais novo para documentos)
+    - `operations(pending)`: lista de (chaves, operação) para o bulk_write
+
+    Em falha parcial (BulkWriteError) voltam para a fila apenas as chaves das
+    operações que falharam; nas demais falhas volta tudo.
+    """
+
+    thread_name = 'write-behind'
+
+    def __init__(self, collection_getter, interval: float):
+        self._collection_getter = collection_getter
+        self.interval = interval
+        self._pending = {}
+        # Lotes retirados da fila e ainda não confirmados pelo banco (mais antigo primeiro)
+        self._inflight = []
+        # Incrementado a cada gravação concluída (permite detectar flush durante uma leitura)
+        self.generation = 0
+        # Reentrante: subclasses podem chamar put() segurando o lock
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+        _buffers.append(self)
+
+    def merge(self, older, newer):
+        raise NotImplementedError
+
+    def operations(self, pending: dict) -> list:
+        raise NotImplementedError
+
+    def prepare(self, collection):
+        """Executado antes de cada gravação (ex: criação de índices)"""
+
+    def put(self, key, value):
+        """Registra uma alteração a ser gravada no próximo flush"""
+        with self._lock:
+            if key in self._pending:
+                value = self.merge(self._pending[key], value)
+            self._pending[key] = value
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Erro na gravação em lote ({self.thread_name}): {e}")
+
+    def _take(self, select=None) -> dict:
+        with self._lock:
+            if select is None:
+                pending, self._pending = self._pending, {}
+            else:
+                keys = [key for key, value in self._pending.items() if select(key, value)]
+                pending = {key: self._pending.pop(key) for key in keys}
+            if pending:
+                self._inflight.append(pending)
+            return pending
+
+    def _settle(self, pending: dict):
+        """Encerra a gravação do lote (com o lock)"""
+        self._inflight = [batch for batch in self._inflight if batch is not pending]
+        self.generation += 1
+
+    def unsaved(self, select) -> dict:
+        """
+        Alterações ainda não confirmadas pelo banco (em gravação ou na fila)
+        aceitas por `select(chave, valor)`, da mais antiga para a mais nova
+        """
+        items = {}
+        with self._lock:
+            for batch in self._inflight + [self._pending]:
+                for key, value in batch.items():
+                    if select(key, value):
+                        items[key] = self.merge(items[key], value) if key in items else value
+        return items
+
+    def _requeue(self, items: dict):
+        """Devolve alterações não gravadas, combinando com as que chegaram depois"""
+        with self._lock:
+            for key, value in items.items():
+                if key in self._pending:
+                    value = self.merge(value, self._pending[key])
+                self._pending[key] = value
+
+    def flush(self, select=None) -> int:
+        """
+        Grava as alterações pendentes com um único bulk_write
+        `select(chave, valor)`, se informado, limita a gravação às alterações aceitas
+        """
+        pending = self._take(select)
+        if not pending:
+            return 0
+
+        batch = self.operations(pending)
+        if not batch:
+            with self._lock:
+                self._settle(pending)
+            return 0
+        try:
+            collection = self._collection_getter()
+            self.prepare(collection)
+            collection.bulk_write([operation for _, operation in batch], ordered=False)
+        except BulkWriteError as e:
+            failed = {error['index'] for error in e.details.get('writeErrors', [])}
+            with self._lock:
+                self._requeue({
+                    key: pending[key]
+                    for index, (keys, _) in enumerate(batch) if index in failed
+                    for key in keys
+                })
+                self._settle(pending)
+            raise
+        except Exception:
+            with self._lock:
+                self._requeue(pending)
+                self._settle(pending)
+            raise
+        with self._lock:
+            self._settle(pending)
+        return len(batch)
+
+    def stop(self):
+        """Interrompe a thread de flush e grava o que estiver pendente"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval)
+        self.flush()
+
+
+def flush_all():
+    """Grava todos os buffers do processo - chamado no encerramento"""
+    for buffer in _buffers:
+        try:
+            buffer.stop()
+        except Exception as e:
+            logger.error(f"Erro ao gravar {buffer.thread_name} no encerramento: {e}")
@@ -0,0 +1,252 @@
+"""
+Importação em lote da base legal (leis, jurisprudências, doutrinas)
+
+Lê arquivos JSONL, CSV ou XML registro a registro, sem carregar o arquivo em
+memória, e grava em lotes com insert_many. Documentos repetidos são ignorados
+pelo hash do conteúdo (índice único em content_hash) e o progresso é salvo na
+coleção import_jobs, permitindo retomar uma importação interrompida.
+
+Uso:
+    python -m legal_database.importer clt.jsonl --type lei --tags trabalhista
+"""
+import os
+import csv
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+from datetime import datetime
+from xml.etree.ElementTree import iterparse
+from pymongo.errors import BulkWriteError
+from database.stats import stats_counters
+from .passages import PassageStore
+from .text_analysis import normalize
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 500))
+
+# Tags XML aceitas como registro quando nenhuma é informada
+XML_RECORD_TAGS = ('document', 'documento', 'lei', 'artigo', 'jurisprudencia')
+
+csv.field_size_limit(sys.maxsize)
+
+
+def iter_jsonl(path: str, **kwargs):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_csv(path: str, **kwargs):
+    with open(path, encoding='utf-8', newline='') as f:
+        yield from csv.DictReader(f)
+
+
+def iter_xml(path: str, record_tag: str = None, **kwargs):
+    """Cada elemento de registro vira um dict com o texto dos filhos; o elemento é liberado em seguida"""
+    tags = (record_tag,) if record_tag else XML_RECORD_TAGS
+    depth = 0
+    for event, element in iterparse(path, events=('start', 'end')):
+        if event == 'start':
+            if element.tag in tags:
+                depth += 1
+            continue
+        if element.tag not in tags:
+            continue
+        depth -= 1
+        if depth == 0:
+            record = {child.tag: (child.text or '').strip() for child in element}
+            record.update(element.attrib)
+            element.clear()
+            yield record
+
+
+READERS = {
+    'jsonl': iter_jsonl,
+    'csv': iter_csv,
+    'xml': iter_xml,
+}
+
+
+def content_hash(title: str, content: str) -> str:
+    """Hash do texto normalizado: a mesma lei com outra formatação é considerada repetida"""
+    return hashlib.sha256(f"{normalize(title)}|{normalize(content)}".encode('utf-8')).hexdigest()
+
+
+def to_document(record: dict, doc_type: str = None, tags: list = None):
+    """Converte um registro lido do arquivo em documento da coleção legal_documents"""
+    title = (record.get('title') or record.get('titulo') or '').strip()
+    content = (record.get('content') or record.get('conteudo') or record.get('texto') or '').strip()
+    if not content:
+        return None
+    record_tags = record.get('tags') or []
+    if isinstance(record_tags, str):
+        record_tags = [tag.strip() for tag in record_tags.replace(';', ',').split(',') if tag.strip()]
+    return {
+        'title': title,
+        'content': content,
+        'type': record.get('type') or record.get('tipo') or doc_type,
+        'tags': list(dict.fromkeys(list(record_tags) + (tags or []))),
+        'source': record.get('source') or record.get('fonte'),
+        'content_hash': content_hash(title, content),
+        'added_date': datetime.utcnow()
+    }
+
+
+class CorpusImporter:
+    """Importa arquivos da base legal em lotes, com deduplicação e checkpoints"""
+
+    def __init__(self, db, batch_size: int = None, progress_interval: float = 5.0):
+        self.db = db
+        self.batch_size = batch_size or IMPORT_BATCH_SIZE
+        self.progress_interval = progress_interval
+        self.passages = PassageStore(db)
+
+    @property
+    def jobs(self):
+        return self.db.db.import_jobs
+
+    def ensure_indexes(self):
+        self.db.legal_documents.create_index(
+            'content_hash', unique=True,
+            partialFilterExpression={'content_hash': {'$type': 'string'}}
+        )
+
+    @staticmethod
+    def job_id(path: str) -> str:
+        """Identifica o arquivo pelo caminho, tamanho e data de modificação"""
+        stat = os.stat(path)
+        key = f"{os.path.abspath(path)}|{stat.st_size}|{int(stat.st_mtime)}"
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _write_batch(self, docs: list) -> tuple:
+        """Grava um lote; retorna (inseridos, repetidos)"""
+        try:
+            self.db.legal_documents.insert_many(docs, ordered=False)
+            inserted = docs
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            if any(error.get('code') != 11000 for error in errors):
+                raise
+            failed = {error['index'] for error in errors}
+            inserted = [doc for i, doc in enumerate(docs) if i not in failed]
+        if inserted:
+            self.passages.save_many(inserted)
+            stats_counters.add('legal_documents', len(inserted))
+        return len(inserted), len(docs) - len(inserted)
+
+    def _checkpoint(self, job_id: str, stats: dict, status: str = 'running'):
+        self.jobs.update_one(
+            {'_id': job_id},
+            {'$set': {**stats, 'status': status, 'updated_at': datetime.utcnow()}},
+            upsert=True
+        )
+
+    def run(self, path: str, fmt: str = None, doc_type: str = None, tags: list = None,
+            record_tag: str = None, progress=None) -> dict:
+        """
+        Importa o arquivo e retorna as estatísticas da importação
+        Se uma importação anterior do mesmo arquivo foi interrompida, continua
+        a partir do último lote gravado. `progress(stats)` é chamado periodicamente
+        """
+        fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+        reader = READERS.get(fmt)
+        if reader is None:
+            raise ValueError(f"Formato não suportado: {fmt} (use jsonl, csv ou xml)")
+
+        self.ensure_indexes()
+        job_id = self.job_id(path)
+        job = self.jobs.find_one({'_id': job_id}) or {}
+        if job.get('status') == 'done':
+            logger.info(f"Arquivo já importado: {path}")
+            return job
+
+        stats = {
+            'path': path,
+            'processed': job.get('processed', 0),
+            'inserted': job.get('inserted', 0),
+            'duplicates': job.get('duplicates', 0),
+            'invalid': job.get('invalid', 0),
+            'rate': 0.0
+        }
+        skip = stats['processed']
+        if skip:
+            logger.info(f"Retomando importação de {path} a partir do registro {skip}")
+
+        started = time.monotonic()
+        last_report = started
+        read_now = 0
+        batch = []
+        invalid = 0
+
+        def flush():
+            nonlocal invalid
+            inserted, duplicates = self._write_batch(batch) if batch else (0, 0)
+            stats['inserted'] += inserted
+            stats['duplicates'] += duplicates
+            stats['invalid'] += invalid
+            stats['processed'] += len(batch) + invalid
+            stats['rate'] = (read_now - skip) / max(time.monotonic() - started, 1e-9)
+            batch.clear()
+            invalid = 0
+            self._checkpoint(job_id, stats)
+
+        for read_now, record in enumerate(reader(path, record_tag=record_tag), 1):
+            if read_now <= skip:
+                continue
+            doc = to_document(record, doc_type, tags)
+            if doc is None:
+                invalid += 1
+            else:
+                batch.append(doc)
+            if len(batch) >= self.batch_size:
+                flush()
+                if progress and time.monotonic() - last_report >= self.progress_interval:
+                    last_report = time.monotonic()
+                    progress(dict(stats))
+        flush()
+
+        if stats['inserted']:
+            from .legal_analyzer import bump_corpus_version
+            bump_corpus_version(self.db)
+        stats['elapsed'] = time.monotonic() - started
+        self._checkpoint(job_id, stats, status='done')
+        logger.info(
+            f"Importação de {path} concluída: {stats['inserted']} inseridos, "
+            f"{stats['duplicates']} repetidos, {stats['invalid']} inválidos "
+            f"em {stats['elapsed']:.1f}s ({stats['rate']:.0f} registros/s)"
+        )
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=sorted(READERS))
+    parser.add_argument('--type', help='tipo padrão dos documentos (lei, jurisprudencia, doutrina...)')
+    parser.add_argument('--tags', default='', help='tags adicionadas a todos os documentos, separadas por vírgula')
+    parser.add_argument('--record-tag', help='tag dos registros em arquivos XML')
+    parser.add_argument('--batch-size', type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    from database.operations import DatabaseManager
+    importer = CorpusImporter(DatabaseManager(), batch_size=args.batch_size)
+    importer.run(
+        args.path, args.format, args.type,
+        [tag.strip() for tag in args.tags.split(',') if tag.strip()],
+        args.record_tag,
+        progress=lambda stats: logger.info(
+            f"{stats['processed']} registros ({stats['rate']:.0f}/s), "
+            f"{stats['inserted']} inseridos, {stats['duplicates']} repetidos"
+        )
+    )
+    stats_counters.stop()
+
+
+if __name__ == '__main__':
+    main()
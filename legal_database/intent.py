@@ -0,0 +1,142 @@
+import os
+import re
+import json
+import logging
+import unicodedata
+from .text_analysis import fold_accents
+
+logger = logging.getLogger(__name__)
+
+# Palavras-chave (sem acento) e pesos; termos ambíguos têm peso menor e
+# expressões do uso cotidiano recebem peso negativo para evitar falsos positivos
+DEFAULT_KEYWORDS = {
+    # Termos fortes
+    'juridico': 1.0, 'juridica': 1.0, 'advogado': 1.0, 'advogada': 1.0, 'jurisprudencia': 1.0,
+    'trabalhista': 1.0, 'penal': 1.0, 'penais': 1.0, 'clt': 1.0, 'codigo civil': 1.0,
+    'codigo penal': 1.0, 'constituicao': 1.0, 'inconstitucional': 1.0, 'stf': 1.0, 'stj': 1.0,
+    'habeas corpus': 1.0, 'pensao alimenticia': 1.0, 'usucapiao': 1.0, 'inventario': 0.8,
+    'rescisao': 1.0, 'rescisorias': 1.0, 'aviso previo': 1.0, 'justa causa': 1.0,
+    'fgts': 1.0, 'indenizacao': 1.0, 'danos morais': 1.0, 'dano moral': 1.0,
+    'peticao inicial': 1.0, 'liminar': 1.0, 'prescricao': 1.0, 'decadencia': 1.0,
+    'crime': 1.0, 'estelionato': 1.0, 'procon': 1.0, 'codigo de defesa do consumidor': 1.0,
+    'lei': 1.0, 'direito': 0.8, 'artigo': 0.6, 'art': 0.6,
+    # Termos ambíguos (precisam de outro indício)
+    'processo': 0.5, 'recurso': 0.5, 'contrato': 0.5, 'multa': 0.5, 'prazo': 0.4,
+    'juiz': 0.7, 'tribunal': 0.8, 'sentenca': 0.7, 'audiencia': 0.7, 'divorcio': 0.8,
+    'heranca': 0.8, 'guarda': 0.3, 'demissao': 0.6, 'demitido': 0.6, 'aluguel': 0.4,
+    'locacao': 0.6, 'despejo': 0.8, 'ferias': 0.3, 'salario': 0.3, 'posso processar': 1.0,
+    # Uso cotidiano
+    'processo seletivo': -1.0, 'recursos humanos': -0.5, 'direito de resposta': 0.0,
+    'lei de murphy': -1.0, 'lei da atracao': -1.0, 'multa do netflix': -0.5,
+}
+
+INTENT_THRESHOLD = float(os.getenv('INTENT_THRESHOLD', 1.0))
+
+
+def _fold(text: str) -> bytes:
+    """
+    Versão rápida de fold_accents para o caminho quente, já em bytes ASCII:
+    caracteres que não viram ASCII após a decomposição (emoji, outros
+    alfabetos) são descartados
+    """
+    text = text.lower()
+    if text.isascii():
+        return text.encode('ascii')
+    return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore')
+
+
+# Separação em palavras do texto já sem acento (ASCII): bytes fora de \w viram espaço
+_WORD_BYTES = bytes(b if chr(b).isalnum() or b == ord('_') else ord(' ') for b in range(128)) + b' ' * 128
+
+
+def _trie_pattern(phrases) -> str:
+    """
+    Converte as expressões em uma expressão regular em forma de trie
+    ('lei', 'lei de murphy' -> 'lei(?:\\s+de\\s+murphy)?'), casando sempre a mais longa
+    """
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for ch in phrase:
+            node = node.setdefault(ch, {})
+        node[''] = True
+
+    def build(node) -> str:
+        end = '' in node
+        branches = [
+            (r'\s+' if ch == ' ' else re.escape(ch)) + build(child)
+            for ch, child in sorted(node.items()) if ch
+        ]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{body})?' if end else body
+
+    return build(trie)
+
+
+class LegalIntentClassifier:
+    """
+    Classificador de intenção jurídica para mensagens de texto livre
+    Todas as palavras-chave são compiladas em uma única expressão (trie) e
+    casadas em uma passada sobre o texto sem acentos; a pontuação é a soma
+    dos pesos das expressões distintas encontradas
+    A maioria das mensagens não é jurídica: antes da expressão, um teste de
+    conjunto descarta os textos sem nenhuma palavra que inicie uma expressão
+    """
+
+    def __init__(self, keywords: dict = None, threshold: float = None):
+        self.keywords = {}
+        self.threshold = INTENT_THRESHOLD if threshold is None else threshold
+        self._pattern = None
+        self._first_words = frozenset()
+        self.update(DEFAULT_KEYWORDS if keywords is None else keywords)
+
+    def update(self, keywords: dict):
+        """Adiciona ou altera palavras-chave (pesos) e recompila a expressão"""
+        for phrase, weight in keywords.items():
+            self.keywords[' '.join(fold_accents(phrase).split())] = float(weight)
+        # Plural simples ('leis', 'contratos') aceito sem entrada própria no dicionário
+        pattern = r'\b(' + _trie_pattern(self.keywords) + r')(?:e?s)?\b'
+        self._pattern = re.compile(pattern.encode('ascii'))
+        # Palavras (com o plural, se for a expressão inteira) que iniciam alguma expressão
+        first_words = set()
+        for phrase in self.keywords:
+            word = phrase.split()[0]
+            first_words.update((word, word + 's', word + 'es') if word == phrase else (word,))
+        self._first_words = frozenset(word.encode('ascii') for word in first_words)
+
+    def load(self, path: str):
+        """Carrega um dicionário adicional em JSON ({"expressão": peso})"""
+        with open(path, encoding='utf-8') as f:
+            self.update(json.load(f))
+        logger.info(f"Dicionário de intenção carregado de {path} ({len(self.keywords)} expressões)")
+
+    def matches(self, text: str) -> set:
+        """Expressões encontradas no texto"""
+        text = _fold(text)
+        if self._first_words.isdisjoint(text.translate(_WORD_BYTES).split()):
+            return set()
+        return {' '.join(phrase.decode('ascii').split()) for phrase in self._pattern.findall(text)}
+
+    def score(self, text: str) -> float:
+        return sum(self.keywords[phrase] for phrase in self.matches(text))
+
+    def is_legal(self, text: str) -> bool:
+        """Indica se a mensagem deve ser tratada como consulta jurídica"""
+        return self.score(text) >= self.threshold
+
+
+_classifier = None
+
+
+def get_intent_classifier() -> LegalIntentClassifier:
+    """Classificador compartilhado (com o dicionário extra de INTENT_KEYWORDS_PATH, se definido)"""
+    global _classifier
+    if _classifier is None:
+        classifier = LegalIntentClassifier()
+        path = os.getenv('INTENT_KEYWORDS_PATH')
+        if path:
+            classifier.load(path)
+        _classifier = classifier
+    return _classifier
@@ -1,50 +1,289 @@
 import os
+import time
+import asyncio
+import hashlib
 import logging
-from pymongo import MongoClient
+import threading
+from datetime import datetime
+from pymongo import ReturnDocument
 from database.operations import DatabaseManager
-import google.generativeai as genai
+from database.connection import run_in_executor
+from database.cache_store import PersistentCache
+from database.stats import stats_counters
+from utils.cache import TTLCache
+from utils.metrics import register_cache
+from utils.llm_executor import get_llm_executor
+from utils.llm_backends import get_llm_backend
+from utils.singleflight import SingleFlight
+from utils.chunking import estimate_tokens
+from utils.tracing import span
+from .search_index import BM25Index
+from .text_analysis import normalize
+from .passages import PassageStore
 
 logger = logging.getLogger(__name__)
 
+# Campos carregados da coleção legal_passages para o índice local
+INDEX_PROJECTION = {
+    'doc_id': 1, 'title': 1, 'heading': 1, 'text': 1, 'tokens': 1, 'type': 1, 'tags': 1, 'indexed_seq': 1
+}
+
+# Modos de busca: 'lexical' (BM25), 'vector' (similaridade densa) ou 'hybrid'
+SEARCH_MODES = ('lexical', 'vector', 'hybrid')
+
+
+class LegalAnalysisError(Exception):
+    """Falha ao gerar a resposta (o chamador deve devolver a consulta reservada)"""
+
+# Cache de respostas compartilhado pelo processo
+answer_cache = PersistentCache(
+    'answer_cache',
+    maxsize=int(os.getenv('ANSWER_CACHE_SIZE', 5000)),
+    ttl=float(os.getenv('ANSWER_CACHE_TTL', 7 * 24 * 3600)),
+    memory_ttl=float(os.getenv('ANSWER_CACHE_MEMORY_TTL', 3600))
+)
+register_cache('answers', answer_cache)
+
+# Consultas idênticas em andamento compartilham a mesma chamada ao modelo
+consultations = SingleFlight()
+
+# Versão da base legal, relida periodicamente (alterada por add_legal_document)
+_corpus_version_cache = TTLCache(maxsize=1, ttl=float(os.getenv('LEGAL_CORPUS_VERSION_TTL', 30)))
+
+def bump_corpus_version(db) -> int:
+    """Incrementa a versão da base legal (documento 'legal_corpus' da coleção meta)"""
+    meta = db.db.meta.find_one_and_update(
+        {'_id': 'legal_corpus'},
+        {'$inc': {'version': 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    _corpus_version_cache.set('version', meta['version'])
+    return meta['version']
+
+
 class LegalAnalyzer:
     def __init__(self):
         self.db = DatabaseManager()
-        genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
-        self.model = genai.GenerativeModel('gemini-pro')
+        self.backend = get_llm_backend()
+        self.passages = PassageStore(self.db)
+        
+        # Orçamento de tokens do contexto legal enviado ao modelo
+        self.context_token_budget = int(os.getenv('LEGAL_CONTEXT_TOKEN_BUDGET', 1200))
+        self.context_candidates = int(os.getenv('LEGAL_CONTEXT_CANDIDATES', 20))
+        
+        # Índice BM25 local sobre os trechos (artigos/parágrafos) da base legal
+        self.index = BM25Index()
+        self.index_refresh_interval = float(os.getenv('LEGAL_INDEX_REFRESH_SECONDS', 60))
+        self._index_lock = threading.Lock()
+        self._index_loaded_at = None
+        # Sequência (indexed_seq) até a qual todos os trechos já estão no índice,
+        # e os trechos acima dela já indexados (fora de ordem)
+        self._indexed_seq = None
+        self._indexed_ahead = set()
+        self._sequence_gap_since = None
+        self.sequence_gap_timeout = float(os.getenv('LEGAL_INDEX_GAP_TIMEOUT', 300))
+        
+        # Índice vetorial opcional (matriz float32, persistida em LEGAL_VECTOR_PATH)
+        self.search_mode = os.getenv('LEGAL_SEARCH_MODE', 'lexical')
+        if self.search_mode not in SEARCH_MODES:
+            raise ValueError(f"LEGAL_SEARCH_MODE inválido: {self.search_mode}")
+        self.hybrid_alpha = float(os.getenv('LEGAL_HYBRID_ALPHA', 0.5))
+        self.vector_path = os.getenv('LEGAL_VECTOR_PATH')
+        self.vectors = None
 
-    def search_legal_references(self, query: str, max_results: int = 5):
-        """Busca referências legais na base de dados"""
-        # Busca textual simples (em produção, usar índice de texto completo)
-        results = self.db.legal_documents.find(
-            {"$text": {"$search": query}},
-            {"score": {"$meta": "textScore"}}
-        ).sort([("score", {"$meta": "textScore"})]).limit(max_results)
+    def _load_vectors(self):
+        """Cria o índice vetorial (NumPy importado apenas quando o modo de busca o utiliza)"""
+        from .vector_index import VectorIndex
+        self.vectors = VectorIndex()
+        if self.vector_path and self.vectors.load(self.vector_path):
+            logger.info(f"Índice vetorial carregado de {self.vector_path} ({len(self.vectors)} vetores)")
 
-        return list(results)
+    def index_is_stale(self) -> bool:
+        """Indica se o índice precisa ser carregado ou atualizado"""
+        if self._index_loaded_at is None:
+            return True
+        return time.monotonic() - self._index_loaded_at > self.index_refresh_interval
 
-    async def analyze_with_legal_context(self, question: str, user_id: int) -> str:
-        """Analisa questão jurídica com contexto da base legal"""
+    def refresh_index(self):
+        """
+        Carrega no índice os trechos ainda não indexados
+        Na primeira chamada indexa toda a coleção (gerando trechos de documentos
+        antigos); depois, apenas os novos (inseridos por outros workers), pela
+        sequência 'indexed_seq' atribuída na gravação
+        """
+        with self._index_lock:
+            if not self.index_is_stale():
+                return
+            if self._indexed_seq is None:
+                if self.search_mode != 'lexical':
+                    self._load_vectors()
+                self.passages.backfill()
+                query = {}
+            else:
+                query = {'indexed_seq': {'$gt': self._indexed_seq}}
+            cursor = self.passages.collection.find(query, INDEX_PROJECTION).sort('indexed_seq', 1)
+            added = 0
+            pending_vectors = []
+            for passage in cursor:
+                seq = passage.get('indexed_seq')
+                if seq in self._indexed_ahead:
+                    continue
+                self._index_passage(passage, encode=False)
+                if self.vectors is not None and passage['_id'] not in self.vectors:
+                    pending_vectors.append(passage)
+                    if len(pending_vectors) >= 256:
+                        self._encode_passages(pending_vectors)
+                        pending_vectors = []
+                if seq is not None:
+                    self._indexed_ahead.add(seq)
+                added += 1
+            if pending_vectors:
+                self._encode_passages(pending_vectors)
+            self._advance_sequence()
+            self._index_loaded_at = time.monotonic()
+            if added:
+                logger.info(f"Índice legal atualizado: +{added} trechos ({len(self.index)} no total)")
+                if self.vectors is not None and self.vector_path:
+                    self.vectors.save(self.vector_path)
+
+    def _advance_sequence(self):
+        """
+        Avança a sequência indexada enquanto não há lacunas
+        Uma lacuna é um número reservado por outro worker e ainda não gravado
+        (os trechos acima dela já são lidos e indexados); depois de
+        sequence_gap_timeout ela é dada como perdida (ex: trecho duplicado)
+        """
+        if self._indexed_seq is None:
+            self._indexed_seq = 0
+        while True:
+            while self._indexed_seq + 1 in self._indexed_ahead:
+                self._indexed_seq += 1
+                self._indexed_ahead.discard(self._indexed_seq)
+                self._sequence_gap_since = None
+            if not self._indexed_ahead:
+                self._sequence_gap_since = None
+                return
+            now = time.monotonic()
+            if self._sequence_gap_since is None:
+                self._sequence_gap_since = now
+            if now - self._sequence_gap_since < self.sequence_gap_timeout:
+                return
+            logger.warning(f"Trechos {self._indexed_seq + 1}-{min(self._indexed_ahead) - 1} não encontrados; ignorados")
+            self._indexed_seq = min(self._indexed_ahead) - 1
+
+    def _index_passage(self, passage: dict, encode: bool = True):
+        self.index.add(
+            passage['_id'], passage.get('title', ''), passage.get('text', ''),
+            doc_id=passage.get('doc_id'), heading=passage.get('heading', ''),
+            tokens=passage.get('tokens', 0), type=passage.get('type'), tags=passage.get('tags', [])
+        )
+        if encode and self.vectors is not None:
+            self._encode_passages([passage])
+
+    def _encode_passages(self, passages: list):
+        self.vectors.add_many(
+            [passage['_id'] for passage in passages],
+            [f"{passage.get('title', '')}\n{passage.get('text', '')}" for passage in passages]
+        )
+
+    def search_legal_references(self, query: str, max_results: int = 5, mode: str = None):
+        """Busca trechos da base legal nos índices locais (BM25, vetorial ou híbrido)"""
+        if self.index_is_stale():
+            self.refresh_index()
+        
+        mode = mode or self.search_mode
+        if mode == 'lexical' or self.vectors is None:
+            return self.index.search(query, max_results)
+        
+        if mode == 'vector':
+            return self.index.documents_for(self.vectors.search(query, max_results))
+        
+        # Híbrido: combina BM25 normalizado e similaridade de cosseno
+        candidates = max_results * 4
+        lexical = self.index.score(query)
+        lexical_max = max(lexical.values(), default=0.0) or 1.0
+        fused = {
+            doc_id: (1 - self.hybrid_alpha) * score / lexical_max
+            for doc_id, score in lexical.items()
+        }
+        for doc_id, similarity in self.vectors.search(query, candidates):
+            fused[doc_id] = fused.get(doc_id, 0.0) + self.hybrid_alpha * similarity
+        
+        top = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:max_results]
+        return self.index.documents_for(top)
+
+    def corpus_version(self) -> int:
+        """Versão atual da base legal (muda a cada documento adicionado)"""
+        version = _corpus_version_cache.get('version')
+        if version is None:
+            meta = self.db.db.meta.find_one({'_id': 'legal_corpus'})
+            version = meta.get('version', 0) if meta else 0
+            _corpus_version_cache.set('version', version)
+        return version
+
+    def bump_corpus_version(self) -> int:
+        """Incrementa a versão da base legal, invalidando respostas em cache"""
+        return bump_corpus_version(self.db)
+
+    @staticmethod
+    def plan_tier(user_plan: str) -> str:
+        """Usuários free recebem contexto reduzido, logo outra resposta"""
+        return 'free' if user_plan == 'free' else 'full'
+
+    def answer_cache_key(self, question: str, user_plan: str, version: int) -> str:
+        """Chave do cache: pergunta normalizada + nível do plano + versão da base"""
+        raw = f"{version}|{self.plan_tier(user_plan)}|{normalize(question)}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    async def resolve_cache_key(self, question: str, user_id: int):
+        """Obtém o plano do usuário e a chave da resposta no cache"""
         # Verificar assinatura para acesso à base legal completa
-        user_plan = self.db.get_user_plan(user_id)
+        user_plan = await self.db.get_user_plan_async(user_id)
         
+        version = _corpus_version_cache.get('version')
+        if version is None:
+            version = await run_in_executor(self.corpus_version)
+        return user_plan, self.answer_cache_key(question, user_plan, version)
+
+    @staticmethod
+    def assemble_context(legal_refs: list, token_budget: int) -> str:
+        """
+        Monta o contexto legal com os trechos de maior score que cabem no orçamento
+        Trechos que não cabem são pulados; os seguintes (menores) ainda podem entrar
+        """
+        if not legal_refs:
+            return ""
+        parts = ["Referências Legais Encontradas:"]
+        used = 0
+        for ref in legal_refs:
+            tokens = ref.get('tokens') or estimate_tokens(ref['content'])
+            tokens += estimate_tokens(ref['title']) + 4
+            if used + tokens > token_budget:
+                continue
+            parts.append(f"- {ref['title']}:\n{ref['content']}\n")
+            used += tokens
+        return '\n'.join(parts) + '\n'
+
+    async def build_prompt(self, question: str, user_plan: str) -> str:
+        """Busca as referências relevantes e monta o prompt"""
         # Buscar referências relevantes
-        legal_refs = self.search_legal_references(question)
+        with span('retrieval'):
+            if self.index_is_stale():
+                await run_in_executor(self.refresh_index)
+            legal_refs = self.search_legal_references(question, self.context_candidates)
         
-        # Construir contexto legal
-        legal_context = ""
-        if legal_refs:
-            legal_context = "Referências Legais Encontradas:\n"
-            for ref in legal_refs:
-                legal_context += f"- {ref['title']}: {ref['content'][:200]}...\n\n"
-
-        # Se usuário free, limitar contexto
-        if user_plan == 'free' and len(legal_refs) > 2:
-            legal_context = "Referências Legais (limitadas no plano Free):\n"
-            for ref in legal_refs[:2]:
-                legal_context += f"- {ref['title']}\n"
-            legal_context += "\n*Assine o Premium para acesso completo à base legal.*\n\n"
-
-        prompt = f"""
+        with span('prompt_build'):
+            # Se usuário free, limitar contexto
+            if user_plan == 'free' and len(legal_refs) > 2:
+                titles = list(dict.fromkeys(ref['title'] for ref in legal_refs))[:2]
+                legal_context = "Referências Legais (limitadas no plano Free):\n"
+                legal_context += ''.join(f"- {title}\n" for title in titles)
+                legal_context += "\n*Assine o Premium para acesso completo à base legal.*\n\n"
+            else:
+                legal_context = self.assemble_context(legal_refs, self.context_token_budget)
+
+        return f"""
         Você é um assistente jurídico especializado em direito brasileiro.
         Use o contexto legal abaixo para responder à questão do usuário.
 
@@ -60,22 +299,104 @@ class LegalAnalyzer:
         Mantenha a resposta em português e estruturada.
         """
 
+    async def _store_answer(self, cache_key: str, answer: str):
+        try:
+            await answer_cache.set_async(cache_key, answer)
+        except Exception as e:
+            logger.warning(f"Falha ao gravar resposta no cache: {e}")
+
+    async def _generate_answer(self, question: str, user_plan: str, cache_key: str) -> str:
+        prompt = await self.build_prompt(question, user_plan)
+        answer = await get_llm_executor().generate(self.backend, prompt)
+        await self._store_answer(cache_key, answer)
+        return answer
+
+    async def analyze_with_legal_context(self, question: str, user_id: int) -> str:
+        """Analisa questão jurídica com contexto da base legal"""
+        with span('answer_cache'):
+            user_plan, cache_key = await self.resolve_cache_key(question, user_id)
+            
+            # Resposta em cache para a mesma pergunta, plano e versão da base
+            cached = await answer_cache.get_async(cache_key)
+        if cached is not None:
+            return cached
+        
+        # Perguntas idênticas simultâneas aguardam a mesma geração
         try:
-            response = self.model.generate_content(prompt)
-            return response.text
+            return await consultations.do(
+                cache_key, lambda: self._generate_answer(question, user_plan, cache_key)
+            )
         except Exception as e:
             logger.error(f"Erro na análise legal: {e}")
-            return "Erro na consulta à base legal. Tente novamente."
+            raise LegalAnalysisError(str(e)) from e
+
+    async def stream_with_legal_context(self, question: str, user_id: int):
+        """
+        Variante em streaming de `analyze_with_legal_context`
+        Entrega os trechos da resposta conforme o modelo os gera; em caso de
+        falha (mesmo após trechos já entregues) lança LegalAnalysisError
+        """
+        with span('answer_cache'):
+            user_plan, cache_key = await self.resolve_cache_key(question, user_id)
+            cached = await answer_cache.get_async(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
+        # Se a mesma pergunta já está sendo respondida, aguardar a resposta completa
+        in_flight = consultations.in_flight(cache_key)
+        if in_flight is not None:
+            consultations.coalesced += 1
+            try:
+                answer = await asyncio.shield(in_flight)
+            except Exception as e:
+                logger.error(f"Erro na análise legal: {e}")
+                raise LegalAnalysisError(str(e)) from e
+            yield answer
+            return
+        
+        shared = consultations.begin(cache_key)
+        parts = []
+        try:
+            prompt = await self.build_prompt(question, user_plan)
+            async for text in get_llm_executor().stream_generate(self.backend, prompt):
+                parts.append(text)
+                yield text
+            answer = ''.join(parts)
+            shared.set_result(answer)
+        except Exception as e:
+            logger.error(f"Erro na análise legal (streaming): {e}")
+            shared.set_exception(e)
+            raise LegalAnalysisError(str(e)) from e
+        finally:
+            # Consumidor abandonou o streaming: liberar quem aguardava a resposta
+            if not shared.done():
+                shared.set_exception(RuntimeError("Consulta interrompida"))
+        
+        await self._store_answer(cache_key, answer)
 
     def add_legal_document(self, title: str, content: str, doc_type: str, tags: list):
         """Adiciona documento à base legal"""
-        self.db.legal_documents.insert_one({
+        doc = {
             'title': title,
             'content': content,
             'type': doc_type,  # lei, jurisprudencia, doutrina, etc.
             'tags': tags,
             'added_date': datetime.utcnow()
-        })
+        }
+        result = self.db.legal_documents.insert_one(doc)
+        stats_counters.add('legal_documents')
+        
+        # Divisão em trechos e atualização incremental do índice local
+        passages = self.passages.save(doc)
+        for passage in passages:
+            self._index_passage(passage)
+        with self._index_lock:
+            if self._indexed_seq is not None:
+                # Já indexados aqui: o próximo refresh não precisa relê-los
+                self._indexed_ahead.update(passage['indexed_seq'] for passage in passages)
+        self.bump_corpus_version()
+        return result.inserted_id
 
     def get_legal_document(self, doc_id: str):
         """Recupera documento legal por ID"""
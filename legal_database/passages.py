@@ -0,0 +1,106 @@
+import os
+import logging
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from utils.chunking import split_legal_units, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+PASSAGE_MAX_TOKENS = int(os.getenv('LEGAL_PASSAGE_MAX_TOKENS', 300))
+
+# Documento da coleção meta com o último número de sequência atribuído a um trecho
+PASSAGE_SEQUENCE_ID = 'legal_passages'
+
+
+def build_passages(doc: dict) -> list:
+    """
+    Divide um documento legal em trechos (artigos/parágrafos) com tokens pré-calculados
+    O _id do trecho é determinístico ('<doc_id>:<ordem>'), o que torna a gravação idempotente
+    """
+    passages = []
+    for ordinal, text in enumerate(split_legal_units(doc.get('content', ''), PASSAGE_MAX_TOKENS)):
+        heading = text.split('\n', 1)[0][:80]
+        passages.append({
+            '_id': f"{doc['_id']}:{ordinal:05d}",
+            'doc_id': doc['_id'],
+            'ordinal': ordinal,
+            'title': doc.get('title', ''),
+            'heading': heading,
+            'text': text,
+            'tokens': estimate_tokens(text),
+            'type': doc.get('type'),
+            'tags': doc.get('tags', [])
+        })
+    return passages
+
+
+class PassageStore:
+    """Coleção legal_passages: trechos dos documentos usados na recuperação"""
+
+    def __init__(self, db):
+        self.db = db
+        self._indexes_ready = False
+
+    @property
+    def collection(self):
+        return self.db.db.legal_passages
+
+    def _assign_sequence(self, passages: list):
+        """
+        Numera os trechos com 'indexed_seq' crescente (um bloco reservado por
+        escrita), usado pelos índices locais para buscar apenas os trechos novos
+        """
+        meta = self.db.db.meta.find_one_and_update(
+            {'_id': PASSAGE_SEQUENCE_ID},
+            {'$inc': {'seq': len(passages)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        first = meta['seq'] - len(passages) + 1
+        for offset, passage in enumerate(passages):
+            passage['indexed_seq'] = first + offset
+
+    def _insert(self, passages: list):
+        if not self._indexes_ready:
+            self.collection.create_index('indexed_seq')
+            self._indexes_ready = True
+        self._assign_sequence(passages)
+        try:
+            self.collection.insert_many(passages, ordered=False)
+        except BulkWriteError as e:
+            # Trechos já gravados por outro worker (chave duplicada) são ignorados
+            if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+                raise
+
+    def save(self, doc: dict) -> list:
+        """Gera e grava os trechos de um documento"""
+        passages = build_passages(doc)
+        if passages:
+            self._insert(passages)
+        self.db.legal_documents.update_one({'_id': doc['_id']}, {'$set': {'passages_built': True}})
+        return passages
+
+    def save_many(self, docs: list) -> int:
+        """Gera e grava os trechos de vários documentos em uma única escrita em lote"""
+        passages = [passage for doc in docs for passage in build_passages(doc)]
+        if passages:
+            self._insert(passages)
+        self.db.legal_documents.update_many(
+            {'_id': {'$in': [doc['_id'] for doc in docs]}},
+            {'$set': {'passages_built': True}}
+        )
+        return len(passages)
+
+    def backfill(self) -> int:
+        """Gera trechos para documentos inseridos antes da divisão em passagens"""
+        count = 0
+        cursor = self.db.legal_documents.find(
+            {'passages_built': {'$ne': True}},
+            {'title': 1, 'content': 1, 'type': 1, 'tags': 1}
+        )
+        for doc in cursor:
+            self.save(doc)
+            count += 1
+        if count:
+            logger.info(f"{count} documentos legais divididos em trechos")
+        return count
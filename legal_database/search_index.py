@@ -0,0 +1,123 @@
+import math
+import re
+import heapq
+import threading
+from collections import Counter
+from .text_analysis import analyze
+
+_PHRASE_RE = re.compile(r'"([^"]+)"')
+
+
+class BM25Index:
+    """
+    Índice invertido em memória com ranqueamento BM25
+    Termos são analisados sem acento, sem stopwords e com stemming leve.
+    Bigramas consecutivos também são indexados para dar peso a expressões
+    ("justa causa", "aviso prévio").
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, title_weight: int = 2,
+                 phrase_boost: float = 0.5, quoted_boost: float = 1.5):
+        self.k1 = k1
+        self.b = b
+        self.title_weight = title_weight
+        self.phrase_boost = phrase_boost
+        self.quoted_boost = quoted_boost
+        self.postings = {}
+        self.documents = {}
+        self._doc_terms = {}
+        self._doc_len = {}
+        self._total_len = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.documents)
+
+    @property
+    def avgdl(self) -> float:
+        return self._total_len / len(self._doc_len) if self._doc_len else 0.0
+
+    def _terms(self, title: str, content: str) -> Counter:
+        tokens = analyze(content)
+        title_tokens = analyze(title or '')
+        terms = Counter(tokens)
+        terms.update(_bigrams(tokens))
+        for _ in range(self.title_weight):
+            terms.update(title_tokens)
+            terms.update(_bigrams(title_tokens))
+        return terms
+
+    def add(self, key, title: str, content: str, **metadata):
+        """Indexa (ou reindexa) um documento"""
+        terms = self._terms(title, content)
+        length = sum(count for term, count in terms.items() if ' ' not in term)
+        with self._lock:
+            if key in self.documents:
+                self.remove(key)
+            for term, tf in terms.items():
+                self.postings.setdefault(term, {})[key] = tf
+            self._doc_terms[key] = tuple(terms)
+            self._doc_len[key] = length
+            self._total_len += length
+            self.documents[key] = dict(metadata, _id=key, title=title, content=content)
+
+    def remove(self, doc_id):
+        """Remove um documento do índice"""
+        with self._lock:
+            for term in self._doc_terms.pop(doc_id, ()):
+                postings = self.postings.get(term)
+                if postings is not None:
+                    postings.pop(doc_id, None)
+                    if not postings:
+                        del self.postings[term]
+            self._total_len -= self._doc_len.pop(doc_id, 0)
+            self.documents.pop(doc_id, None)
+
+    def _idf(self, term: str) -> float:
+        df = len(self.postings.get(term, ()))
+        n = len(self.documents)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def _accumulate(self, scores: dict, term: str, weight: float, avgdl: float):
+        postings = self.postings.get(term)
+        if not postings:
+            return
+        idf = self._idf(term) * weight
+        k1, b = self.k1, self.b
+        doc_len = self._doc_len
+        for doc_id, tf in postings.items():
+            norm = k1 * (1 - b + b * doc_len[doc_id] / avgdl)
+            scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+
+    def score(self, query: str) -> dict:
+        """Calcula o score BM25 de todos os documentos que casam com a consulta"""
+        tokens = analyze(query)
+        quoted = [analyze(phrase) for phrase in _PHRASE_RE.findall(query)]
+        scores = {}
+        with self._lock:
+            avgdl = self.avgdl or 1.0
+            for term, count in Counter(tokens).items():
+                self._accumulate(scores, term, count, avgdl)
+            for bigram in set(_bigrams(tokens)):
+                self._accumulate(scores, bigram, self.phrase_boost, avgdl)
+            for phrase in quoted:
+                for bigram in set(_bigrams(phrase)):
+                    self._accumulate(scores, bigram, self.quoted_boost, avgdl)
+        return scores
+
+    def search(self, query: str, k: int = 5) -> list:
+        """Retorna os k documentos mais relevantes (com o campo 'score')"""
+        scores = self.score(query)
+        return self.documents_for(heapq.nlargest(k, scores.items(), key=lambda item: item[1]))
+
+    def documents_for(self, scored: list) -> list:
+        """Documentos de [(id, score)] com o campo 'score', ignorando os que saíram do índice"""
+        with self._lock:
+            return [
+                dict(self.documents[doc_id], score=score)
+                for doc_id, score in scored if doc_id in self.documents
+            ]
+
+
+def _bigrams(tokens: list) -> list:
+    return [f'{a} {b}' for a, b in zip(tokens, tokens[1:])]
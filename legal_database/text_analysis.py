@@ -0,0 +1,64 @@
+import re
+import unicodedata
+
+# Stopwords do português (já sem acentos)
+PORTUGUESE_STOPWORDS = frozenset("""
+a ao aos aquela aquelas aquele aqueles aquilo as ate com como da das de dela delas
+dele deles depois do dos e ela elas ele eles em entre era eram essa essas esse esses
+esta estas este estes eu foi foram ha isso isto ja la lhe lhes mais mas me mesmo meu
+meus minha minhas muito na nas nao nem no nos nossa nossas nosso nossos num numa o os
+ou para pela pelas pelo pelos por qual quando que quem se sem ser seu seus so sua suas
+tambem te tem ter teu teus tu tua tuas um uma umas uns voce voces vos
+""".split())
+
+_TOKEN_RE = re.compile(r'\w+')
+
+# Sufixos de plural/flexão removidos pelo stemmer leve (ordem importa)
+_PLURAL_RULES = (
+    ('oes', 'ao'), ('aes', 'ao'), ('ais', 'al'), ('eis', 'el'), ('ois', 'ol'),
+    ('is', 'il'), ('ns', 'm'), ('res', 'r'), ('zes', 'z'), ('ses', 's'), ('s', ''),
+)
+
+
+# Acentos do português resolvidos por tabela (evita a normalização Unicode no caso comum)
+_ACCENT_TABLE = str.maketrans('áàâãäéèêëíìîïóòôõöúùûüç', 'aaaaaeeeeiiiiooooouuuuc')
+
+
+def fold_accents(text: str) -> str:
+    """Remove acentos e converte para minúsculas ('Jurídico' -> 'juridico')"""
+    text = text.lower()
+    if text.isascii():
+        return text
+    text = text.translate(_ACCENT_TABLE)
+    if text.isascii():
+        return text
+    normalized = unicodedata.normalize('NFKD', text)
+    return ''.join(ch for ch in normalized if not unicodedata.combining(ch))
+
+
+def tokenize(text: str) -> list:
+    """Separa o texto em palavras sem acento"""
+    return _TOKEN_RE.findall(fold_accents(text))
+
+
+def normalize(text: str) -> str:
+    """Forma canônica de um texto: sem acento, pontuação ou espaços extras"""
+    return ' '.join(tokenize(text))
+
+
+def stem(token: str) -> str:
+    """Stemmer leve para português: remove plural e gênero"""
+    if len(token) <= 3 or token.isdigit():
+        return token
+    for suffix, replacement in _PLURAL_RULES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            token = token[:-len(suffix)] + replacement
+            break
+    if len(token) > 4 and token[-1] in 'aoe':
+        token = token[:-1]
+    return token
+
+
+def analyze(text: str) -> list:
+    """Pipeline completo: tokenização, remoção de stopwords e stemming"""
+    return [stem(token) for token in tokenize(text) if token not in PORTUGUESE_STOPWORDS]
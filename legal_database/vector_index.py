@@ -0,0 +1,178 @@
+import os
+import json
+import math
+import hashlib
+import importlib
+import threading
+from collections import Counter
+import numpy as np
+from .text_analysis import analyze, tokenize
+
+
+class HashingEncoder:
+    """
+    Codificador local e determinístico (TF hasheado em dimensão fixa)
+    Combina termos com stemming e n-gramas de caracteres, o que aproxima
+    variações morfológicas ("dispensa"/"dispensado") sem serviço externo
+    """
+
+    def __init__(self, dim: int = 384, ngram: int = 4):
+        self.dim = dim
+        self.ngram = ngram
+
+    def _features(self, text: str) -> Counter:
+        features = Counter(analyze(text))
+        for token in tokenize(text):
+            padded = f'#{token}#'
+            for i in range(max(len(padded) - self.ngram + 1, 1)):
+                features['~' + padded[i:i + self.ngram]] += 0.5
+        return features
+
+    def _encode_one(self, text: str, out: np.ndarray):
+        for feature, tf in self._features(text).items():
+            digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+            value = int.from_bytes(digest, 'little')
+            sign = 1.0 if value & 1 else -1.0
+            weight = 1.0 + math.log(tf) if tf >= 1 else tf
+            out[(value >> 1) % self.dim] += sign * weight
+        norm = np.linalg.norm(out)
+        if norm:
+            out /= norm
+
+    def encode(self, texts: list) -> np.ndarray:
+        """Codifica uma lista de textos em uma matriz float32 (n, dim) normalizada"""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            self._encode_one(text, matrix[row])
+        return matrix
+
+
+def load_encoder():
+    """
+    Instancia o codificador configurado em LEGAL_VECTOR_ENCODER ('pacote.modulo:Classe')
+    O padrão é o HashingEncoder com dimensão LEGAL_VECTOR_DIM
+    """
+    spec = os.getenv('LEGAL_VECTOR_ENCODER')
+    if spec:
+        module_name, class_name = spec.split(':')
+        return getattr(importlib.import_module(module_name), class_name)()
+    return HashingEncoder(dim=int(os.getenv('LEGAL_VECTOR_DIM', 384)))
+
+
+class VectorIndex:
+    """
+    Índice vetorial denso em uma matriz float32 contígua
+    A busca top-k é um único produto matriz-vetor; o índice pode ser salvo
+    em disco e reaberto via memory-map
+    """
+
+    def __init__(self, encoder=None, capacity: int = 1024):
+        self.encoder = encoder or load_encoder()
+        self.matrix = np.zeros((capacity, self.encoder.dim), dtype=np.float32)
+        self.ids = []
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._rows
+
+    def _grow(self, needed: int):
+        capacity = self.matrix.shape[0]
+        if needed <= capacity and self.matrix.flags.writeable:
+            return
+        new_capacity = max(needed, capacity * 2, 1024)
+        matrix = np.zeros((new_capacity, self.encoder.dim), dtype=np.float32)
+        matrix[:len(self.ids)] = self.matrix[:len(self.ids)]
+        self.matrix = matrix
+
+    def add_many(self, doc_ids: list, texts: list):
+        """Codifica e adiciona documentos em lote"""
+        vectors = self.encoder.encode(texts)
+        with self._lock:
+            for doc_id, vector in zip(doc_ids, vectors):
+                row = self._rows.get(doc_id)
+                if row is None:
+                    row = len(self.ids)
+                    self._grow(row + 1)
+                    self.ids.append(doc_id)
+                    self._rows[doc_id] = row
+                else:
+                    self._grow(len(self.ids))
+                self.matrix[row] = vector
+
+    def add(self, doc_id, text: str):
+        self.add_many([doc_id], [text])
+
+    def remove(self, doc_id):
+        """Remove o documento (a linha é zerada e deixa de ser retornada)"""
+        with self._lock:
+            row = self._rows.pop(doc_id, None)
+            if row is not None:
+                self._grow(len(self.ids))
+                self.matrix[row] = 0
+                self.ids[row] = None
+
+    def search(self, query: str, k: int = 5) -> list:
+        """Retorna [(doc_id, similaridade)] dos k vetores mais próximos"""
+        return self.search_batch([query], k)[0]
+
+    def search_batch(self, queries: list, k: int = 5) -> list:
+        """Busca várias consultas com um único produto de matrizes"""
+        q = self.encoder.encode(queries)
+        with self._lock:
+            n = len(self.ids)
+            if not n:
+                return [[] for _ in queries]
+            scores = q @ self.matrix[:n].T
+            ids = list(self.ids)
+        k = min(k, n)
+        results = []
+        for row_scores in scores:
+            top = np.argpartition(-row_scores, k - 1)[:k]
+            top = top[np.argsort(-row_scores[top])]
+            results.append([
+                (ids[i], float(row_scores[i])) for i in top
+                if ids[i] is not None and row_scores[i] > 0
+            ])
+        return results
+
+    def save(self, path: str):
+        """
+        Grava a matriz (.npy) e os ids (.json) para reabertura via memory-map
+        Cada arquivo é escrito em um temporário e trocado com os.replace: quem
+        abre o índice (inclusive via memory-map) nunca vê um arquivo pela metade
+        """
+        with self._lock:
+            n = len(self.ids)
+            matrix = self.matrix[:n].copy()
+            meta = {'dim': self.encoder.dim, 'rows': n, 'ids': list(self.ids)}
+        # Temporários por processo e thread: vários processos podem salvar no mesmo caminho
+        suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(f'{path}.npy{suffix}', 'wb') as f:
+            np.save(f, matrix)
+        with open(f'{path}.json{suffix}', 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        # Os ids por último: load confere que os dois arquivos são do mesmo save
+        os.replace(f'{path}.npy{suffix}', f'{path}.npy')
+        os.replace(f'{path}.json{suffix}', f'{path}.json')
+
+    def load(self, path: str, mmap: bool = True) -> bool:
+        """Abre um índice salvo; retorna False se não existir ou for incompatível"""
+        if not (os.path.exists(f'{path}.npy') and os.path.exists(f'{path}.json')):
+            return False
+        with open(f'{path}.json', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta['dim'] != self.encoder.dim:
+            return False
+        matrix = np.load(f'{path}.npy', mmap_mode='r' if mmap else None)
+        if matrix.shape[0] != meta.get('rows', len(meta['ids'])):
+            # Matriz e ids de gravações diferentes (save em andamento)
+            return False
+        with self._lock:
+            self.matrix = matrix
+            self.ids = meta['ids']
+            self._rows = {doc_id: row for row, doc_id in enumerate(self.ids) if doc_id is not None}
+        return True
@@ -1,14 +1,24 @@
 import os
 import logging
+from dotenv import load_dotenv
+
+# Carregar variáveis de ambiente antes dos módulos do projeto, que leem
+# configurações (SHARED_STATE, TTLs, TRACE_BUFFER_SIZE...) na importação
+load_dotenv()
+
+from utils.startup import startup_timer
 from flask import Flask, request
 from telegram import Update
 from telegram.ext import Application, ContextTypes
-from dotenv import load_dotenv
 import importlib
 import pkgutil
-
-# Carregar variáveis de ambiente
-load_dotenv()
+import atexit
+from utils.update_dispatcher import UpdateDispatcher, QueueFullError
+from database.connection import close_client
+from database.write_behind import flush_all as flush_write_behind
+from utils.error_handler import ErrorHandler
+from utils.persistence import SHARED_STATE_ENABLED, SharedStatePersistence, state_loader, STATE_LOADER_GROUP
+from utils.metrics import REGISTRY, CONTENT_TYPE, merge_exports
 
 # Configuração de logging
 logging.basicConfig(
@@ -21,10 +31,19 @@ app = Flask(__name__)
 
 # Variável global para a aplicação
 application = None
+dispatcher = None
+
+# Modo de ingestão do webhook: 'queue' (ack imediato), 'inline' (aguarda os handlers)
+# ou 'sharded' (roteia por usuário para um pool de processos - ver utils.sharding)
+WEBHOOK_MODE = os.getenv('WEBHOOK_MODE', 'queue')
+# Definido apenas nos processos do pool iniciados pelo roteador (utils.sharding.shard_main)
+SHARD_ID = os.getenv('SHARD_ID')
+IS_ROUTER = WEBHOOK_MODE == 'sharded' and SHARD_ID is None
+router = None
 
 def initialize_bot():
     """Inicializa o bot de forma segura"""
-    global application
+    global application, dispatcher, router
     
     try:
         token = os.getenv('TELEGRAM_BOT_TOKEN')
@@ -32,12 +51,48 @@ def initialize_bot():
             logger.error("❌ TELEGRAM_BOT_TOKEN não configurado")
             return False
         
+        if IS_ROUTER:
+            # O roteador só encaminha: handlers e dispatcher rodam nos processos do pool
+            from utils.sharding import ShardRouter
+            with startup_timer.phase('application'):
+                application = Application.builder().token(token).build()
+            with startup_timer.phase('router'):
+                router = ShardRouter()
+                router.start()
+            atexit.register(router.stop)
+            logger.info("✅ Roteador inicializado com sucesso")
+            return True
+        
         # Criar aplicação - método correto para versão 20.x
-        application = Application.builder().token(token).build()
+        with startup_timer.phase('application'):
+            builder = Application.builder().token(token)
+            if SHARED_STATE_ENABLED:
+                # Estado das conversas e user_data compartilhado entre os processos
+                builder = builder.persistence(SharedStatePersistence())
+            application = builder.build()
+            if SHARED_STATE_ENABLED:
+                application.add_handler(state_loader(), group=STATE_LOADER_GROUP)
         
-        # Carregar módulos
+        # Carregar módulos (clientes de banco e de modelo são criados no primeiro uso)
         load_modules(application)
         
+        # Handler global de erros (resumos periódicos para os administradores)
+        admin_ids = [int(id.strip()) for id in os.getenv('ADMIN_IDS', '').split(',') if id.strip()]
+        application.add_error_handler(ErrorHandler(admin_ids).error_handler)
+        
+        # Iniciar fila de atualizações e pool de workers
+        # Ordem inversa no encerramento: drenar fila, gravar contadores, fechar conexão
+        atexit.register(close_client)
+        atexit.register(flush_write_behind)
+        with startup_timer.phase('dispatcher'):
+            if SHARD_ID is not None:
+                # No pool o limite de pendentes é aplicado pelo roteador
+                dispatcher = UpdateDispatcher(application, max_queue=int(os.getenv('SHARD_QUEUE_SIZE', 1000)))
+            else:
+                dispatcher = UpdateDispatcher(application)
+            dispatcher.start()
+        atexit.register(dispatcher.stop)
+        
         logger.info("✅ Bot inicializado com sucesso")
         return True
         
@@ -45,6 +100,18 @@ def initialize_bot():
         logger.error(f"❌ Erro na inicialização: {e}")
         return False
 
+def initialize_shard(shard_id: int) -> bool:
+    """
+    Inicializa este módulo como processo do pool
+    Usado quando o spawn importou o main como __mp_main__ (servidor iniciado
+    com `python main.py`), caso em que a importação não inicializa o bot
+    """
+    global SHARD_ID, IS_ROUTER, bot_initialized
+    SHARD_ID = str(shard_id)
+    IS_ROUTER = False
+    bot_initialized = initialize_bot()
+    return bot_initialized
+
 def load_modules(app):
     """Carrega todos os módulos automaticamente"""
     try:
@@ -55,9 +122,11 @@ def load_modules(app):
         for _, name, ispkg in pkgutil.iter_modules(package.__path__):
             if not ispkg and name != 'base_module':
                 try:
-                    module = importlib.import_module(f'{package_path}.{name}')
+                    with startup_timer.phase(f'import {name}'):
+                        module = importlib.import_module(f'{package_path}.{name}')
                     if hasattr(module, 'register_module'):
-                        module.register_module(app)
+                        with startup_timer.phase(f'register {name}'):
+                            module.register_module(app)
                         modules_loaded.append(name)
                         logger.info(f'✅ Módulo {name} carregado')
                 except Exception as e:
@@ -69,7 +138,10 @@ def load_modules(app):
         logger.error(f'❌ Erro ao carregar módulos: {e}')
 
 # Inicializar o bot ao importar
-bot_initialized = initialize_bot()
+# Importações de flask, telegram, dotenv e utilitários até aqui
+# (exceto no processo do pool iniciado por spawn, que chama initialize_shard)
+startup_timer.record('imports', startup_timer.total)
+bot_initialized = initialize_bot() if __name__ != '__mp_main__' else False
 
 @app.route('/')
 def home():
@@ -78,7 +150,34 @@ def home():
 @app.route('/health')
 def health():
     status = "healthy" if application else "unhealthy"
-    return {'status': status, 'bot_initialized': bot_initialized}
+    return {
+        'status': status,
+        'bot_initialized': bot_initialized,
+        'webhook_mode': WEBHOOK_MODE,
+        'queue_depth': router.depth if router else dispatcher.depth if dispatcher else 0,
+        'shards': router.health() if router else None,
+        'startup_ms': startup_timer.as_dict()
+    }
+
+@app.route('/metrics')
+def metrics():
+    """Métricas no formato do Prometheus (com as dos processos do pool, label shard)"""
+    text = REGISTRY.render()
+    if router:
+        text = merge_exports(text, router.shard_metrics(), 'shard')
+    return text, 200, {'Content-Type': CONTENT_TYPE}
+
+REGISTRY.callback('update_queue_depth', 'Atualizações aguardando ou em processamento',
+                  lambda: router.depth if router else dispatcher.depth if dispatcher else 0)
+REGISTRY.callback('updates_total', 'Atualizações processadas e rejeitadas pelo dispatcher',
+                  lambda: {('processed',): dispatcher.processed, ('rejected',): dispatcher.rejected} if dispatcher else {},
+                  ('result',), 'counter')
+REGISTRY.callback('shard_updates_total', 'Atualizações encaminhadas pelo roteador aos processos do pool',
+                  lambda: {('routed',): router.routed, ('rejected',): router.rejected, ('rerouted',): router.rerouted,
+                           ('lost',): router.lost} if router else {},
+                  ('result',), 'counter')
+REGISTRY.callback('shard_restarts_total', 'Processos do pool substituídos pelo roteador',
+                  lambda: router.restarts if router else 0, metric_type='counter')
 
 @app.route('/webhook', methods=['POST'])
 def webhook():
@@ -87,10 +186,25 @@ def webhook():
         return 'Bot não inicializado', 500
         
     try:
+        if router:
+            # Encaminhar ao processo do usuário (ordem estrita por usuário)
+            router.submit(request.get_json())
+            return 'ok'
+        
         # Processar a atualização do Telegram
         update = Update.de_json(request.get_json(), application.bot)
-        application.process_update(update)
+        
+        if WEBHOOK_MODE == 'inline':
+            dispatcher.run(dispatcher.process(update))
+            return 'ok'
+        
+        # Ack imediato: a atualização é processada pelos workers do dispatcher
+        dispatcher.submit(update)
         return 'ok'
+    except QueueFullError as e:
+        # Backpressure: o Telegram reenvia a atualização após o Retry-After
+        logger.warning(f"⚠️ Atualização rejeitada: {e}")
+        return 'busy', 503, {'Retry-After': os.getenv('UPDATE_RETRY_AFTER', '5')}
     except Exception as e:
         logger.error(f"❌ Erro no webhook: {e}")
         return 'error', 500
@@ -130,7 +244,7 @@ def remove_webhook():
         return f'Erro: {e}', 500
 
 # Configurar webhook automaticamente ao iniciar
-if bot_initialized and application:
+if bot_initialized and application and SHARD_ID is None:
     webhook_url = os.getenv('WEBHOOK_URL')
     if webhook_url:
         try:
@@ -140,6 +254,9 @@ if bot_initialized and application:
         except Exception as e:
             logger.error(f"❌ Erro no webhook automático: {e}")
 
+if __name__ != '__mp_main__':
+    startup_timer.report()
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     logger.info(f"🚀 Iniciando servidor na porta {port}")
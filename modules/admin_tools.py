@@ -1,7 +1,18 @@
+import os
+import json
+import asyncio
 import logging
+from datetime import datetime
 from telegram import Update
-from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
+from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler, MessageHandler, ApplicationHandlerStop, filters
 from modules.base_module import BaseModule
+from database.connection import run_in_executor
+from legal_database.importer import CorpusImporter, READERS
+from utils.broadcast import BroadcastEngine
+from collections import Counter
+from utils.tracing import summarize
+from utils.profiler import collapse, top_functions
+from utils.sharding import cluster_call
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +27,8 @@ class AdminTools(BaseModule):
         super().__init__(app)
         # Lista de IDs de administradores (definidos no .env)
         self.admin_ids = [int(id.strip()) for id in os.getenv('ADMIN_IDS', '').split(',') if id.strip()]
+        # Motor de broadcast criado no primeiro uso (um limitador de taxa para todos os envios)
+        self.broadcasts = None
         self.setup_handlers()
     
     def setup_handlers(self):
@@ -25,6 +38,14 @@ class AdminTools(BaseModule):
         self.add_handler(CommandHandler("stats", self.system_stats))
         self.add_handler(CommandHandler("broadcast", self.broadcast_message))
         self.add_handler(CommandHandler("userinfo", self.user_info))
+        self.add_handler(CommandHandler("importlaws", self.import_laws))
+        self.add_handler(CommandHandler("trace", self.trace_command))
+        self.add_handler(CommandHandler("profile", self.profile_command))
+        # Confirmação do broadcast avaliada antes do handler de texto das consultas
+        self.add_handler(
+            MessageHandler(filters.TEXT & filters.Regex(r'^(CONFIRMAR|CANCELAR)$'), self.confirm_broadcast),
+            group=-1
+        )
     
     def is_admin(self, user_id: int) -> bool:
         """Verifica se o usuário é administrador"""
@@ -54,7 +75,11 @@ class AdminTools(BaseModule):
 🔧 *Ferramentas da Base Legal:*
 📚 `/addlaw [titulo] [conteudo]` - Adicionar lei à base
 🔍 `/searchindex [termo]` - Buscar na base legal
-📥 `/importlaws` - Importar leis em lote
+📥 `/importlaws [arquivo]` - Importar leis em lote (JSONL/CSV/XML)
+
+🔬 *Diagnóstico:*
+⏱️ `/trace on [taxa]` - Rastrear uma amostra das atualizações (`/trace off`, `/trace`)
+🔥 `/profile [segundos]` - Profiling estatístico dos processos do bot
 
 💾 *Backup e Manutenção:*
 🔄 `/backup` - Criar backup do banco
@@ -75,57 +100,48 @@ class AdminTools(BaseModule):
             await update.message.reply_text("❌ Acesso restrito a administradores.")
             return
         
+        # Recalcular a partir das coleções: /stats recalcular
+        recalculate = context.args == ['recalcular']
+        
         try:
-            # Coletar estatísticas do banco de dados
-            total_users = self.db.users.count_documents({})
-            premium_users = self.db.users.count_documents({'subscription_plan': 'premium'})
-            enterprise_users = self.db.users.count_documents({'subscription_plan': 'enterprise'})
-            free_users = self.db.users.count_documents({'subscription_plan': 'free'})
-            
-            # Estatísticas de uso do mês atual
-            from datetime import datetime
-            current_month = datetime.utcnow().month
-            current_year = datetime.utcnow().year
+            # Contadores mantidos incrementalmente (sem varrer as coleções)
+            if recalculate:
+                await self.db.reconcile_system_stats_async()
+            stats = await self.db.get_system_stats_async()
             
-            monthly_usage = self.db.user_usage.aggregate([
-                {
-                    '$match': {
-                        'month': current_month,
-                        'year': current_year
-                    }
-                },
-                {
-                    '$group': {
-                        '_id': None,
-                        'total_usage': {'$sum': '$count'}
-                    }
-                }
-            ])
+            total_users = stats['users_total']
+            plans = stats['plans']
+            free_users = plans.get('free', 0)
+            premium_users = plans.get('premium', 0)
+            enterprise_users = plans.get('enterprise', 0)
+            usage_count = stats['monthly_usage']
+            legal_docs_count = stats['legal_documents']
             
-            total_monthly_usage = list(monthly_usage)
-            usage_count = total_monthly_usage[0]['total_usage'] if total_monthly_usage else 0
+            def percent(count):
+                return count / total_users * 100 if total_users else 0.0
             
-            # Estatísticas da base legal
-            legal_docs_count = self.db.legal_documents.count_documents({})
+            reconciled_at = stats['reconciled_at']
+            reconciled_text = reconciled_at.strftime("%d/%m/%Y %H:%M") if reconciled_at else 'nunca'
             
             stats_text = f"""
 📊 *Estatísticas do Sistema - {datetime.utcnow().strftime("%d/%m/%Y")}*
 
 👥 *Usuários:*
 • **Total:** {total_users} usuários
-• 🆓 **Free:** {free_users} ({free_users/total_users*100:.1f}%)
-• ⭐ **Premium:** {premium_users} ({premium_users/total_users*100:.1f}%)
-• 🏢 **Enterprise:** {enterprise_users} ({enterprise_users/total_users*100:.1f}%)
+• 🆓 **Free:** {free_users} ({percent(free_users):.1f}%)
+• ⭐ **Premium:** {premium_users} ({percent(premium_users):.1f}%)
+• 🏢 **Enterprise:** {enterprise_users} ({percent(enterprise_users):.1f}%)
 
 📈 *Uso Este Mês:*
 • **Total de consultas:** {usage_count}
-• **Média por usuário:** {usage_count/total_users:.1f}
+• **Média por usuário:** {usage_count / total_users if total_users else 0:.1f}
 
 📚 *Base Legal:*
 • **Documentos armazenados:** {legal_docs_count}
 • **Leis, jurisprudências e doutrinas**
 
 🟢 *Status do Sistema:* Operacional
+🔄 _Última reconciliação: {reconciled_text} (use /stats recalcular)_
             """
             
             await update.message.reply_text(stats_text, parse_mode='Markdown')
@@ -151,9 +167,18 @@ class AdminTools(BaseModule):
         if not context.args:
             await update.message.reply_text(
                 "📢 Uso: /broadcast [sua mensagem]\n\n"
-                "Exemplo: /broadcast Nova atualização disponível!"
+                "Exemplo: /broadcast Nova atualização disponível!\n\n"
+                "/broadcast status - andamento do último envio\n"
+                "/broadcast retomar - continuar um envio interrompido"
             )
             return
+
+        if context.args == ['status']:
+            await self.broadcast_status(update, context)
+            return
+        if context.args == ['retomar']:
+            await self.resume_broadcast(update, context)
+            return
         
         broadcast_message = ' '.join(context.args)
         
@@ -176,6 +201,80 @@ Digite CONFIRMAR para enviar ou CANCELAR para abortar.
         # Armazenar mensagem temporariamente para confirmação
         context.user_data['pending_broadcast'] = broadcast_message
     
+    def broadcast_engine(self, bot) -> BroadcastEngine:
+        if self.broadcasts is None:
+            self.broadcasts = BroadcastEngine(self.db, bot)
+        return self.broadcasts
+
+    async def confirm_broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Trata a resposta CONFIRMAR/CANCELAR de um broadcast pendente"""
+        user_id = update.effective_user.id
+        if not self.is_admin(user_id) or 'pending_broadcast' not in context.user_data:
+            return
+
+        message = context.user_data.pop('pending_broadcast')
+        if update.message.text == 'CANCELAR':
+            await update.message.reply_text("🚫 Broadcast cancelado.")
+        else:
+            engine = self.broadcast_engine(context.bot)
+            job_id = await run_in_executor(engine.create_job, message, user_id)
+            status_message = await update.message.reply_text("📢 Broadcast iniciado...")
+            context.application.create_task(self.run_broadcast(engine, job_id, status_message))
+            logger.info(f"Administrador {user_id} iniciou o broadcast {job_id}")
+
+        # Não repassar a resposta para os demais handlers de texto
+        raise ApplicationHandlerStop
+
+    async def run_broadcast(self, engine: BroadcastEngine, job_id, status_message):
+        """Executa o job em segundo plano, atualizando a mensagem de status"""
+        async def progress(stats):
+            await status_message.edit_text(
+                f"📢 Broadcast em andamento ({stats['rate']:.1f} msg/s)\n\n"
+                f"✅ Enviadas: {stats['sent']}\n"
+                f"⛔ Bloqueados: {stats['blocked']}\n"
+                f"❌ Falhas: {stats['failed']}"
+            )
+
+        try:
+            stats = await engine.run(job_id, progress=progress)
+            await status_message.edit_text(
+                f"✅ Broadcast concluído em {stats['elapsed']:.0f}s\n\n"
+                f"✅ Enviadas: {stats['sent']}\n"
+                f"⛔ Bloqueados: {stats['blocked']}\n"
+                f"❌ Falhas: {stats['failed']}"
+            )
+        except Exception as e:
+            logger.error(f"Erro no broadcast {job_id}: {e}")
+            await status_message.edit_text(
+                f"❌ Broadcast interrompido: {str(e)}\n\nUse /broadcast retomar para continuar."
+            )
+
+    async def broadcast_status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Mostra o andamento do último broadcast"""
+        job = await run_in_executor(self.broadcast_engine(context.bot).latest_job)
+        if not job:
+            await update.message.reply_text("📢 Nenhum broadcast registrado.")
+            return
+        await update.message.reply_text(
+            f"📢 Último broadcast ({job['created_at'].strftime('%d/%m/%Y %H:%M')}): {job['status']}\n\n"
+            f"✅ Enviadas: {job['sent']}\n"
+            f"⛔ Bloqueados: {job['blocked']}\n"
+            f"❌ Falhas: {job['failed']}"
+        )
+
+    async def resume_broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Retoma o broadcast interrompido mais recente a partir do último lote gravado"""
+        engine = self.broadcast_engine(context.bot)
+        job = await run_in_executor(engine.claim_interrupted_job)
+        if not job:
+            await update.message.reply_text("📢 Nenhum broadcast interrompido para retomar.")
+            return
+        status_message = await update.message.reply_text(
+            f"📢 Retomando broadcast ({job['sent']} já enviadas)..."
+        )
+        context.application.create_task(self.run_broadcast(engine, job['_id'], status_message))
+        logger.info(f"Administrador {update.effective_user.id} retomou o broadcast {job['_id']}")
+
     async def user_info(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
         Mostra informações detalhadas de um usuário específico
@@ -193,7 +292,7 @@ Digite CONFIRMAR para enviar ou CANCELAR para abortar.
         
         try:
             target_user_id = int(context.args[0])
-            user_data = self.db.get_user_data(target_user_id)
+            user_data = await self.db.get_user_data_async(target_user_id)
             
             if not user_data:
                 await update.message.reply_text("❌ Usuário não encontrado.")
@@ -223,9 +322,191 @@ Digite CONFIRMAR para enviar ou CANCELAR para abortar.
             await update.message.reply_text(error_msg)
             logger.error(f"Erro em user_info: {e}")
 
+    async def import_laws(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Importa em lote um arquivo da base legal (JSONL, CSV ou XML) presente no servidor
+        A importação roda fora do event loop e o progresso é atualizado na mesma mensagem
+        """
+        user_id = update.effective_user.id
+
+        if not self.is_admin(user_id):
+            await update.message.reply_text("❌ Acesso restrito a administradores.")
+            return
+
+        if not context.args:
+            await update.message.reply_text(
+                "📥 Uso: /importlaws [caminho] [tipo] [tags]\n\n"
+                f"Formatos: {', '.join(sorted(READERS))}\n"
+                "Exemplo: /importlaws dados/clt.jsonl lei trabalhista,clt\n\n"
+                "Importações interrompidas continuam de onde pararam."
+            )
+            return
+
+        path = context.args[0]
+        doc_type = context.args[1] if len(context.args) > 1 else None
+        tags = [tag.strip() for tag in context.args[2].split(',')] if len(context.args) > 2 else []
+        if not os.path.isfile(path):
+            await update.message.reply_text(f"❌ Arquivo não encontrado: {path}")
+            return
+
+        status_message = await update.message.reply_text(f"📥 Importando {os.path.basename(path)}...")
+        loop = asyncio.get_running_loop()
+
+        def progress(stats):
+            # Chamado na thread da importação
+            text = (
+                f"📥 Importando {os.path.basename(path)}...\n\n"
+                f"Registros: {stats['processed']} ({stats['rate']:.0f}/s)\n"
+                f"Inseridos: {stats['inserted']} | Repetidos: {stats['duplicates']}"
+            )
+            asyncio.run_coroutine_threadsafe(status_message.edit_text(text), loop)
+
+        try:
+            importer = CorpusImporter(self.db)
+            stats = await run_in_executor(importer.run, path, None, doc_type, tags, None, progress)
+            await status_message.edit_text(
+                f"✅ Importação concluída: {os.path.basename(path)}\n\n"
+                f"Registros: {stats['processed']}\n"
+                f"Inseridos: {stats['inserted']}\n"
+                f"Repetidos: {stats['duplicates']}\n"
+                f"Inválidos: {stats['invalid']}\n"
+                f"Tempo: {stats.get('elapsed', 0):.1f}s ({stats.get('rate', 0):.0f} registros/s)"
+            )
+            logger.info(f"Administrador {user_id} importou {path}")
+
+        except Exception as e:
+            await status_message.edit_text(
+                f"❌ Erro na importação: {str(e)}\n\nExecute o comando novamente para continuar."
+            )
+            logger.error(f"Erro em import_laws: {e}")
+
+    async def trace_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Controla o rastreamento amostrado das atualizações (em todos os processos)
+        /trace on [taxa] liga (taxa de 0 a 1, padrão 0.1), /trace off desliga e
+        /trace mostra o resumo por etapa e envia os traces recentes em JSON
+        """
+        user_id = update.effective_user.id
+
+        if not self.is_admin(user_id):
+            await update.message.reply_text("❌ Acesso restrito a administradores.")
+            return
+
+        action = context.args[0].lower() if context.args else ''
+        if action == 'on':
+            try:
+                rate = float(context.args[1]) if len(context.args) > 1 else 0.1
+            except ValueError:
+                await update.message.reply_text("❌ Taxa inválida. Use um número entre 0 e 1.")
+                return
+            if not 0 < rate <= 1:
+                await update.message.reply_text("❌ Taxa inválida. Use um número entre 0 e 1.")
+                return
+            results = await asyncio.to_thread(cluster_call, 'trace', 'on', rate)
+            await update.message.reply_text(
+                f"⏱️ Rastreamento ligado para {rate:.0%} das atualizações ({len(results)} processos)."
+            )
+            logger.info(f"Administrador {user_id} ligou o rastreamento (taxa {rate})")
+            return
+        if action == 'off':
+            results = await asyncio.to_thread(cluster_call, 'trace', 'off')
+            await update.message.reply_text(f"⏱️ Rastreamento desligado ({len(results)} processos).")
+            logger.info(f"Administrador {user_id} desligou o rastreamento")
+            return
+
+        results = await asyncio.to_thread(cluster_call, 'trace')
+        traces = [
+            dict(trace, process=process)
+            for process, result in results.items()
+            for trace in result.get('traces', [])
+        ]
+        rate = max((result.get('sample_rate', 0.0) for result in results.values()), default=0.0)
+        status = f"ligado ({rate:.0%})" if rate else "desligado"
+        if not traces:
+            await update.message.reply_text(
+                f"⏱️ Rastreamento {status}. Nenhum trace registrado.\n\n"
+                "Use /trace on [taxa] para ligar."
+            )
+            return
+
+        # Tempo médio por etapa e os traces mais lentos
+        totals = {}
+        for trace in traces:
+            for step in trace['spans']:
+                count, elapsed = totals.get(step['name'], (0, 0.0))
+                totals[step['name']] = (count + 1, elapsed + step['duration_ms'])
+        steps = '\n'.join(
+            f"• {name}: {elapsed / count:.0f} ms ({count}x)"
+            for name, (count, elapsed) in sorted(totals.items(), key=lambda item: item[1][1], reverse=True)
+        )
+        slowest = '\n'.join(
+            f"• {summarize(trace)}"
+            for trace in sorted(traces, key=lambda trace: trace['duration_ms'], reverse=True)[:5]
+        )
+        await update.message.reply_text(
+            f"⏱️ Rastreamento {status} - {len(traces)} traces de {len(results)} processos\n\n"
+            f"Tempo médio por etapa:\n{steps or '• sem etapas'}\n\n"
+            f"Mais lentos:\n{slowest}"
+        )
+        payload = json.dumps(traces, ensure_ascii=False, indent=1)
+        await update.message.reply_document(
+            document=payload.encode('utf-8'),
+            filename=f"traces_{datetime.utcnow():%Y%m%d_%H%M%S}.json"
+        )
+
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Executa o profiler estatístico por alguns segundos (padrão 30, máx. 300)
+        em todos os processos e envia as pilhas agregadas (formato collapsed,
+        para flamegraph/speedscope; no pool, cada pilha começa pelo processo)
+        """
+        user_id = update.effective_user.id
+
+        if not self.is_admin(user_id):
+            await update.message.reply_text("❌ Acesso restrito a administradores.")
+            return
+
+        try:
+            seconds = int(context.args[0]) if context.args else 30
+        except ValueError:
+            await update.message.reply_text("❌ Uso: /profile [segundos]")
+            return
+        seconds = max(1, min(seconds, 300))
+
+        status_message = await update.message.reply_text(f"🔥 Profiling por {seconds}s...")
+        results = await asyncio.to_thread(cluster_call, 'profile', seconds, timeout=seconds + 30)
+
+        samples = Counter()
+        sample_count = 0
+        errors = []
+        for process, result in results.items():
+            if 'error' in result:
+                errors.append(f"{process}: {result['error']}")
+                continue
+            prefix = '' if process == 'local' else f"{process};"
+            for stack, count in result['samples'].items():
+                samples[prefix + stack] += count
+            sample_count += result['sample_count']
+        if not samples and errors:
+            await status_message.edit_text("❌ " + '\n'.join(errors))
+            return
+
+        top = '\n'.join(f"• {name}: {share:.0%}" for name, share in top_functions(samples, 10))
+        failed = "\n\n⚠️ Sem resultado:\n" + '\n'.join(errors) if errors else ''
+        await status_message.edit_text(
+            f"🔥 Profiling concluído: {sample_count} amostras em {seconds}s ({len(results)} processos)\n\n"
+            f"Funções com mais tempo próprio:\n{top or '• nenhuma amostra'}{failed}"
+        )
+        await update.message.reply_document(
+            document=collapse(samples).encode('utf-8'),
+            filename=f"profile_{datetime.utcnow():%Y%m%d_%H%M%S}.txt",
+            caption="Pilhas agregadas (flamegraph.pl / speedscope)"
+        )
+        logger.info(f"Administrador {user_id} executou profiling por {seconds}s")
+
 def register_module(app):
     """
     Função de registro do módulo administrativo
     """
-    AdminTools(app)
+    AdminTools(app).register_module(app)
     logger.info("Módulo de ferramentas administrativas carregado com sucesso")
@@ -1,18 +1,77 @@
-from telegram.ext import CommandHandler, MessageHandler, filters, CallbackQueryHandler, ConversationHandler
+from telegram.ext import (
+    CommandHandler, MessageHandler, filters, CallbackQueryHandler, ConversationHandler, ApplicationHandlerStop
+)
+from telegram.error import BadRequest
 import logging
+from functools import cached_property
+from utils.metrics import REGISTRY, timed
+from database.operations import DatabaseManager
+from utils.persistence import SharedConversationHandler
 
 logger = logging.getLogger(__name__)
 
+# Limite de caracteres de uma mensagem do Telegram
+MESSAGE_LIMIT = 4096
+
+HANDLER_LATENCY = REGISTRY.histogram('handler_seconds', 'Duração dos handlers do bot', ('handler',))
+HANDLER_ERRORS = REGISTRY.counter('handler_errors_total', 'Exceções nos handlers do bot', ('handler',))
+
+
+def instrument_handler(handler):
+    """Mede os callbacks do handler (e dos handlers internos de uma conversa)"""
+    if isinstance(handler, (ConversationHandler, SharedConversationHandler)):
+        nested = list(handler.entry_points) + list(handler.fallbacks)
+        for state_handlers in handler.states.values():
+            nested.extend(state_handlers)
+        for inner in nested:
+            instrument_handler(inner)
+        return handler
+    if isinstance(handler, CommandHandler):
+        label = '/' + sorted(handler.commands)[0]
+    else:
+        label = handler.callback.__name__
+    # ApplicationHandlerStop é controle de fluxo (interrompe os grupos seguintes), não erro
+    handler.callback = timed(
+        HANDLER_LATENCY.labels(label), HANDLER_ERRORS.labels(label), ignore=(ApplicationHandlerStop,)
+    )(handler.callback)
+    return handler
+
 class BaseModule:
-    def __init__(self):
+    def __init__(self, app=None):
+        self.app = app
         self.handlers = []
     
+    @cached_property
+    def db(self):
+        """Acesso ao banco (cliente MongoDB compartilhado, criado no primeiro uso)"""
+        return DatabaseManager()
+    
     def register_module(self, application):
         """Registra todos os handlers no aplicativo"""
-        for handler in self.handlers:
-            application.add_handler(handler)
+        for handler, group in self.handlers:
+            application.add_handler(instrument_handler(handler), group)
         logger.info(f"✅ Módulo {self.__class__.__name__} registrado")
     
-    def add_handler(self, handler):
-        """Adiciona handler à lista"""
-        self.handlers.append(handler)
+    def add_handler(self, handler, group: int = 0):
+        """Adiciona handler à lista (grupos menores são avaliados antes)"""
+        self.handlers.append((handler, group))
+    
+    async def check_subscription(self, user_id: int) -> bool:
+        """Verifica se o usuário pode realizar a consulta"""
+        entitlement = await self.db.get_entitlement_async(user_id)
+        return entitlement.allowed
+
+    async def send_markdown(self, message, text: str, edit: bool = False):
+        """
+        Envia um texto longo em Markdown, em partes de até MESSAGE_LIMIT caracteres
+        Com `edit`, a primeira parte substitui o texto de `message` (placeholder);
+        as demais são enviadas como respostas a ela
+        """
+        chunks = [text[i:i + MESSAGE_LIMIT] for i in range(0, len(text), MESSAGE_LIMIT)]
+        for index, chunk in enumerate(chunks):
+            send = message.edit_text if edit and index == 0 else message.reply_text
+            try:
+                await send(chunk, parse_mode='Markdown')
+            except BadRequest:
+                # Markdown inválido (ex: trecho cortado no meio de uma marcação)
+                await send(chunk)
@@ -1,18 +1,71 @@
+import io
 import os
+import re
+import asyncio
+import hashlib
 import logging
+import unicodedata
 from telegram import Update
 from telegram.ext import ContextTypes, CommandHandler, MessageHandler, filters
 from modules.base_module import BaseModule
-import google.generativeai as genai
+from database.cache_store import PersistentCache
+from utils.llm_executor import get_llm_executor
+from utils.llm_backends import get_llm_backend
+from utils.singleflight import SingleFlight
+from utils.metrics import register_cache
+from utils.text_extraction import extract_text
+from utils.tracing import span
+from utils.chunking import split_overlapping, estimate_tokens
 
 logger = logging.getLogger(__name__)
 
+# Análises simultâneas do mesmo arquivo (file_unique_id) compartilham o processamento
+document_analyses = SingleFlight()
+
+# Cache de análises endereçado por conteúdo: 'file:<file_unique_id>' e 'text:<sha256 do texto>'
+document_cache = PersistentCache(
+    'document_analysis_cache',
+    maxsize=int(os.getenv('DOC_CACHE_SIZE', 1000)),
+    ttl=float(os.getenv('DOC_CACHE_TTL', 30 * 24 * 3600)),
+    max_entries=int(os.getenv('DOC_CACHE_MAX_ENTRIES', 50000))
+)
+register_cache('document_analyses', document_cache)
+
+# Incrementar ao alterar prompts/parâmetros da análise (invalida o cache)
+ANALYSIS_VERSION = 1
+
+
+class DocumentAnalysisError(Exception):
+    """Falha do modelo na análise (o chamador deve devolver a consulta reservada)"""
+
+
+class EmptyDocumentError(Exception):
+    """Documento sem texto extraível (o chamador deve devolver a consulta reservada)"""
+
+
+def text_cache_key(text: str) -> str:
+    """Chave do cache pelo texto extraído normalizado (Unicode NFC, espaços colapsados)"""
+    normalized = re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text)).strip()
+    digest = hashlib.sha256(f"{ANALYSIS_VERSION}|{normalized}".encode('utf-8')).hexdigest()
+    return f"text:{digest}"
+
+
+def file_cache_key(file_unique_id: str) -> str:
+    return f"file:{ANALYSIS_VERSION}:{file_unique_id}"
+
 class DocumentAnalyzer(BaseModule):
     def __init__(self, app):
         super().__init__(app)
-        # Configurar a API do Gemini
-        genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
-        self.model = genai.GenerativeModel('gemini-pro')
+        # Backend de modelo compartilhado (Gemini, simulado ou replay)
+        self.backend = get_llm_backend()
+        # Limites de tamanho do arquivo baixado e do texto extraído
+        self.max_file_size = int(os.getenv('DOC_MAX_FILE_SIZE', 20 * 1024 * 1024))
+        self.max_chars = int(os.getenv('DOC_MAX_CHARS', 400000))
+        # Documentos maiores que single_pass_chars são analisados por blocos (map-reduce)
+        self.single_pass_chars = int(os.getenv('DOC_SINGLE_PASS_CHARS', 10000))
+        self.chunk_tokens = int(os.getenv('DOC_CHUNK_TOKENS', 2000))
+        self.chunk_overlap_tokens = int(os.getenv('DOC_CHUNK_OVERLAP_TOKENS', 200))
+        self.map_concurrency = int(os.getenv('DOC_MAP_CONCURRENCY', 4))
         self.setup_handlers()
 
     def setup_handlers(self):
@@ -25,7 +78,7 @@ class DocumentAnalyzer(BaseModule):
         user_id = update.effective_user.id
         
         # Verificar assinatura
-        if not self.check_subscription(user_id):
+        if not await self.check_subscription(user_id):
             await update.message.reply_text(
                 "❌ Você excedeu seu limite de consultas gratuitas deste mês. "
                 "Assine o plano Premium para consultas ilimitadas.\n\n"
@@ -47,15 +100,6 @@ class DocumentAnalyzer(BaseModule):
     async def handle_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Processa o documento enviado"""
         user_id = update.effective_user.id
-        
-        # Verificar assinatura
-        if not self.check_subscription(user_id):
-            await update.message.reply_text(
-                "❌ Você excedeu seu limite de consultas gratuitas deste mês. "
-                "Assine o plano Premium para consultas ilimitadas.\n\n"
-                "Use /planos para ver os planos disponíveis."
-            )
-            return
 
         # Verificar se é um documento
         if not update.message.document:
@@ -71,46 +115,96 @@ class DocumentAnalyzer(BaseModule):
             )
             return
 
-        # Baixar o arquivo
-        file = await document.get_file()
-        file_path = f"temp_{user_id}_{document.file_name}"
-        await file.download_to_drive(file_path)
+        if document.file_size and document.file_size > self.max_file_size:
+            await update.message.reply_text(
+                f"❌ Arquivo muito grande. O limite é {self.max_file_size // (1024 * 1024)} MB."
+            )
+            return
+
+        # Reservar a consulta na cota (atômico no plano free)
+        with span('entitlement'):
+            reservation = await self.db.reserve_usage_async(user_id)
+        if reservation is None:
+            await update.message.reply_text(
+                "❌ Você excedeu seu limite de consultas gratuitas deste mês. "
+                "Assine o plano Premium para consultas ilimitadas.\n\n"
+                "Use /planos para ver os planos disponíveis."
+            )
+            return
 
         # Processar o arquivo
         try:
-            # Ler o conteúdo do arquivo (simplificado para txt, para outros formatos precisaria de bibliotecas extras)
-            if file_extension == 'txt':
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-            else:
-                # Para PDF e DOCX, vamos usar uma abordagem simplificada (em produção, use bibliotecas como PyPDF2, python-docx)
-                content = f"Conteúdo do arquivo {document.file_name} (formato {file_extension}) não pode ser lido nesta versão. Em breve, suporte completo."
-
-            # Se o conteúdo for muito longo, truncar (limite do Gemini)
-            if len(content) > 10000:
-                content = content[:10000] + "... [conteúdo truncado]"
-
-            # Analisar com Gemini
-            analysis = await self.analyze_with_gemini(content)
-
-            # Incrementar uso
-            self.db.increment_usage(user_id)
+            # Envios simultâneos do mesmo arquivo aguardam a mesma análise
+            analysis = await document_analyses.do(
+                document.file_unique_id,
+                lambda: self.process_document(document, file_extension, user_id)
+            )
 
             # Enviar resposta
+            # Relatórios longos (análise por blocos) são divididos em várias mensagens
+            with span('telegram_send'):
+                await self.send_markdown(update.message, f"📊 **Análise do Documento**\n\n{analysis}")
+
+            # Confirmar uso apenas após a entrega da análise
+            await self.db.commit_usage_async(reservation)
+
+        except EmptyDocumentError:
+            await self.db.refund_usage_async(reservation)
             await update.message.reply_text(
-                f"📊 **Análise do Documento**\n\n{analysis}",
-                parse_mode='Markdown'
+                "❌ Não foi possível extrair texto do documento (arquivo vazio ou digitalizado)."
             )
 
         except Exception as e:
             logger.error(f"Erro ao analisar documento: {e}")
+            await self.db.refund_usage_async(reservation)
             await update.message.reply_text(
                 "❌ Ocorreu um erro ao analisar o documento. Tente novamente."
             )
-        finally:
-            # Limpar arquivo temporário
-            if os.path.exists(file_path):
-                os.remove(file_path)
+
+    async def process_document(self, document, file_extension: str, user_id: int) -> str:
+        """Baixa o documento para a memória, extrai o texto e analisa"""
+        # Mesmo arquivo já analisado: nem o download é necessário
+        file_key = file_cache_key(document.file_unique_id)
+        cached = await document_cache.get_async(file_key)
+        if cached is not None:
+            return cached
+
+        # Baixar o arquivo para um buffer em memória (sem arquivo temporário)
+        with span('download'):
+            file = await document.get_file()
+            buffer = io.BytesIO()
+            await file.download_to_memory(out=buffer)
+            buffer.seek(0)
+
+        # Extrair texto página/parágrafo a parágrafo, parando no limite de caracteres
+        loop = asyncio.get_running_loop()
+        with span('extraction'):
+            content, truncated = await loop.run_in_executor(
+                None, extract_text, buffer, file_extension, self.max_chars
+            )
+        if not content.strip():
+            raise EmptyDocumentError(document.file_unique_id)
+
+        # Acima do limite de extração o restante do documento é descartado
+        if truncated:
+            content += "... [conteúdo truncado]"
+
+        # Mesmo conteúdo enviado em outro arquivo (ex: modelo de contrato)
+        text_key = text_cache_key(content)
+        cached = await document_cache.get_async(text_key)
+        if cached is not None:
+            await document_cache.set_async(file_key, cached)
+            return cached
+
+        # Documentos curtos: uma única chamada; longos: análise por blocos
+        if len(content) <= self.single_pass_chars:
+            analysis = await self.analyze_with_gemini(content)
+        else:
+            analysis = await self.analyze_long_document(content)
+
+        await document_cache.set_async(text_key, analysis)
+        await document_cache.set_async(file_key, analysis)
+        return analysis
 
     async def analyze_with_gemini(self, text: str) -> str:
         """Analisa o texto com a API do Gemini"""
@@ -127,12 +221,95 @@ class DocumentAnalyzer(BaseModule):
         """
 
         try:
-            response = self.model.generate_content(prompt + text)
-            return response.text
+            return await get_llm_executor().generate(self.backend, prompt + text)
+        except Exception as e:
+            logger.error(f"Erro na API do Gemini: {e}")
+            raise DocumentAnalysisError(str(e)) from e
+
+    async def analyze_long_document(self, text: str) -> str:
+        """
+        Análise map-reduce: cada bloco (com sobreposição, respeitando cláusulas) é
+        analisado em paralelo, com no máximo map_concurrency chamadas simultâneas,
+        e as análises parciais são consolidadas no relatório de quatro seções
+        """
+        chunks = split_overlapping(text, self.chunk_tokens, self.chunk_overlap_tokens)
+        semaphore = asyncio.Semaphore(self.map_concurrency)
+
+        async def analyze_chunk(index: int, chunk: str) -> str:
+            prompt = f"""
+        Você é um assistente jurídico especializado em direito brasileiro.
+        Este é o trecho {index + 1} de {len(chunks)} de um documento maior.
+        Liste de forma objetiva, em português:
+
+        - Assunto do trecho (cláusulas/artigos envolvidos)
+        - Pontos que necessitam de atenção jurídica
+        - Sugestões de ajuste
+        - Leis ou jurisprudências aplicáveis
+
+        Não repita o enunciado e não conclua sobre o documento inteiro.
+
+        Trecho:
+        """
+            async with semaphore:
+                return await get_llm_executor().generate(self.backend, prompt + chunk)
+
+        try:
+            partials = await asyncio.gather(*(analyze_chunk(i, chunk) for i, chunk in enumerate(chunks)))
+            logger.info(f"Documento analisado em {len(chunks)} blocos")
+            return await self.reduce_analyses(list(partials))
         except Exception as e:
             logger.error(f"Erro na API do Gemini: {e}")
-            return "Erro na análise com IA. Tente novamente mais tarde."
+            raise DocumentAnalysisError(str(e)) from e
+
+    async def reduce_analyses(self, partials: list) -> str:
+        """Consolida as análises parciais; se não couberem em um prompt, consolida em níveis"""
+        while len(partials) > 1 and estimate_tokens('\n\n'.join(partials)) > self.chunk_tokens * 2:
+            groups = []
+            group, group_tokens = [], 0
+            for partial in partials:
+                tokens = estimate_tokens(partial)
+                if group and group_tokens + tokens > self.chunk_tokens * 2:
+                    groups.append(group)
+                    group, group_tokens = [], 0
+                group.append(partial)
+                group_tokens += tokens
+            groups.append(group)
+            if len(groups) == len(partials):
+                break
+            partials = list(await asyncio.gather(*(self._combine(group) for group in groups)))
+
+        prompt = """
+        Você é um assistente jurídico especializado em direito brasileiro.
+        Abaixo estão análises parciais de trechos consecutivos de um mesmo documento.
+        Consolide-as, sem repetições, em uma análise única com:
+
+        1. **Resumo Executivo**: Um breve resumo do documento.
+        2. **Pontos Críticos**: Identifique pontos que necessitam de atenção jurídica.
+        3. **Recomendações**: Sugestões de melhorias ou ajustes.
+        4. **Referências Legais**: Indique leis ou jurisprudências aplicáveis.
+
+        Mantenha a resposta em português e estruturada de forma clara.
+
+        Análises parciais:
+        """
+        return await get_llm_executor().generate(self.backend, prompt + self._join_partials(partials))
+
+    async def _combine(self, partials: list) -> str:
+        """Nível intermediário do reduce: resume um grupo de análises parciais"""
+        if len(partials) == 1:
+            return partials[0]
+        prompt = """
+        Junte as análises parciais abaixo em uma única lista objetiva, em português,
+        mantendo pontos de atenção, sugestões e referências legais sem repetições.
+
+        Análises parciais:
+        """
+        return await get_llm_executor().generate(self.backend, prompt + self._join_partials(partials))
+
+    @staticmethod
+    def _join_partials(partials: list) -> str:
+        return '\n\n'.join(f"[Parte {i + 1}]\n{partial}" for i, partial in enumerate(partials))
 
 def register_module(app):
     """Função de registro do módulo"""
-    DocumentAnalyzer(app)
+    DocumentAnalyzer(app).register_module(app)
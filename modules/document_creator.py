@@ -2,6 +2,7 @@ import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler, ConversationHandler, MessageHandler, filters
 from modules.base_module import BaseModule
+from utils.persistence import SharedConversationHandler
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +16,9 @@ class DocumentCreator(BaseModule):
 
     def setup_handlers(self):
         """Configura handlers para criação de documentos"""
-        conv_handler = ConversationHandler(
+        # Estado compartilhado: a próxima mensagem pode ser atendida por outro processo
+        conv_handler = SharedConversationHandler(
+            name='document_creation',
             entry_points=[CommandHandler('criardocumento', self.start_creation)],
             states={
                 SELECT_DOC_TYPE: [
@@ -34,7 +37,8 @@ class DocumentCreator(BaseModule):
         user_id = update.effective_user.id
 
         # Verificar assinatura (apenas premium e enterprise podem criar documentos)
-        if not self.check_subscription(user_id) or self.db.get_user_plan(user_id) == 'free':
+        entitlement = await self.db.get_entitlement_async(user_id)
+        if not entitlement.allowed or entitlement.is_free:
             await update.message.reply_text(
                 "❌ Criação de documentos é exclusiva para assinantes Premium e Enterprise.\n\n"
                 "Use /planos para upgrade."
@@ -85,20 +89,37 @@ class DocumentCreator(BaseModule):
         details = update.message.text
         doc_type = context.user_data['doc_type']
 
-        # Gerar documento (simulação - em produção, integrar com template engine e Gemini)
-        document_content = await self.generate_document(doc_type, details)
+        # Reservar a consulta na cota
+        reservation = await self.db.reserve_usage_async(user_id)
+        if reservation is None:
+            await update.message.reply_text(
+                "❌ Criação de documentos é exclusiva para assinantes Premium e Enterprise.\n\n"
+                "Use /planos para upgrade."
+            )
+            return ConversationHandler.END
 
-        # Incrementar uso
-        self.db.increment_usage(user_id)
+        try:
+            # Gerar documento (simulação - em produção, integrar com template engine e Gemini)
+            document_content = await self.generate_document(doc_type, details)
 
-        # Enviar documento
-        await update.message.reply_text(
-            f"✅ Documento gerado com sucesso!\n\n"
-            f"📄 Conteúdo:\n\n{document_content}\n\n"
-            f"*Nota: Este é um documento gerado automaticamente. "
-            f"Recomendamos consultar um advogado para validação.*",
-            parse_mode='Markdown'
-        )
+            # Enviar documento
+            await update.message.reply_text(
+                f"✅ Documento gerado com sucesso!\n\n"
+                f"📄 Conteúdo:\n\n{document_content}\n\n"
+                f"*Nota: Este é um documento gerado automaticamente. "
+                f"Recomendamos consultar um advogado para validação.*",
+                parse_mode='Markdown'
+            )
+
+            # Confirmar uso apenas após a entrega do documento
+            await self.db.commit_usage_async(reservation)
+
+        except Exception as e:
+            logger.error(f"Erro ao gerar documento: {e}")
+            await self.db.refund_usage_async(reservation)
+            await update.message.reply_text(
+                "❌ Ocorreu um erro ao gerar o documento. Tente novamente."
+            )
 
         return ConversationHandler.END
 
@@ -123,4 +144,4 @@ class DocumentCreator(BaseModule):
 
 def register_module(app):
     """Função de registro do módulo"""
-    DocumentCreator(app)
+    DocumentCreator(app).register_module(app)
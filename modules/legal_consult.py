@@ -1,17 +1,32 @@
+import os
+import time
 import logging
+from functools import cached_property
 from telegram import Update
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes, CommandHandler, MessageHandler, filters
-from modules.base_module import BaseModule
+from modules.base_module import BaseModule, MESSAGE_LIMIT
 from legal_database.legal_analyzer import LegalAnalyzer
+from legal_database.intent import get_intent_classifier
+from utils.tracing import span
 
 logger = logging.getLogger(__name__)
 
 class LegalConsult(BaseModule):
     def __init__(self, app):
         super().__init__(app)
-        self.legal_analyzer = LegalAnalyzer()
+        # Classificador das mensagens de texto livre
+        self.intent = get_intent_classifier()
+        # Streaming da resposta no placeholder, com edições espaçadas (limite do Telegram)
+        self.streaming = os.getenv('STREAM_RESPONSES', 'true').lower() == 'true'
+        self.edit_interval = float(os.getenv('STREAM_EDIT_INTERVAL', 1.5))
         self.setup_handlers()
 
+    @cached_property
+    def legal_analyzer(self) -> LegalAnalyzer:
+        """Analisador criado na primeira consulta (índices carregados sob demanda)"""
+        return LegalAnalyzer()
+
     def setup_handlers(self):
         """Configura handlers para consulta legal"""
         self.add_handler(CommandHandler("consultar", self.legal_query))
@@ -22,7 +37,7 @@ class LegalConsult(BaseModule):
         user_id = update.effective_user.id
         
         # Verificar assinatura
-        if not self.check_subscription(user_id):
+        if not await self.check_subscription(user_id):
             await update.message.reply_text(
                 "❌ Você excedeu seu limite de consultas gratuitas deste mês. "
                 "Assine o plano Premium para consultas ilimitadas.\n\n"
@@ -45,11 +60,9 @@ class LegalConsult(BaseModule):
         user_id = update.effective_user.id
         text = update.message.text
 
-        # Verificar se é uma consulta jurídica (palavras-chave)
-        legal_keywords = ['lei ', 'direito ', 'jurídico', 'processo', 'recurso', 'contrato', 'penal', 'trabalhista']
-        
-        if any(keyword in text.lower() for keyword in legal_keywords):
-            if not self.check_subscription(user_id):
+        # Verificar se é uma consulta jurídica (palavras-chave ponderadas, sem acento)
+        if self.intent.is_legal(text):
+            if not await self.check_subscription(user_id):
                 await update.message.reply_text(
                     "❌ Você excedeu seu limite de consultas gratuitas. Use /planos para upgrade."
                 )
@@ -59,30 +72,73 @@ class LegalConsult(BaseModule):
 
     async def process_legal_query(self, update: Update, query: str, user_id: int):
         """Processa a consulta jurídica"""
+        # Reservar a consulta na cota antes de processar (atômico no plano free)
+        with span('entitlement'):
+            reservation = await self.db.reserve_usage_async(user_id)
+        if reservation is None:
+            await update.message.reply_text(
+                "❌ Você excedeu seu limite de consultas gratuitas. Use /planos para upgrade."
+            )
+            return
+
         # Indicar que está processando
-        processing_msg = await update.message.reply_text("🔍 Consultando base legal...")
+        with span('telegram_send'):
+            processing_msg = await update.message.reply_text("🔍 Consultando base legal...")
 
         try:
-            # Analisar com contexto legal
-            response = await self.legal_analyzer.analyze_with_legal_context(query, user_id)
+            # Analisar com contexto legal (falhas do modelo lançam LegalAnalysisError)
+            if self.streaming:
+                response = await self.stream_response(processing_msg, query, user_id)
+            else:
+                response = await self.legal_analyzer.analyze_with_legal_context(query, user_id)
 
-            # Incrementar uso
-            self.db.increment_usage(user_id)
+            # Enviar resposta (Markdown apenas no texto completo)
+            with span('telegram_send'):
+                await self.send_final_response(
+                    processing_msg,
+                    f"⚖️ **Consulta Jurídica**\n\n"
+                    f"**Pergunta:** {query}\n\n"
+                    f"**Resposta:**\n{response}"
+                )
 
-            # Enviar resposta
-            await processing_msg.edit_text(
-                f"⚖️ **Consulta Jurídica**\n\n"
-                f"**Pergunta:** {query}\n\n"
-                f"**Resposta:**\n{response}",
-                parse_mode='Markdown'
-            )
+            # Confirmar uso apenas após a entrega da resposta
+            await self.db.commit_usage_async(reservation)
 
         except Exception as e:
             logger.error(f"Erro na consulta legal: {e}")
+            await self.db.refund_usage_async(reservation)
             await processing_msg.edit_text(
                 "❌ Ocorreu um erro na consulta. Tente novamente mais tarde."
             )
 
+    async def stream_response(self, processing_msg, query: str, user_id: int) -> str:
+        """
+        Acrescenta ao placeholder os trechos gerados pelo modelo
+        As edições são em texto simples e espaçadas por STREAM_EDIT_INTERVAL
+        """
+        header = f"⚖️ Consulta Jurídica\n\nPergunta: {query}\n\nResposta:\n"
+        parts = []
+        last_edit = time.monotonic()
+
+        async for text in self.legal_analyzer.stream_with_legal_context(query, user_id):
+            parts.append(text)
+            now = time.monotonic()
+            if now - last_edit < self.edit_interval:
+                continue
+            last_edit = now
+            partial = (header + ''.join(parts))[:MESSAGE_LIMIT - 2] + " ▌"
+            try:
+                with span('telegram_send'):
+                    await processing_msg.edit_text(partial)
+            except BadRequest as e:
+                logger.debug(f"Edição parcial ignorada: {e}")
+
+        return ''.join(parts)
+
+    async def send_final_response(self, processing_msg, text: str):
+        """Edita o placeholder com a resposta completa em Markdown"""
+        await self.send_markdown(processing_msg, text, edit=True)
+
 def register_module(app):
     """Função de registro do módulo"""
-    LegalConsult(app)
+    LegalConsult(app).register_module(app)
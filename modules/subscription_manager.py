@@ -48,8 +48,8 @@ class SubscriptionManager(BaseModule):
     async def my_account(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Mostra informações da conta do usuário"""
         user_id = update.effective_user.id
-        user_data = self.db.get_user_data(user_id)
-        usage_data = self.db.get_user_usage(user_id)
+        user_data = await self.db.get_user_data_async(user_id)
+        usage_data = await self.db.get_user_usage_async(user_id)
         
         plan_emoji = {
             'free': '🆓',
@@ -90,4 +90,4 @@ class SubscriptionManager(BaseModule):
 
 def register_module(app):
     """Função de registro do módulo"""
-    SubscriptionManager(app)
+    SubscriptionManager(app).register_module(app)
@@ -16,6 +16,12 @@ class UtilityCommands(BaseModule):
         self.add_handler(CommandHandler("sobre", self.about))
     
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user = update.effective_user
+        try:
+            # Cadastra o usuário (ou reativa os broadcasts de quem havia bloqueado o bot)
+            await self.db.init_user_async(user.id, user.username, user.first_name)
+        except Exception as e:
+            logger.error(f"Erro ao registrar usuário {user.id}: {e}")
         await update.message.reply_text("🤖 Bot Jurídico Iniciado!")
     
     async def help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
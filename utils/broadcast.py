@@ -0,0 +1,169 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError
+from database.connection import run_in_executor
+from .rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Limite global do Telegram é ~30 mensagens/s; a folga evita 429
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 25))
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', 100))
+BROADCAST_MAX_ATTEMPTS = 3
+# Job 'running' sem sinal de vida há mais que isso é considerado interrompido
+BROADCAST_STALE_AFTER = timedelta(seconds=120)
+# Sinal de vida do job em andamento, independente do avanço dos lotes (ex: pausa por RetryAfter)
+BROADCAST_HEARTBEAT_INTERVAL = BROADCAST_STALE_AFTER.total_seconds() / 4
+
+
+class BroadcastEngine:
+    """
+    Envio de mensagens para todos os usuários com limite de taxa
+    Os destinatários são lidos da coleção users em ordem de user_id, em lotes,
+    e o progresso de cada job é gravado em broadcast_jobs após cada lote, o que
+    permite retomar um envio interrompido a partir do último lote concluído
+    """
+
+    def __init__(self, db, bot, rate: float = None, batch_size: int = None):
+        self.db = db
+        self.bot = bot
+        self.batch_size = batch_size or BROADCAST_BATCH_SIZE
+        self.bucket = TokenBucket(rate or BROADCAST_RATE)
+
+    @property
+    def jobs(self):
+        return self.db.db.broadcast_jobs
+
+    def create_job(self, message: str, admin_id: int):
+        """Registra um novo job de envio e retorna seu _id"""
+        now = datetime.utcnow()
+        result = self.jobs.insert_one({
+            'message': message,
+            'created_by': admin_id,
+            'created_at': now,
+            'heartbeat_at': now,
+            'status': 'running',
+            'last_user_id': None,
+            'sent': 0,
+            'failed': 0,
+            'blocked': 0
+        })
+        return result.inserted_id
+
+    def claim_interrupted_job(self):
+        """Assume o job interrompido mais recente (status running sem heartbeat recente)"""
+        return self.jobs.find_one_and_update(
+            {'status': 'running', 'heartbeat_at': {'$lt': datetime.utcnow() - BROADCAST_STALE_AFTER}},
+            {'$set': {'heartbeat_at': datetime.utcnow()}},
+            sort=[('created_at', -1)]
+        )
+
+    def latest_job(self):
+        return self.jobs.find_one({}, sort=[('created_at', -1)])
+
+    def _recipients(self, last_user_id):
+        """Próximo lote de destinatários após last_user_id"""
+        query = {'blocked': {'$ne': True}}
+        if last_user_id is not None:
+            query['user_id'] = {'$gt': last_user_id}
+        cursor = self.db.users.find(query, {'user_id': 1, '_id': 0}).sort('user_id', 1).limit(self.batch_size)
+        return [user['user_id'] for user in cursor]
+
+    async def _send(self, user_id: int, message: str) -> str:
+        """Envia para um usuário; retorna 'sent', 'blocked' ou 'failed'"""
+        for attempt in range(BROADCAST_MAX_ATTEMPTS):
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=user_id, text=message)
+                return 'sent'
+            except RetryAfter as e:
+                # Limite excedido: pausa todos os envios pelo tempo indicado
+                retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                logger.warning(f"Broadcast limitado pelo Telegram, pausando {retry_after}s")
+                self.bucket.pause(retry_after)
+            except Forbidden:
+                return 'blocked'
+            except BadRequest as e:
+                logger.info(f"Broadcast para {user_id} falhou: {e}")
+                return 'failed'
+            except (TimedOut, NetworkError) as e:
+                logger.warning(f"Erro de rede no broadcast para {user_id}: {e}")
+                await asyncio.sleep(2 ** attempt)
+        return 'failed'
+
+    async def _heartbeat(self, job_id):
+        """Atualiza heartbeat_at periodicamente enquanto o job executa"""
+        while True:
+            await asyncio.sleep(BROADCAST_HEARTBEAT_INTERVAL)
+            try:
+                await run_in_executor(
+                    self.jobs.update_one, {'_id': job_id}, {'$set': {'heartbeat_at': datetime.utcnow()}}
+                )
+            except Exception as e:
+                logger.warning(f"Erro ao atualizar heartbeat do broadcast {job_id}: {e}")
+
+    async def run(self, job_id, progress=None, progress_interval: float = 10.0) -> dict:
+        """
+        Executa (ou retoma) o job até o fim
+        `progress(stats)` é aguardado periodicamente com os contadores atuais
+        """
+        job = await run_in_executor(self.jobs.find_one, {'_id': job_id})
+        message = job['message']
+        last_user_id = job.get('last_user_id')
+        counts = {key: job.get(key, 0) for key in ('sent', 'failed', 'blocked')}
+        started = time.monotonic()
+        last_report = started
+        delivered_now = 0
+
+        # Sem o heartbeat, uma pausa longa (RetryAfter) faria o job parecer interrompido
+        # e /broadcast retomar o assumiria enquanto ainda executa (mensagens em dobro)
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            while True:
+                recipients = await run_in_executor(self._recipients, last_user_id)
+                if not recipients:
+                    break
+
+                results = await asyncio.gather(*(self._send(user_id, message) for user_id in recipients))
+                blocked = [user_id for user_id, result in zip(recipients, results) if result == 'blocked']
+                for result in results:
+                    counts[result] += 1
+                delivered_now += len(recipients)
+                last_user_id = recipients[-1]
+
+                # Usuários que bloquearam o bot deixam de receber broadcasts
+                if blocked:
+                    await run_in_executor(
+                        self.db.users.update_many, {'user_id': {'$in': blocked}}, {'$set': {'blocked': True}}
+                    )
+                await run_in_executor(
+                    self.jobs.update_one,
+                    {'_id': job_id},
+                    {'$set': {**counts, 'last_user_id': last_user_id, 'heartbeat_at': datetime.utcnow()}}
+                )
+
+                if progress and time.monotonic() - last_report >= progress_interval:
+                    last_report = time.monotonic()
+                    rate = delivered_now / (last_report - started)
+                    try:
+                        await progress({**counts, 'rate': rate})
+                    except Exception as e:
+                        # Falha ao informar o progresso (ex: mensagem de status apagada) não interrompe o envio
+                        logger.warning(f"Erro ao informar progresso do broadcast {job_id}: {e}")
+        finally:
+            heartbeat.cancel()
+
+        elapsed = time.monotonic() - started
+        await run_in_executor(
+            self.jobs.update_one,
+            {'_id': job_id},
+            {'$set': {'status': 'done', 'finished_at': datetime.utcnow(), 'elapsed': elapsed}}
+        )
+        logger.info(
+            f"Broadcast {job_id} concluído: {counts['sent']} enviadas, {counts['failed']} falhas, "
+            f"{counts['blocked']} bloqueados em {elapsed:.1f}s"
+        )
+        return {**counts, 'elapsed': elapsed, 'rate': delivered_now / elapsed if elapsed else 0.0}
@@ -0,0 +1,96 @@
+import re
+
+# Início de artigo ("Art. 7º", "Artigo 12") e de parágrafo/inciso ("§ 1º", "Parágrafo único", "IV -")
+_ARTICLE_RE = re.compile(r'(?=^\s*(?:Art\.?|Artigo)\s*\d+)', re.IGNORECASE | re.MULTILINE)
+_SUBUNIT_RE = re.compile(
+    r'(?=^\s*(?:§\s*\d+|Par[aá]grafo\s+[uú]nico|[IVXLC]+\s*[-–—]|[a-z]\)))',
+    re.IGNORECASE | re.MULTILINE
+)
+_SENTENCE_RE = re.compile(r'(?<=[.;:!?])\s+')
+# Início de cláusula contratual ou artigo ("CLÁUSULA PRIMEIRA", "Cláusula 3ª", "Art. 5º")
+_CLAUSE_RE = re.compile(r'(?=^\s*(?:Cl[aá]usula|Art\.?|Artigo)\s+\w+)', re.IGNORECASE | re.MULTILINE)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa grosseira de tokens (~4 caracteres por token)"""
+    return max(len(text) // 4, 1) if text else 0
+
+
+def _split(text: str, pattern) -> list:
+    return [part.strip() for part in pattern.split(text) if part.strip()]
+
+
+def _split_long(unit: str, max_tokens: int) -> list:
+    """Divide uma unidade grande em parágrafos, subunidades e, por fim, frases"""
+    if estimate_tokens(unit) <= max_tokens:
+        return [unit]
+    for pattern in (re.compile(r'\n\s*\n'), _SUBUNIT_RE, _SENTENCE_RE):
+        parts = _split(unit, pattern)
+        if len(parts) > 1:
+            return [piece for part in parts for piece in _split_long(part, max_tokens)]
+    # Sem separadores naturais: corte por tamanho
+    size = max_tokens * 4
+    return [unit[i:i + size] for i in range(0, len(unit), size)]
+
+
+def _merge(units: list, max_tokens: int) -> list:
+    """Junta unidades pequenas consecutivas sem ultrapassar max_tokens"""
+    merged = []
+    current = []
+    current_tokens = 0
+    for unit in units:
+        tokens = estimate_tokens(unit)
+        if current and current_tokens + tokens > max_tokens:
+            merged.append('\n'.join(current))
+            current, current_tokens = [], 0
+        current.append(unit)
+        current_tokens += tokens
+    if current:
+        merged.append('\n'.join(current))
+    return merged
+
+
+def split_legal_units(text: str, max_tokens: int = 300) -> list:
+    """
+    Divide um texto legal em trechos por artigo/parágrafo
+    Artigos longos são subdivididos; trechos curtos vizinhos são agrupados
+    """
+    units = []
+    for article in _split(text, _ARTICLE_RE):
+        units.extend(_split_long(article, max_tokens))
+    return _merge(units, max_tokens)
+
+
+def split_overlapping(text: str, max_tokens: int = 2000, overlap_tokens: int = 200) -> list:
+    """
+    Divide um documento longo em blocos de até max_tokens respeitando cláusulas/artigos
+    Cada bloco repete as últimas unidades do anterior (até overlap_tokens) para
+    não perder o contexto de cláusulas que cruzam a fronteira
+    """
+    units = []
+    for clause in _split(text, _CLAUSE_RE):
+        units.extend(_split_long(clause, max_tokens))
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for unit in units:
+        tokens = estimate_tokens(unit)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append('\n'.join(current))
+            # Sobreposição: unidades finais do bloco anterior
+            tail, tail_tokens = [], 0
+            for previous in reversed(current):
+                previous_tokens = estimate_tokens(previous)
+                if tail_tokens + previous_tokens > overlap_tokens:
+                    break
+                tail.insert(0, previous)
+                tail_tokens += previous_tokens
+            if tail_tokens + tokens > max_tokens:
+                tail, tail_tokens = [], 0
+            current, current_tokens = tail, tail_tokens
+        current.append(unit)
+        current_tokens += tokens
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
@@ -1,36 +1,107 @@
+import os
+import time
+import asyncio
+import hashlib
 import logging
+import threading
 import traceback
+from dataclasses import dataclass
 from telegram import Update
 from telegram.ext import ContextTypes
 
 # Configurar logger específico para erros
 error_logger = logging.getLogger('error_handler')
 
+# Quantidade de frames (os mais internos) que compõem a assinatura do erro
+FINGERPRINT_FRAMES = 3
+
+
+def fingerprint(error: BaseException) -> tuple:
+    """
+    Assinatura do erro: tipo da exceção + frames mais internos (arquivo e função)
+    Números de linha e mensagem ficam de fora para agrupar ocorrências do mesmo problema
+    """
+    frames = traceback.extract_tb(error.__traceback__)[-FINGERPRINT_FRAMES:]
+    location = ' > '.join(
+        f"{os.path.splitext(os.path.basename(frame.filename))[0]}.{frame.name}" for frame in frames
+    )
+    key = hashlib.sha1(f"{type(error).__name__}|{location}".encode('utf-8')).hexdigest()[:12]
+    return key, location
+
+
+@dataclass
+class ErrorStat:
+    """Contadores de uma assinatura de erro"""
+    error_type: str
+    location: str
+    message: str
+    first_seen: float
+    last_seen: float
+    total: int = 0
+    pending: int = 0
+
+
 class ErrorHandler:
     """
     Sistema centralizado de tratamento de erros
     Captura e registra todas as exceções não tratadas
+    Erros são agrupados por assinatura e os administradores recebem resumos
+    periódicos (no máximo um a cada `digest_interval` segundos) em vez de uma
+    mensagem por exceção; uma assinatura nova gera alerta imediato, limitado
+    a um a cada `alert_interval` segundos
     """
-    
-    def __init__(self, admin_ids):
+
+    def __init__(self, admin_ids, digest_interval: float = None, alert_interval: float = None):
         self.admin_ids = admin_ids
-    
+        self.digest_interval = digest_interval or float(os.getenv('ERROR_DIGEST_INTERVAL', 300))
+        self.alert_interval = alert_interval or float(os.getenv('ERROR_ALERT_INTERVAL', 60))
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._last_alert = 0.0
+        self._digest_task = None
+
+    def record(self, error: BaseException) -> tuple:
+        """Contabiliza o erro; retorna (estatística, é_nova_assinatura)"""
+        key, location = fingerprint(error)
+        now = time.time()
+        with self._lock:
+            stat = self.stats.get(key)
+            is_new = stat is None
+            if is_new:
+                stat = self.stats[key] = ErrorStat(type(error).__name__, location, str(error)[:200], now, now)
+            stat.total += 1
+            stat.pending += 1
+            stat.last_seen = now
+        return stat, is_new
+
     async def error_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
         Handler global de erros - captura todas as exceções não tratadas
         """
-        # Log do erro completo
-        error_logger.error(f"Exception while handling an update: {context.error}")
-        
-        # Traceback detalhado para debugging
-        tb_list = traceback.format_exception(None, context.error, context.error.__traceback__)
-        tb_string = ''.join(tb_list)
-        
-        error_logger.error(f"Traceback: {tb_string}")
-        
-        # Notificar administradores sobre erros críticos
-        await self.notify_admins(context, tb_string)
-        
+        stat, is_new = self.record(context.error)
+
+        if is_new:
+            # Traceback completo apenas na primeira ocorrência da assinatura
+            tb_list = traceback.format_exception(None, context.error, context.error.__traceback__)
+            error_logger.error(f"Exception while handling an update: {context.error}\nTraceback: {''.join(tb_list)}")
+        else:
+            error_logger.error(
+                f"Exception while handling an update: {stat.error_type} em {stat.location} "
+                f"(×{stat.total}): {context.error}"
+            )
+
+        # Resumos periódicos para os administradores
+        if self._digest_task is None or self._digest_task.done():
+            self._digest_task = asyncio.get_running_loop().create_task(self._digest_loop(context.bot))
+
+        # Alerta imediato para assinaturas novas, com limite de frequência
+        now = time.monotonic()
+        if is_new and now - self._last_alert >= self.alert_interval:
+            self._last_alert = now
+            with self._lock:
+                stat.pending = 0
+            await self.notify_admins(context, stat)
+
         # Responder ao usuário com mensagem amigável
         if update and update.effective_message:
             user_friendly_message = """
@@ -46,34 +117,52 @@ Enquanto isso, você pode:
 Pedimos desculpas pelo inconveniente.
             """
             await update.effective_message.reply_text(user_friendly_message)
-    
-    async def notify_admins(self, context: ContextTypes.DEFAULT_TYPE, traceback_text: str):
+
+    async def _send(self, bot, text: str):
+        for admin_id in self.admin_ids:
+            try:
+                await bot.send_message(chat_id=admin_id, text=text)
+            except Exception as e:
+                error_logger.error(f"Failed to notify admin {admin_id}: {e}")
+
+    async def notify_admins(self, context: ContextTypes.DEFAULT_TYPE, stat: ErrorStat):
         """
-        Notifica administradores sobre erros críticos
+        Notifica administradores sobre um erro com assinatura nova
         """
         error_message = f"""
-🚨 *ERRO NO SISTEMA JURÍDICO*
+🚨 ERRO NO SISTEMA JURÍDICO (novo)
 
-💥 *Exceção:* {type(context.error).__name__}
-📝 *Mensagem:* {str(context.error)}
+💥 Exceção: {stat.error_type}
+📍 Local: {stat.location}
+📝 Mensagem: {stat.message}
 
-🕒 *Hora:* {context.error.__traceback__.tb_frame.f_code.co_filename if context.error.__traceback__ else 'N/A'}
-
-🔧 *Ação necessária:* Verificar logs para detalhes completos
+🔧 Ocorrências seguintes serão enviadas no resumo periódico
         """
-        
-        # Enviar para todos os administradores
-        for admin_id in self.admin_ids:
-            try:
-                # Enviar mensagem resumida pelo Telegram
-                await context.bot.send_message(
-                    chat_id=admin_id,
-                    text=error_message,
-                    parse_mode='Markdown'
-                )
-                
-                # Log completo no console/log file
-                error_logger.error(f"Error details sent to admin {admin_id}")
-                
-            except Exception as e:
-                error_logger.error(f"Failed to notify admin {admin_id}: {e}")
+        await self._send(context.bot, error_message)
+
+    def digest(self) -> str:
+        """Monta o resumo dos erros pendentes e zera os contadores do período"""
+        with self._lock:
+            pending = [stat for stat in self.stats.values() if stat.pending]
+            pending.sort(key=lambda stat: stat.pending, reverse=True)
+            lines = [
+                f"• {stat.error_type} em {stat.location} ×{stat.pending} (total {stat.total})"
+                for stat in pending[:15]
+            ]
+            for stat in pending:
+                stat.pending = 0
+        if not lines:
+            return ''
+        if len(pending) > 15:
+            lines.append(f"• ... e mais {len(pending) - 15} assinaturas")
+        minutes = self.digest_interval / 60
+        return f"📋 RESUMO DE ERROS (últimos {minutes:g} min)\n\n" + '\n'.join(lines)
+
+    async def _digest_loop(self, bot):
+        """Envia resumos enquanto houver erros; encerra após um período sem ocorrências"""
+        while True:
+            await asyncio.sleep(self.digest_interval)
+            text = self.digest()
+            if not text:
+                return
+            await self._send(bot, text)
@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from .chunking import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class LLMResult:
+    """Resposta do modelo com contagem de tokens (quando disponível)"""
+    text: str
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+
+
+class LLMBackend:
+    """Interface comum dos backends de modelo usados pelos módulos"""
+    name = 'base'
+
+    def generate(self, prompt: str) -> LLMResult:
+        raise NotImplementedError
+
+    def stream(self, prompt: str):
+        """Itera sobre trechos de texto; por padrão entrega a resposta inteira"""
+        yield self.generate(prompt).text
+
+
+class GeminiBackend(LLMBackend):
+    """Backend Google Gemini (SDK importado e configurado no primeiro uso)"""
+    name = 'gemini'
+
+    def __init__(self, model_name: str = None):
+        self.model_name = model_name or os.getenv('GEMINI_MODEL', 'gemini-pro')
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+                    self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def generate(self, prompt: str) -> LLMResult:
+        response = self.model.generate_content(prompt)
+        usage = getattr(response, 'usage_metadata', None)
+        return LLMResult(
+            response.text,
+            getattr(usage, 'prompt_token_count', 0) or estimate_tokens(prompt),
+            getattr(usage, 'candidates_token_count', 0) or estimate_tokens(response.text)
+        )
+
+    def stream(self, prompt: str):
+        for chunk in self.model.generate_content(prompt, stream=True):
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeBackend(LLMBackend):
+    """
+    Substituto local e determinístico do modelo, para testes de carga
+    A latência segue a distribuição configurada em LLM_FAKE_LATENCY:
+    'fixed:0.8', 'uniform:0.5,2.0' ou 'lognormal:0.0,0.5' (segundos)
+    """
+    name = 'fake'
+
+    def __init__(self, latency: str = None, seed: int = None, chunks: int = 8):
+        self.latency = latency or os.getenv('LLM_FAKE_LATENCY', 'fixed:0.5')
+        self.chunks = chunks
+        self._rng = random.Random(int(os.getenv('LLM_FAKE_SEED', 42)) if seed is None else seed)
+        self._lock = threading.Lock()
+        kind, _, params = self.latency.partition(':')
+        self._kind = kind
+        self._params = [float(value) for value in params.split(',') if value]
+
+    def sample_latency(self) -> float:
+        with self._lock:
+            if self._kind == 'fixed':
+                return self._params[0] if self._params else 0.0
+            if self._kind == 'uniform':
+                return self._rng.uniform(*self._params)
+            if self._kind == 'lognormal':
+                return self._rng.lognormvariate(*self._params)
+        raise ValueError(f"Distribuição de latência desconhecida: {self.latency}")
+
+    def _answer(self, prompt: str) -> str:
+        digest = hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:12]
+        return (
+            f"**Resposta Direta**: resposta simulada {digest}.\n\n"
+            f"**Fundamentação**: texto gerado localmente para medição de desempenho.\n\n"
+            f"**Próximos Passos**: nenhum."
+        )
+
+    def generate(self, prompt: str) -> LLMResult:
+        time.sleep(self.sample_latency())
+        text = self._answer(prompt)
+        return LLMResult(text, estimate_tokens(prompt), estimate_tokens(text))
+
+    def stream(self, prompt: str):
+        latency = self.sample_latency()
+        text = self._answer(prompt)
+        size = max(len(text) // self.chunks, 1)
+        for i in range(0, len(text), size):
+            time.sleep(latency / self.chunks)
+            yield text[i:i + size]
+
+
+class LLMReplayMissError(KeyError):
+    """Prompt não encontrado na gravação usada pelo backend de replay"""
+
+
+class RecordReplayBackend(LLMBackend):
+    """
+    Grava respostas de outro backend em JSONL (mode='record') ou as reproduz
+    sem acesso à rede (mode='replay'), indexadas pelo hash do prompt
+    """
+    name = 'replay'
+
+    def __init__(self, path: str, mode: str = 'replay', inner: LLMBackend = None, latency: float = 0.0):
+        self.path = path
+        self.mode = mode
+        self.inner = inner
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._records = {}
+        if mode == 'replay':
+            self._load()
+        elif inner is None:
+            raise ValueError("O modo 'record' exige um backend interno")
+
+    @staticmethod
+    def key(prompt: str) -> str:
+        return hashlib.sha1(prompt.encode('utf-8')).hexdigest()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            logger.warning(f"Gravação de LLM não encontrada: {self.path}")
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._records[record['key']] = LLMResult(
+                        record['text'], record.get('prompt_tokens', 0), record.get('output_tokens', 0)
+                    )
+        logger.info(f"{len(self._records)} respostas carregadas de {self.path}")
+
+    def generate(self, prompt: str) -> LLMResult:
+        key = self.key(prompt)
+        if self.mode == 'replay':
+            result = self._records.get(key)
+            if result is None:
+                if self.inner is None:
+                    raise LLMReplayMissError(key)
+                result = self.inner.generate(prompt)
+            if self.latency:
+                time.sleep(self.latency)
+            return result
+
+        result = self.inner.generate(prompt)
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({
+                'key': key,
+                'prompt': prompt,
+                'text': result.text,
+                'prompt_tokens': result.prompt_tokens,
+                'output_tokens': result.output_tokens
+            }, ensure_ascii=False) + '\n')
+        return result
+
+
+def create_backend(name: str = None) -> LLMBackend:
+    """
+    Cria o backend definido em LLM_BACKEND: gemini (padrão), fake, record ou replay
+    record/replay usam o arquivo LLM_RECORD_PATH
+    """
+    name = name or os.getenv('LLM_BACKEND', 'gemini')
+    if name == 'gemini':
+        return GeminiBackend()
+    if name == 'fake':
+        return FakeBackend()
+    path = os.getenv('LLM_RECORD_PATH', 'llm_recording.jsonl')
+    if name == 'record':
+        return RecordReplayBackend(path, mode='record', inner=GeminiBackend())
+    if name == 'replay':
+        return RecordReplayBackend(path, mode='replay')
+    raise ValueError(f"LLM_BACKEND desconhecido: {name}")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_llm_backend() -> LLMBackend:
+    """Backend compartilhado pelos módulos do processo"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+    return _backend
+
+
+def set_llm_backend(backend: LLMBackend):
+    """Substitui o backend do processo (ex: benchmark com backend simulado)"""
+    global _backend
+    _backend = backend
@@ -0,0 +1,263 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+import functools
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .metrics import REGISTRY
+from .tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Erros do SDK considerados transitórios (comparados pelo nome da classe)
+TRANSIENT_ERRORS = {
+    'ServiceUnavailable', 'ResourceExhausted', 'DeadlineExceeded', 'InternalServerError',
+    'TooManyRequests', 'Aborted', 'RetryError',
+}
+
+
+LLM_LATENCY = REGISTRY.histogram(
+    'llm_request_seconds', 'Duração das chamadas ao modelo (inclui retentativas)', ('mode',)
+)
+LLM_TOKENS = REGISTRY.counter('llm_tokens_total', 'Tokens enviados e gerados pelo modelo', ('backend', 'kind'))
+LLM_ERRORS = REGISTRY.counter('llm_errors_total', 'Chamadas ao modelo com erro', ('reason',))
+
+
+class LLMTimeoutError(Exception):
+    """A chamada ao modelo excedeu o tempo limite"""
+
+
+def is_transient(error: Exception) -> bool:
+    """Indica se vale a pena repetir a chamada após o erro"""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return type(error).__name__ in TRANSIENT_ERRORS
+
+
+class LLMExecutor:
+    """
+    Executor compartilhado para chamadas ao modelo
+    As chamadas bloqueantes do SDK rodam em um pool de threads limitado, com
+    teto global de requisições simultâneas, timeout por chamada e retentativas
+    com backoff exponencial e jitter
+    """
+
+    def __init__(self, max_workers: int = None, max_in_flight: int = None, timeout: float = None,
+                 max_retries: int = None, backoff_base: float = None, backoff_max: float = None):
+        self.max_workers = max_workers or int(os.getenv('LLM_MAX_WORKERS', 16))
+        self.max_in_flight = max_in_flight or int(os.getenv('LLM_MAX_IN_FLIGHT', self.max_workers))
+        self.timeout = timeout or float(os.getenv('LLM_TIMEOUT', 60))
+        self.max_retries = int(os.getenv('LLM_MAX_RETRIES', 2)) if max_retries is None else max_retries
+        self.backoff_base = backoff_base or float(os.getenv('LLM_BACKOFF_BASE', 0.5))
+        self.backoff_max = backoff_max or float(os.getenv('LLM_BACKOFF_MAX', 8))
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='llm')
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_in_flight)
+        return semaphore
+
+    def _add(self, counter: str, value: int = 1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + value)
+
+    async def _acquire(self) -> asyncio.Semaphore:
+        """Aguarda uma vaga no teto de requisições simultâneas"""
+        semaphore = self._semaphore()
+        self._add('queued')
+        try:
+            await semaphore.acquire()
+        finally:
+            self._add('queued', -1)
+        self._add('in_flight')
+        return semaphore
+
+    def _release_when_done(self, future, semaphore: asyncio.Semaphore, loop):
+        """
+        Libera a vaga quando a thread termina a chamada, e não quando o
+        chamador desiste (timeout ou cancelamento): a thread continua ocupada
+        até o SDK retornar, e o teto precisa contar com ela
+        """
+        def release(_):
+            self._add('in_flight', -1)
+            try:
+                loop.call_soon_threadsafe(semaphore.release)
+            except RuntimeError:
+                # Loop já encerrado
+                pass
+        future.add_done_callback(release)
+
+    async def run(self, func, *args, timeout: float = None, **kwargs):
+        """
+        Executa `func(*args, **kwargs)` fora do event loop respeitando os limites
+        Timeouts e erros transitórios são repetidos até max_retries vezes
+        """
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+        timeout = timeout or self.timeout
+
+        call_started = time.perf_counter()
+        attempt = 0
+        while True:
+            semaphore = await self._acquire()
+            started = time.perf_counter()
+            future = self._pool.submit(call)
+            self._release_when_done(future, semaphore, loop)
+            try:
+                result = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+                self._latencies.append(time.perf_counter() - started)
+                self._add('completed')
+                LLM_LATENCY.labels('generate').observe(time.perf_counter() - call_started)
+                return result
+            except asyncio.TimeoutError:
+                self._add('timeouts')
+                LLM_ERRORS.labels('timeout').inc()
+                error = LLMTimeoutError(f"Chamada ao modelo excedeu {timeout:g}s")
+                if attempt >= self.max_retries:
+                    self._add('failed')
+                    raise error
+            except Exception as e:
+                if attempt >= self.max_retries or not is_transient(e):
+                    self._add('failed')
+                    LLM_ERRORS.labels(type(e).__name__).inc()
+                    raise
+                error = e
+
+            attempt += 1
+            self._add('retries')
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+            logger.warning(f"Erro transitório no modelo ({type(error).__name__}), "
+                           f"tentativa {attempt}/{self.max_retries} em {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def generate(self, backend, prompt: str, timeout: float = None) -> str:
+        """Gera conteúdo com o backend (ver utils.llm_backends) e retorna o texto"""
+        with span('llm'):
+            result = await self.run(backend.generate, prompt, timeout=timeout)
+        self._add('prompt_tokens', result.prompt_tokens)
+        self._add('output_tokens', result.output_tokens)
+        LLM_TOKENS.labels(backend.name, 'prompt').inc(result.prompt_tokens)
+        LLM_TOKENS.labels(backend.name, 'output').inc(result.output_tokens)
+        return result.text
+
+    async def stream(self, func, *args, timeout: float = None, **kwargs):
+        """
+        Consome um iterador bloqueante (ex: resposta em streaming do SDK) fora
+        do event loop, entregando cada item assim que chega
+        O timeout vale para o intervalo entre itens; não há retentativa após
+        o primeiro item já ter sido entregue
+        """
+        loop = asyncio.get_running_loop()
+        timeout = timeout or self.timeout
+        queue = asyncio.Queue()
+        cancelled = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                for item in func(*args, **kwargs):
+                    if cancelled.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+
+        semaphore = await self._acquire()
+        started = time.perf_counter()
+        # A vaga é liberada quando o produtor termina (ele para no próximo item após cancelled)
+        self._release_when_done(self._pool.submit(produce), semaphore, loop)
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    self._add('timeouts')
+                    self._add('failed')
+                    LLM_ERRORS.labels('timeout').inc()
+                    raise LLMTimeoutError(f"Streaming do modelo parado há {timeout:g}s")
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    self._add('failed')
+                    LLM_ERRORS.labels(type(item).__name__).inc()
+                    raise item
+                yield item
+            self._latencies.append(time.perf_counter() - started)
+            self._add('completed')
+            LLM_LATENCY.labels('stream').observe(time.perf_counter() - started)
+        finally:
+            cancelled.set()
+
+    async def stream_generate(self, backend, prompt: str, timeout: float = None):
+        """Gera conteúdo em streaming com o backend, entregando os trechos de texto"""
+        # No trace, a etapa inclui o tempo do consumidor entre os trechos (edições parciais)
+        with span('llm'):
+            async for text in self.stream(backend.stream, prompt, timeout=timeout):
+                yield text
+
+    def stats(self) -> dict:
+        """Profundidade da fila, requisições em andamento e latências recentes"""
+        latencies = sorted(self._latencies)
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(int(len(latencies) * p), len(latencies) - 1)]
+
+        return {
+            'queued': self.queued,
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'failed': self.failed,
+            'timeouts': self.timeouts,
+            'retries': self.retries,
+            'prompt_tokens': self.prompt_tokens,
+            'output_tokens': self.output_tokens,
+            'latency_p50': percentile(0.50),
+            'latency_p95': percentile(0.95),
+            'latency_max': latencies[-1] if latencies else 0.0,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _executor_gauges():
+    if _executor is None:
+        return {}
+    return {('queued',): _executor.queued, ('in_flight',): _executor.in_flight}
+
+
+REGISTRY.callback('llm_requests', 'Chamadas ao modelo aguardando vaga ou em andamento', _executor_gauges, ('state',))
+
+
+def get_llm_executor() -> LLMExecutor:
+    """Executor de LLM compartilhado por todos os módulos do processo"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = LLMExecutor()
+    return _executor
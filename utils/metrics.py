@@ -0,0 +1,299 @@
+"""
+Métricas no formato texto do Prometheus (exposto em /metrics)
+
+A coleta no caminho quente é só incremento de atributos, sem lock: sob o GIL
+uma atualização concorrente rara pode se perder, o que é aceitável para
+métricas e evita contenção entre os workers. Valores que já existem em outros
+objetos (profundidade da fila, acertos de cache) são lidos apenas no momento
+da exportação, via callback.
+"""
+import re
+import time
+import asyncio
+import logging
+import functools
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, *values):
+        """Série com os valores de label informados (criada no primeiro uso)"""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def header(self) -> list:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+
+    def render(self) -> list:
+        lines = self.header()
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def _render_child(self, values, child):
+        return [f'{self.name}{_labels(self.labelnames, values)} {_number(child.value)}']
+
+
+class _HistogramChild:
+    __slots__ = ('upper_bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, upper_bounds):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _render_child(self, values, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+            cumulative += count
+            le = f'le="{_number(bound)}"'
+            lines.append(f'{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}')
+        label_text = _labels(self.labelnames, values)
+        lines.append(f'{self.name}_sum{label_text} {_number(child.sum)}')
+        lines.append(f'{self.name}_count{label_text} {child.count}')
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """
+    Métrica lida na exportação: `callback()` retorna um número (sem labels)
+    ou um dict {tupla de valores de label: número}
+    """
+
+    def __init__(self, name: str, documentation: str, callback, labelnames=(), metric_type: str = 'gauge'):
+        super().__init__(name, documentation, labelnames)
+        self.type = metric_type
+        self.callbacks = [callback]
+
+    def render(self) -> list:
+        lines = self.header()
+        for callback in self.callbacks:
+            try:
+                values = callback()
+            except Exception as e:
+                logger.warning(f"Erro ao coletar a métrica {self.name}: {e}")
+                continue
+            if not isinstance(values, dict):
+                values = {(): values}
+            for label_values, value in values.items():
+                lines.append(f'{self.name}{_labels(self.labelnames, label_values)} {_number(value)}')
+        return lines
+
+
+class Registry:
+    """Conjunto de métricas do processo"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics.setdefault(name, cls(name, *args, **kwargs))
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets)
+
+    def callback(self, name: str, documentation: str, callback, labelnames=(), metric_type: str = 'gauge'):
+        """Registra uma métrica lida via callback; chamadas repetidas acumulam callbacks"""
+        metric = self._metrics.get(name)
+        if metric is None:
+            return self._get_or_create(CallbackMetric, name, documentation, callback, labelnames, metric_type)
+        metric.callbacks.append(callback)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+_SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+
+
+def _with_label(line: str, extra: str) -> str:
+    match = _SAMPLE.match(line)
+    if not match:
+        return line
+    name, labels, value = match.groups()
+    return f'{name}{{{labels + "," + extra if labels else extra}}} {value}'
+
+
+def merge_exports(local: str, remote: dict, label_name: str) -> str:
+    """
+    Junta a exportação deste processo com as de outros processos
+    (`remote`: {origem: texto}), acrescentando o label `label_name` às séries
+    de cada origem. Cada métrica aparece uma vez, com HELP/TYPE da primeira
+    exportação que a contém
+    """
+    families = {}
+
+    def parse(text: str, extra: str):
+        family = None
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line.startswith('# '):
+                parts = line.split(' ', 3)
+                if len(parts) < 3:
+                    continue
+                family = families.setdefault(parts[2], ([], []))
+                if not any(header.startswith(f'# {parts[1]} ') for header in family[0]):
+                    family[0].append(line)
+                continue
+            if family is not None:
+                family[1].append(_with_label(line, extra) if extra else line)
+
+    parse(local, '')
+    for source, text in remote.items():
+        parse(text, f'{label_name}="{_escape(source)}"')
+    lines = []
+    for header, samples in families.values():
+        lines.extend(header)
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def timed(child, errors=None, ignore: tuple = ()):
+    """
+    Decorador que registra a duração de cada chamada em `child` (série de histograma)
+    e, se informado, incrementa `errors` quando a chamada lança exceção
+    Exceções em `ignore` (controle de fluxo, não falhas) não contam como erro
+    """
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except ignore:
+                    raise
+                except Exception:
+                    if errors is not None:
+                        errors.inc()
+                    raise
+                finally:
+                    child.observe(time.perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except ignore:
+                raise
+            except Exception:
+                if errors is not None:
+                    errors.inc()
+                raise
+            finally:
+                child.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def register_cache(name: str, cache):
+    """Exporta acertos e faltas de um TTLCache ou PersistentCache"""
+    def hits():
+        if hasattr(cache, 'stats'):
+            stats = cache.stats()
+            return {(name, 'memory'): stats['memory_hits'], (name, 'persistent'): stats['persistent_hits']}
+        return {(name, 'memory'): cache.hits}
+
+    def misses():
+        return {(name,): cache.misses}
+
+    def ratio():
+        if hasattr(cache, 'stats'):
+            return {(name,): cache.stats()['hit_ratio']}
+        return {(name,): cache.hit_ratio}
+
+    REGISTRY.callback('cache_hits_total', 'Acertos de cache', hits, ('cache', 'level'), 'counter')
+    REGISTRY.callback('cache_misses_total', 'Faltas de cache', misses, ('cache',), 'counter')
+    REGISTRY.callback('cache_hit_ratio', 'Proporção de acertos de cache', ratio, ('cache',))
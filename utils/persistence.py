@@ -0,0 +1,205 @@
+"""
+Persistência do estado do bot (user_data e estados de ConversationHandler)
+compartilhada entre processos, sobre database.state_store
+
+O PTB só carrega a persistência na inicialização; para que um processo veja o
+que outro gravou, o estado do usuário é relido a cada atualização
+(`refresh_user_data`, disparado cedo pelo `state_loader`). As conversas
+compartilhadas (`SharedConversationHandler`) consultam o estado da chave pelo
+mapeamento de `get_conversations` e gravam por `update_conversation`. O
+dispatcher chama `update_persistence` e `flush_user` ao fim de cada
+atualização, gravando no banco o estado do usuário antes da próxima.
+"""
+import os
+import logging
+from telegram import Update
+from telegram.ext import BasePersistence, PersistenceInput, BaseHandler, ConversationHandler, TypeHandler
+from database.connection import run_in_executor
+from database.state_store import state_store, _MISSING
+
+logger = logging.getLogger(__name__)
+
+# Desligar (SHARED_STATE=0) mantém o estado apenas na memória de cada processo
+SHARED_STATE_ENABLED = os.getenv('SHARED_STATE', '1').lower() not in ('0', 'false', 'no')
+
+# Grupo avaliado antes de todos os handlers dos módulos
+STATE_LOADER_GROUP = -100
+
+
+class SharedStatePersistence(BasePersistence):
+    """Persistência do PTB sobre o SharedStateStore (apenas user_data e conversas)"""
+
+    def __init__(self, store=None):
+        # update_persistence é chamado pelo dispatcher após cada atualização
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=60
+        )
+        self.store = store or state_store
+
+    # Nada é carregado na inicialização: o estado de cada usuário é lido sob demanda
+
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str):
+        return ConversationView(self.store, name)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        await run_in_executor(self.store.refresh, user_id)
+        user_data.clear()
+        user_data.update(self.store.user_data(user_id))
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
+
+    async def update_user_data(self, user_id: int, data: dict):
+        self.store.set_user_data(user_id, data)
+
+    async def drop_user_data(self, user_id: int):
+        self.store.drop_user_data(user_id)
+
+    async def update_conversation(self, name: str, key: tuple, new_state):
+        # Conversas compartilhadas são por usuário: o id do usuário é o último item da chave
+        self.store.set_conversation(name, key, new_state, user_id=key[-1])
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def flush(self):
+        await run_in_executor(self.store.flush)
+
+    async def flush_user(self, user_id: int):
+        """Grava no banco o estado do usuário (fim de cada atualização)"""
+        try:
+            await run_in_executor(self.store.flush_user, user_id)
+        except Exception as e:
+            # Continua na fila: a thread de flush tenta de novo
+            logger.error(f"Erro ao gravar o estado do usuário {user_id}: {e}")
+
+
+class ConversationView:
+    """
+    Estados de uma conversa por chave, lidos da memória do armazenamento
+    Só consulta por chave: o estado é carregado por usuário, sob demanda
+    (refresh_user_data), então não há lista completa de conversas
+    """
+
+    def __init__(self, store, name: str):
+        self.store = store
+        self.name = name
+
+    def get(self, key: tuple, default=None):
+        state = self.store.conversation_state(self.name, key, user_id=key[-1])
+        return default if state is None or state is _MISSING else state
+
+    def keys(self):
+        return ()
+
+
+async def _load_state(update: Update, context):
+    """
+    O estado do usuário já foi lido em refresh_user_data, ao montar o contexto;
+    aqui as conversas compartilhadas recebem o mapeamento de estados da persistência
+    """
+    application = context.application
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, SharedConversationHandler) and not handler.connected:
+                handler.conversations = await application.persistence.get_conversations(handler.name)
+                handler.connected = True
+
+
+def state_loader() -> TypeHandler:
+    """
+    Handler que casa com todas as atualizações, registrado em STATE_LOADER_GROUP:
+    força o PTB a montar o contexto (e reler o estado do usuário) antes que as
+    conversas avaliem a atualização
+    """
+    return TypeHandler(Update, _load_state)
+
+
+class SharedConversationHandler(BaseHandler):
+    """
+    Conversa (entry_points -> states -> fallbacks) com estado compartilhado entre processos
+    Equivale a um ConversationHandler por chat e usuário, mas usa apenas a API
+    pública do PTB: o estado é lido de `persistence.get_conversations(name)` e
+    gravado com `persistence.update_conversation`. Sem a persistência
+    compartilhada (SHARED_STATE=0), o estado fica na memória do processo
+    """
+
+    END = ConversationHandler.END
+
+    def __init__(self, entry_points: list, states: dict, fallbacks: list, name: str,
+                 allow_reentry: bool = False, persistent: bool = None):
+        super().__init__(self._handle)
+        self.entry_points = entry_points
+        self.states = states
+        self.fallbacks = fallbacks
+        self.name = name
+        self.allow_reentry = allow_reentry
+        self.persistent = SHARED_STATE_ENABLED if persistent is None else persistent
+        # Estados em memória (não persistente) ou mapeamento da persistência
+        self.conversations = {}
+        self.connected = not self.persistent
+
+    @staticmethod
+    def _key(update: Update):
+        return (update.effective_chat.id, update.effective_user.id)
+
+    def check_update(self, update: object):
+        if not isinstance(update, Update) or not update.effective_user or not update.effective_chat:
+            return None
+        key = self._key(update)
+        state = self.conversations.get(key)
+
+        candidates = []
+        if state is None or self.allow_reentry:
+            candidates.extend(self.entry_points)
+        if state is not None:
+            candidates.extend(self.states.get(state, []))
+            candidates.extend(self.fallbacks)
+        for handler in candidates:
+            check = handler.check_update(update)
+            if check is not None and check is not False:
+                return key, handler, check
+        return None
+
+    async def handle_update(self, update, application, check_result, context):
+        key, handler, check = check_result
+        new_state = await handler.handle_update(update, application, check, context)
+        if new_state is None:
+            return None
+        if new_state == self.END:
+            new_state = None
+        if self.persistent:
+            await application.persistence.update_conversation(self.name, key, new_state)
+        elif new_state is None:
+            self.conversations.pop(key, None)
+        else:
+            self.conversations[key] = new_state
+        return None
+
+    async def _handle(self, update, context):
+        """Não usado: handle_update delega ao handler interno"""
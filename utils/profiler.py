@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+
+class SamplingProfiler:
+    """
+    Profiler estatístico: amostra a pilha de todas as threads a cada `interval`
+    segundos durante um tempo limitado
+    O resultado segue o formato "collapsed stacks" (uma linha por pilha,
+    'thread;modulo:funcao;...' seguido da contagem), aceito por flamegraph.pl
+    e speedscope
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self.sample_count = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stack(frame) -> list:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.splitext(os.path.basename(code.co_filename))[0]}:{code.co_name}")
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def run(self, duration: float) -> str:
+        """Amostra por `duration` segundos (bloqueante) e retorna as pilhas agregadas"""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("Já existe um profiling em andamento")
+        try:
+            self.samples.clear()
+            self.sample_count = 0
+            own_thread = threading.get_ident()
+            deadline = time.monotonic() + duration
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_thread:
+                        continue
+                    stack = [names.get(thread_id, str(thread_id))] + self._stack(frame)
+                    self.samples[';'.join(stack)] += 1
+                self.sample_count += 1
+                time.sleep(self.interval)
+            return self.collapsed()
+        finally:
+            self._lock.release()
+
+    def collapsed(self) -> str:
+        return collapse(self.samples)
+
+    def top_functions(self, limit: int = 10) -> list:
+        return top_functions(self.samples, limit)
+
+
+def collapse(samples: Counter) -> str:
+    """Pilhas agregadas no formato collapsed (uma linha por pilha com a contagem)"""
+    return '\n'.join(f"{stack} {count}" for stack, count in samples.most_common()) + '\n'
+
+
+def top_functions(samples: Counter, limit: int = 10) -> list:
+    """Funções no topo da pilha (tempo próprio) com sua fração das amostras"""
+    own = Counter()
+    for stack, count in samples.items():
+        own[stack.rsplit(';', 1)[-1]] += count
+    total = sum(own.values()) or 1
+    return [(name, count / total) for name, count in own.most_common(limit)]
+
+
+# Um profiling por processo
+profiler = SamplingProfiler(float(os.getenv('PROFILE_INTERVAL', 0.005)))
@@ -0,0 +1,38 @@
+import time
+import asyncio
+
+
+class TokenBucket:
+    """
+    Limitador de taxa assíncrono (token bucket)
+    Com capacity=1 os envios são espaçados uniformemente em `rate` por segundo;
+    `pause` suspende todas as aquisições (ex: RetryAfter do Telegram)
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Aguarda até haver um token disponível"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Bloqueia novas aquisições por `seconds` segundos"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
@@ -0,0 +1,581 @@
+"""
+Distribuição das atualizações entre processos, por usuário (WEBHOOK_MODE=sharded)
+
+O processo do webhook (roteador) não executa handlers: cada atualização vai
+para o processo dono do usuário, escolhido por hash consistente sobre
+effective_user.id. Dentro do processo o UpdateDispatcher já serializa as
+atualizações de cada usuário, então cada usuário é atendido em ordem estrita
+e usuários diferentes usam todos os núcleos.
+
+Se um processo morre, ele sai do anel: as atualizações que ainda não tinha
+consumido são reencaminhadas, na ordem, aos novos donos, e um substituto é
+iniciado. Quando o substituto fica pronto volta ao anel e recupera seus
+usuários. Um usuário só muda de processo quando não tem atualizações pendentes
+no processo anterior, o que preserva a ordem durante o rebalanceamento.
+As atualizações que o processo morto já tinha consumido (em processamento)
+são perdidas e contadas em `lost`: o webhook já respondeu ao Telegram, que não
+as reenvia. Um processo que morre antes de ficar pronto (ex: falha na
+inicialização) é reiniciado com espera exponencial e, após
+SHARD_MAX_START_FAILURES falhas seguidas, deixa de ser reiniciado.
+
+Os processos enviam ao roteador, pelo canal de eventos, um relatório periódico
+(métricas e fila), exposto em /metrics e /health do processo web, e comandos
+administrativos (/trace, /profile) chegam a todos os processos por
+`cluster_call`.
+
+O roteador vive no processo web: use um único worker web por máquina
+(gunicorn -w 1, com --threads para concorrência, sem --preload). Um arquivo de
+trava (SHARD_LOCK_FILE) impede que um segundo worker inicie outro pool.
+"""
+import os
+import sys
+import time
+import uuid
+import queue
+import bisect
+import hashlib
+import logging
+import tempfile
+import importlib
+import itertools
+import threading
+import multiprocessing
+from utils.update_dispatcher import QueueFullError
+
+logger = logging.getLogger(__name__)
+
+# Chaves reservadas na fila de um processo: comando de controle e resposta a um cluster_call
+CONTROL = '__control__'
+CONTROL_REPLY = '__control_reply__'
+
+
+def effective_user_id(data: dict):
+    """
+    Id do usuário de uma atualização em JSON (sem desserializar com o PTB)
+    Atualizações sem usuário (ex: posts de canal) usam o id do chat
+    """
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get('from') or value.get('user')
+        if user and 'id' in user:
+            return user['id']
+        chat = value.get('chat')
+        if chat and 'id' in chat:
+            return chat['id']
+    return None
+
+
+def _hash(value) -> int:
+    return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Anel de hash consistente com réplicas virtuais por nó"""
+
+    def __init__(self, replicas: int = 64):
+        self.replicas = replicas
+        self._hashes = []
+        self._nodes = []
+
+    def add(self, node):
+        for i in range(self.replicas):
+            point = _hash(f"{node}:{i}")
+            index = bisect.bisect(self._hashes, point)
+            self._hashes.insert(index, point)
+            self._nodes.insert(index, node)
+
+    def remove(self, node):
+        kept = [(point, owner) for point, owner in zip(self._hashes, self._nodes) if owner != node]
+        self._hashes = [point for point, _ in kept]
+        self._nodes = [owner for _, owner in kept]
+
+    def __contains__(self, node) -> bool:
+        return node in self._nodes
+
+    def get(self, key):
+        """Nó dono da chave (None se o anel está vazio)"""
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+def acquire_lock_file(path: str):
+    """
+    Trava exclusiva em arquivo, mantida enquanto o arquivo retornado estiver aberto
+    Lança RuntimeError se outro processo já detém a trava
+    """
+    import fcntl
+    handle = open(path, 'w')
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        raise RuntimeError(f"Outro processo já detém {path}")
+    handle.write(str(os.getpid()))
+    handle.flush()
+    return handle
+
+
+class _Shard:
+    __slots__ = ('shard_id', 'generation', 'process', 'queue', 'pending', 'ready', 'failures',
+                 'restart_at', 'report', 'reported_at')
+
+    def __init__(self, shard_id: int, generation: int, queue, failures: int = 0):
+        self.shard_id = shard_id
+        self.generation = generation
+        # None até o processo ser iniciado (ou se não será mais reiniciado)
+        self.process = None
+        self.queue = queue
+        self.pending = 0
+        self.ready = False
+        # Mortes seguidas antes de ficar pronto
+        self.failures = failures
+        self.restart_at = None
+        self.report = None
+        self.reported_at = None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+
+class ShardRouter:
+    """Roteia atualizações (JSON) para um pool de processos do bot"""
+
+    def __init__(self, workers: int = None, max_pending: int = None, replicas: int = 64):
+        self.workers = workers or int(os.getenv('SHARD_WORKERS', os.cpu_count() or 1))
+        # Limite de atualizações pendentes por processo (backpressure)
+        self.max_pending = max_pending or int(os.getenv('SHARD_QUEUE_SIZE', 1000))
+        self.monitor_interval = float(os.getenv('SHARD_MONITOR_INTERVAL', 1))
+        # Espera antes de reiniciar um processo que morreu antes de ficar pronto (dobra a cada falha)
+        self.restart_backoff = float(os.getenv('SHARD_RESTART_BACKOFF', 1))
+        self.restart_backoff_max = float(os.getenv('SHARD_RESTART_BACKOFF_MAX', 60))
+        self.max_start_failures = int(os.getenv('SHARD_MAX_START_FAILURES', 5))
+        self.lock_path = os.getenv('SHARD_LOCK_FILE', os.path.join(tempfile.gettempdir(), 'juridical-bot-router.lock'))
+        self.ring = HashRing(replicas)
+        self._context = multiprocessing.get_context('spawn')
+        self._events = None
+        self._shards = {}
+        # Usuário -> [processo, atualizações pendentes]: o usuário fica no processo até zerar
+        self._inflight = {}
+        self._lock = threading.Lock()
+        # Respostas dos processos aos comandos de controle: id do pedido -> {processo: resultado}
+        self._replies = {}
+        self._replies_ready = threading.Condition(self._lock)
+        self._request_ids = itertools.count(1)
+        self._lock_file = None
+        self._stop = threading.Event()
+        self._threads = []
+        self.routed = 0
+        self.rejected = 0
+        self.rerouted = 0
+        self.lost = 0
+        self.restarts = 0
+
+    @property
+    def depth(self) -> int:
+        """Atualizações encaminhadas e ainda não concluídas"""
+        return sum(shard.pending for shard in self._shards.values())
+
+    def start(self):
+        """
+        Inicia o pool. Lança RuntimeError se há mais de um worker web
+        (cada um criaria o próprio roteador e pool)
+        """
+        if int(os.getenv('WEB_CONCURRENCY', 1)) > 1:
+            raise RuntimeError("WEBHOOK_MODE=sharded exige um único worker web (WEB_CONCURRENCY=1)")
+        self._lock_file = acquire_lock_file(self.lock_path)
+        self._events = self._context.Queue()
+        with self._lock:
+            for shard_id in range(self.workers):
+                self._shards[shard_id] = _Shard(shard_id, 0, self._context.Queue())
+                self._start_process(self._shards[shard_id])
+                self.ring.add(shard_id)
+        for target, name in ((self._listen, 'shard-events'), (self._monitor, 'shard-monitor')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"🧩 Roteador iniciado com {self.workers} processos")
+
+    def _start_process(self, shard: _Shard):
+        """Inicia o processo do shard (com o lock); o id segue nos argumentos, não no ambiente"""
+        shard.process = self._context.Process(
+            target=shard_main, args=(shard.shard_id, shard.generation, shard.queue, self._events),
+            name=f'shard-{shard.shard_id}', daemon=True
+        )
+        shard.process.start()
+        shard.restart_at = None
+
+    def _route(self, key, data, shard_id: int):
+        """Encaminha para o processo informado (com o lock)"""
+        shard = self._shards[shard_id]
+        shard.pending += 1
+        entry = self._inflight.get(key)
+        if entry is None:
+            self._inflight[key] = [shard_id, 1]
+        else:
+            entry[1] += 1
+        shard.queue.put((key, data))
+
+    def submit(self, data: dict):
+        """
+        Encaminha a atualização ao processo do usuário sem bloquear
+        Lança QueueFullError se o processo atingiu o limite de pendentes
+        """
+        key = effective_user_id(data)
+        if key is None:
+            key = data.get('update_id')
+        with self._lock:
+            entry = self._inflight.get(key)
+            shard_id = entry[0] if entry else self.ring.get(key)
+            if shard_id is None:
+                self.rejected += 1
+                raise QueueFullError("Nenhum processo disponível")
+            if self._shards[shard_id].pending >= self.max_pending:
+                self.rejected += 1
+                raise QueueFullError(f"Fila do processo {shard_id} cheia ({self.max_pending})")
+            self._route(key, data, shard_id)
+            self.routed += 1
+
+    def _listen(self):
+        """Recebe dos processos confirmações, avisos de pronto, relatórios e comandos de controle"""
+        while not self._stop.is_set():
+            try:
+                event = self._events.get(timeout=1)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            try:
+                kind, shard_id, generation, payload = event
+            except (TypeError, ValueError):
+                logger.warning(f"Evento malformado ignorado: {event!r}")
+                continue
+            with self._lock:
+                shard = self._shards.get(shard_id)
+                if shard is None or shard.generation != generation:
+                    continue
+                if kind == 'ready':
+                    shard.ready = True
+                    shard.failures = 0
+                    if shard_id not in self.ring:
+                        self.ring.add(shard_id)
+                        logger.info(f"🧩 Processo {shard_id} de volta ao anel")
+                elif kind == 'report':
+                    shard.report = payload
+                    shard.reported_at = time.time()
+                elif kind == 'reply':
+                    request_id, result = payload
+                    if request_id in self._replies:
+                        self._replies[request_id][shard_id] = result
+                        self._replies_ready.notify_all()
+                elif kind == 'broadcast':
+                    # cluster_call de um processo: repassa a todos sem bloquear a escuta
+                    threading.Thread(
+                        target=self._answer, args=(shard_id, *payload), name='shard-broadcast', daemon=True
+                    ).start()
+                elif kind == 'done':
+                    shard.pending -= 1
+                    entry = self._inflight.get(payload)
+                    if entry is not None and entry[0] == shard_id:
+                        entry[1] -= 1
+                        if entry[1] <= 0:
+                            del self._inflight[payload]
+                else:
+                    # Não altera pending/_inflight: só 'done' confirma uma atualização processada
+                    logger.warning(f"Evento desconhecido do processo {shard_id}: {kind!r}")
+
+    def _monitor(self):
+        while not self._stop.wait(self.monitor_interval):
+            for shard_id, shard in list(self._shards.items()):
+                try:
+                    if shard.process is None:
+                        if shard.restart_at is not None and time.monotonic() >= shard.restart_at:
+                            with self._lock:
+                                self._start_process(shard)
+                                self.restarts += 1
+                    elif not shard.process.is_alive():
+                        self._rebalance(shard_id)
+                except Exception as e:
+                    logger.error(f"Erro ao substituir o processo {shard_id}: {e}")
+
+    @staticmethod
+    def _drain(shard_queue) -> list:
+        items = []
+        while True:
+            try:
+                items.append(shard_queue.get(timeout=0.05))
+            except (queue.Empty, EOFError, OSError):
+                return items
+
+    def _rebalance(self, shard_id: int):
+        """
+        Retira do anel o processo morto, reencaminha o que ele não consumiu e
+        agenda um substituto. As atualizações que ele já tinha consumido são
+        perdidas (contadas em `lost`)
+        """
+        with self._lock:
+            dead = self._shards[shard_id]
+            self.ring.remove(shard_id)
+            leftovers = [item for item in self._drain(dead.queue) if item and item[0] not in (CONTROL, CONTROL_REPLY)]
+            lost = max(dead.pending - len(leftovers), 0)
+            self.lost += lost
+            for key in [key for key, (owner, _) in self._inflight.items() if owner == shard_id]:
+                del self._inflight[key]
+
+            # Morte antes de ficar pronto conta como falha de inicialização
+            failures = 0 if dead.ready else dead.failures + 1
+            replacement = self._shards[shard_id] = _Shard(shard_id, dead.generation + 1, self._context.Queue(), failures)
+            if failures >= self.max_start_failures:
+                logger.error(
+                    f"❌ Processo {shard_id} falhou {failures} vezes seguidas ao iniciar; não será reiniciado"
+                )
+            else:
+                delay = min(self.restart_backoff * 2 ** (failures - 1), self.restart_backoff_max) if failures else 0
+                replacement.restart_at = time.monotonic() + delay
+
+            rerouted = 0
+            for key, data in leftovers:
+                target = self.ring.get(key)
+                if target is None:
+                    if replacement.restart_at is None:
+                        self.lost += 1
+                        continue
+                    # Único processo: aguarda o substituto
+                    target = shard_id
+                self._route(key, data, target)
+                rerouted += 1
+            self.rerouted += rerouted
+        logger.warning(
+            f"⚠️ Processo {shard_id} (exit {dead.process.exitcode}) removido: "
+            f"{rerouted} atualizações reencaminhadas, {lost} perdidas em processamento"
+        )
+
+    # Relatórios e comandos de controle
+
+    def broadcast(self, command: str, args: tuple = (), timeout: float = 30) -> dict:
+        """
+        Executa um comando de controle (CONTROL_COMMANDS) em todos os processos prontos
+        Retorna {id do processo: resultado}; quem não responde no prazo fica com um erro
+        """
+        request_id = next(self._request_ids)
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            targets = [shard_id for shard_id, shard in self._shards.items() if shard.ready and shard.alive]
+            replies = self._replies[request_id] = {}
+            for shard_id in targets:
+                self._shards[shard_id].queue.put((CONTROL, (request_id, command, args)))
+            while len(replies) < len(targets):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._replies_ready.wait(remaining)
+            del self._replies[request_id]
+        return {shard_id: replies.get(shard_id, {'error': 'sem resposta'}) for shard_id in targets}
+
+    def _answer(self, origin: int, request_id: str, command: str, args: tuple, timeout: float):
+        try:
+            results = self.broadcast(command, args, timeout)
+        except Exception as e:
+            logger.error(f"Erro no comando de controle {command}: {e}")
+            results = {}
+        with self._lock:
+            shard = self._shards.get(origin)
+            if shard is not None:
+                shard.queue.put((CONTROL_REPLY, (request_id, results)))
+
+    def shard_metrics(self) -> dict:
+        """Última exportação de métricas de cada processo: {id: texto do Prometheus}"""
+        return {
+            str(shard_id): shard.report['metrics']
+            for shard_id, shard in list(self._shards.items()) if shard.report
+        }
+
+    def health(self) -> list:
+        """Estado de cada processo do pool"""
+        now = time.time()
+        return [
+            {
+                'shard': shard_id,
+                'generation': shard.generation,
+                'alive': shard.alive,
+                'ready': shard.ready,
+                'pending': shard.pending,
+                'start_failures': shard.failures,
+                'queue_depth': shard.report.get('depth') if shard.report else None,
+                'report_age_s': round(now - shard.reported_at, 1) if shard.reported_at else None
+            }
+            for shard_id, shard in sorted(self._shards.items())
+        ]
+
+    def stop(self, timeout: float = 30):
+        """Encerra os processos após consumirem o que já foi encaminhado"""
+        self._stop.set()
+        for shard in self._shards.values():
+            shard.queue.put(None)
+        for shard in self._shards.values():
+            if shard.process is None:
+                continue
+            shard.process.join(timeout)
+            if shard.process.is_alive():
+                shard.process.terminate()
+        if self._lock_file:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+# Comandos de controle executados em cada processo (resultados serializáveis)
+
+def _control_trace(action: str = None, rate: float = None) -> dict:
+    """Liga/desliga o rastreamento; sem ação, retorna os traces recentes"""
+    from utils.tracing import tracer
+    if action == 'on':
+        tracer.sample_rate = rate
+    elif action == 'off':
+        tracer.sample_rate = 0.0
+    traces = [trace.as_dict() for trace in tracer.recent()] if action is None else []
+    return {'sample_rate': tracer.sample_rate, 'traces': traces}
+
+
+def _control_profile(seconds: float) -> dict:
+    """Executa o profiler estatístico; retorna as pilhas amostradas"""
+    from utils.profiler import profiler
+    try:
+        profiler.run(seconds)
+    except RuntimeError as e:
+        return {'error': str(e)}
+    return {'samples': dict(profiler.samples), 'sample_count': profiler.sample_count}
+
+
+CONTROL_COMMANDS = {'trace': _control_trace, 'profile': _control_profile}
+
+
+class _ShardChannel:
+    """Pedidos deste processo ao roteador (cluster_call) e suas respostas"""
+
+    def __init__(self, shard_id: int, generation: int, events):
+        self.shard_id = shard_id
+        self.generation = generation
+        self.events = events
+        self._waiting = {}
+        self._lock = threading.Lock()
+
+    def request(self, command: str, args: tuple, timeout: float) -> dict:
+        request_id = uuid.uuid4().hex
+        done = threading.Event()
+        with self._lock:
+            self._waiting[request_id] = [done, None]
+        try:
+            self.events.put(('broadcast', self.shard_id, self.generation, (request_id, command, args, timeout)))
+            if not done.wait(timeout + 5):
+                raise TimeoutError(f"Sem resposta do roteador para {command}")
+            return self._waiting[request_id][1]
+        finally:
+            with self._lock:
+                self._waiting.pop(request_id, None)
+
+    def resolve(self, request_id: str, results: dict):
+        with self._lock:
+            waiting = self._waiting.get(request_id)
+            if waiting is not None:
+                waiting[1] = results
+                waiting[0].set()
+
+
+# Definido em shard_main nos processos do pool
+_channel = None
+
+
+def cluster_call(command: str, *args, timeout: float = 30) -> dict:
+    """
+    Executa um comando de controle em todos os processos do bot (bloqueante)
+    No pool o pedido passa pelo roteador; fora dele roda apenas neste processo
+    Retorna {nome do processo: resultado}
+    """
+    if _channel is None:
+        return {'local': CONTROL_COMMANDS[command](*args)}
+    results = _channel.request(command, args, timeout)
+    return {f"shard-{shard_id}": result for shard_id, result in sorted(results.items())}
+
+
+def _run_control(events, shard_id: int, generation: int, request):
+    request_id, command, args = request
+    try:
+        result = CONTROL_COMMANDS[command](*args)
+    except Exception as e:
+        logger.error(f"Erro no comando de controle {command}: {e}")
+        result = {'error': str(e)}
+    events.put(('reply', shard_id, generation, (request_id, result)))
+
+
+def _report(bot, shard_id: int, generation: int, events):
+    """Envia ao roteador, periodicamente, as métricas e a fila deste processo"""
+    from utils.metrics import REGISTRY
+    interval = float(os.getenv('SHARD_REPORT_INTERVAL', 5))
+    while True:
+        try:
+            events.put(('report', shard_id, generation, {
+                'metrics': REGISTRY.render(),
+                'depth': bot.dispatcher.depth,
+                'processed': bot.dispatcher.processed
+            }))
+        except Exception as e:
+            logger.error(f"Erro ao enviar relatório do processo {shard_id}: {e}")
+        time.sleep(interval)
+
+
+def shard_main(shard_id: int, generation: int, shard_queue, events):
+    """Processo do pool: inicializa o bot (main) e processa as atualizações recebidas"""
+    global _channel
+    # Definido aqui, no próprio processo: o main lê SHARD_ID ao ser importado
+    os.environ['SHARD_ID'] = str(shard_id)
+    bot = sys.modules.get('__mp_main__')
+    if hasattr(bot, 'initialize_shard'):
+        # Iniciado com `python main.py`: o spawn já importou o main como __mp_main__,
+        # antes deste ponto e sem inicializar o bot
+        bot.initialize_shard(shard_id)
+    else:
+        bot = importlib.import_module('main')
+    from telegram import Update
+
+    if not bot.bot_initialized:
+        logger.error(f"❌ Processo {shard_id} não inicializou o bot")
+        sys.exit(1)
+    _channel = _ShardChannel(shard_id, generation, events)
+    events.put(('ready', shard_id, generation, None))
+    threading.Thread(target=_report, args=(bot, shard_id, generation, events), name='shard-report', daemon=True).start()
+
+    while True:
+        item = shard_queue.get()
+        if item is None:
+            break
+        key, data = item
+        if key == CONTROL:
+            # Em thread própria: um /profile não atrasa as atualizações
+            threading.Thread(
+                target=_run_control, args=(events, shard_id, generation, data), name='shard-control', daemon=True
+            ).start()
+            continue
+        if key == CONTROL_REPLY:
+            _channel.resolve(*data)
+            continue
+
+        def done(key=key):
+            events.put(('done', shard_id, generation, key))
+
+        try:
+            update = Update.de_json(data, bot.application.bot)
+            while True:
+                try:
+                    bot.dispatcher.submit(update, on_done=done)
+                    break
+                except QueueFullError:
+                    # O roteador já limita os pendentes; aqui só aguardamos vaga na fila local
+                    time.sleep(0.05)
+        except Exception as e:
+            logger.error(f"Erro no processo {shard_id} ao receber atualização: {e}")
+            done()
+
+    bot.dispatcher.stop()
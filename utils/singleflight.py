@@ -0,0 +1,65 @@
+import asyncio
+import weakref
+
+
+class SingleFlight:
+    """
+    Coalescência de requisições idênticas em andamento
+    Chamadas concorrentes com a mesma chave compartilham uma única execução
+    e todas recebem o mesmo resultado (ou a mesma exceção)
+    """
+
+    def __init__(self):
+        self._calls = weakref.WeakKeyDictionary()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _calls_for_loop(self) -> dict:
+        loop = asyncio.get_running_loop()
+        calls = self._calls.get(loop)
+        if calls is None:
+            calls = self._calls[loop] = {}
+        return calls
+
+    def _register(self, calls: dict, key, future):
+        def _done(finished):
+            if calls.get(key) is finished:
+                del calls[key]
+            # Marca a exceção como consumida mesmo se ninguém estiver aguardando
+            if not finished.cancelled():
+                finished.exception()
+
+        calls[key] = future
+        future.add_done_callback(_done)
+        self.leaders += 1
+
+    def in_flight(self, key):
+        """Retorna a execução em andamento para a chave, se houver"""
+        return self._calls_for_loop().get(key)
+
+    async def do(self, key, factory):
+        """
+        Executa `factory()` (corrotina) uma única vez por chave em andamento
+        O cancelamento de um dos chamadores não interrompe a execução compartilhada
+        """
+        calls = self._calls_for_loop()
+        task = calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._register(calls, key, task)
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def begin(self, key) -> asyncio.Future:
+        """
+        Registra manualmente uma execução para a chave (ex: resposta em streaming)
+        O chamador deve resolver o Future com set_result/set_exception
+        """
+        calls = self._calls_for_loop()
+        future = asyncio.get_running_loop().create_future()
+        self._register(calls, key, future)
+        return future
+
+    def stats(self) -> dict:
+        return {'leaders': self.leaders, 'coalesced': self.coalesced}
@@ -0,0 +1,42 @@
+import time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Mede a duração de cada fase da inicialização do processo"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name: str, elapsed: float):
+        self.phases.append((name, elapsed))
+
+    @property
+    def total(self) -> float:
+        return time.perf_counter() - self.started
+
+    def as_dict(self) -> dict:
+        """Duração das fases em milissegundos (para o /health)"""
+        return {name: round(elapsed * 1000, 1) for name, elapsed in self.phases}
+
+    def report(self):
+        """Registra no log as fases ordenadas pela duração"""
+        lines = [f"  {name:<32} {elapsed * 1000:8.1f} ms" for name, elapsed in
+                 sorted(self.phases, key=lambda phase: phase[1], reverse=True)]
+        logger.info(f"⏱️ Inicialização em {self.total * 1000:.0f} ms:\n" + '\n'.join(lines))
+
+
+# Cronômetro do processo, iniciado na importação do main
+startup_timer = StartupTimer()
@@ -0,0 +1,79 @@
+import codecs
+
+# Tamanho dos blocos lidos de arquivos de texto
+TEXT_CHUNK_SIZE = 64 * 1024
+
+
+def iter_txt(buffer):
+    """Decodifica o texto em blocos (UTF-8, com fallback para cp1252)"""
+    first = buffer.read(TEXT_CHUNK_SIZE)
+    encoding = 'utf-8-sig'
+    try:
+        codecs.getincrementaldecoder(encoding)().decode(first, final=False)
+    except UnicodeDecodeError:
+        encoding = 'cp1252'
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+
+    chunk = first
+    while chunk:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+        chunk = buffer.read(TEXT_CHUNK_SIZE)
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def iter_pdf(buffer):
+    """Extrai o texto página por página"""
+    from PyPDF2 import PdfReader
+    reader = PdfReader(buffer)
+    for page in reader.pages:
+        text = page.extract_text() or ''
+        if text.strip():
+            yield text + '\n'
+
+
+def iter_docx(buffer):
+    """Extrai o texto parágrafo por parágrafo (e depois as tabelas)"""
+    import docx
+    document = docx.Document(buffer)
+    for paragraph in document.paragraphs:
+        if paragraph.text.strip():
+            yield paragraph.text + '\n'
+    for table in document.tables:
+        for row in table.rows:
+            cells = [cell.text.strip() for cell in row.cells if cell.text.strip()]
+            if cells:
+                yield ' | '.join(cells) + '\n'
+
+
+EXTRACTORS = {
+    'txt': iter_txt,
+    'pdf': iter_pdf,
+    'docx': iter_docx,
+}
+
+
+def iter_text(buffer, extension: str):
+    """Gerador de trechos de texto do arquivo, conforme a extensão"""
+    extractor = EXTRACTORS.get(extension)
+    if extractor is None:
+        raise ValueError(f"Formato não suportado: {extension}")
+    return extractor(buffer)
+
+
+def extract_text(buffer, extension: str, max_chars: int):
+    """
+    Extrai até max_chars caracteres, interrompendo a leitura ao atingir o limite
+    Retorna (texto, truncado) - ao atingir o limite o texto é considerado truncado
+    """
+    parts = []
+    total = 0
+    for text in iter_text(buffer, extension):
+        parts.append(text)
+        total += len(text)
+        if total >= max_chars:
+            return ''.join(parts)[:max_chars], True
+    return ''.join(parts), False
@@ -0,0 +1,141 @@
+"""
+Rastreamento amostrado por atualização
+
+Com o rastreamento ativo (taxa > 0), uma fração das atualizações recebe um
+trace com a duração de cada etapa marcada com `span(...)` (verificação de
+cota, busca, montagem do prompt, modelo, envio ao Telegram). Com a taxa em
+zero, `span` retorna um gerenciador de contexto vazio compartilhado: o custo
+é uma comparação por etapa.
+"""
+import os
+import time
+import random
+import contextvars
+from collections import deque
+from datetime import datetime
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+class Trace:
+    """Etapas medidas durante o processamento de uma atualização"""
+    __slots__ = ('name', 'started_at', '_started', 'spans', 'duration')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = datetime.utcnow()
+        self._started = time.perf_counter()
+        self.spans = []
+        self.duration = None
+
+    def as_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': round((self.duration or 0) * 1000, 1),
+            'spans': [
+                {'name': name, 'offset_ms': round(offset * 1000, 1), 'duration_ms': round(duration * 1000, 1)}
+                for name, offset, duration in self.spans
+            ]
+        }
+
+    def summary(self) -> str:
+        return summarize(self.as_dict())
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'started')
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        finished = time.perf_counter()
+        self.trace.spans.append((self.name, self.started - self.trace._started, finished - self.started))
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """Controle do rastreamento (taxa de amostragem) e traces recentes em memória"""
+
+    def __init__(self, buffer_size: int = None):
+        self.sample_rate = 0.0
+        self.buffer_size = buffer_size
+        self._traces = None
+
+    @property
+    def traces(self) -> deque:
+        # Criado no primeiro uso: o tracer global é instanciado na importação,
+        # antes de o processo carregar o .env
+        if self._traces is None:
+            self._traces = deque(maxlen=self.buffer_size or int(os.getenv('TRACE_BUFFER_SIZE', 500)))
+        return self._traces
+
+    def begin(self, name: str):
+        """Inicia um trace para a atualização atual, conforme a amostragem"""
+        if random.random() >= self.sample_rate:
+            return None
+        trace = Trace(name)
+        return trace, _current_trace.set(trace)
+
+    def finish(self, handle):
+        trace, token = handle
+        trace.duration = time.perf_counter() - trace._started
+        _current_trace.reset(token)
+        self.traces.append(trace)
+
+    def recent(self, limit: int = None) -> list:
+        traces = list(self.traces)
+        return traces[-limit:] if limit else traces
+
+
+tracer = Tracer()
+
+
+def summarize(trace: dict) -> str:
+    """Resumo em uma linha de um trace no formato de Trace.as_dict"""
+    steps = ' | '.join(f"{step['name']} {step['duration_ms']:.0f}ms" for step in trace['spans'])
+    return f"{trace['name']} {trace['duration_ms']:.0f}ms: {steps or 'sem etapas'}"
+
+
+def span(name: str):
+    """Marca uma etapa do trace atual: `with span('retrieval'): ...`"""
+    if not tracer.sample_rate:
+        return _NOOP_SPAN
+    trace = _current_trace.get()
+    if trace is None:
+        return _NOOP_SPAN
+    return _Span(trace, name)
+
+
+def describe_update(update) -> str:
+    """Nome do trace: comando, ou o tipo de mensagem"""
+    message = getattr(update, 'effective_message', None)
+    text = getattr(message, 'text', None) or ''
+    if text.startswith('/'):
+        return text.split()[0].split('@')[0]
+    if getattr(message, 'document', None):
+        return 'documento'
+    if text:
+        return 'texto'
+    if getattr(update, 'callback_query', None):
+        return 'callback'
+    return 'atualizacao'
@@ -0,0 +1,181 @@
+import os
+import asyncio
+import logging
+import threading
+from collections import deque
+from utils.tracing import tracer, describe_update
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Fila de atualizações cheia - a atualização foi rejeitada"""
+
+
+class UpdateDispatcher:
+    """
+    Fila de atualizações em memória com pool de workers asyncio
+    O webhook apenas enfileira e responde; os workers executam os handlers
+    Atualizações do mesmo usuário são processadas uma de cada vez, na ordem de
+    chegada; usuários diferentes seguem em paralelo
+    """
+
+    def __init__(self, application, workers: int = None, max_queue: int = None):
+        self.application = application
+        self.workers = workers or int(os.getenv('UPDATE_WORKERS', 8))
+        self.max_queue = max_queue or int(os.getenv('UPDATE_QUEUE_SIZE', 1000))
+        self.loop = None
+        self.queue = None
+        self._thread = None
+        self._tasks = []
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._start_error = None
+        # Usuários com atualização em processamento -> atualizações seguintes em espera
+        self._busy_users = {}
+        self.processed = 0
+        self.rejected = 0
+
+    @property
+    def depth(self) -> int:
+        """Quantidade de atualizações aguardando ou em processamento"""
+        return self._pending
+
+    def start(self):
+        """Inicia o event loop dedicado em uma thread de fundo"""
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run_loop, name='update-dispatcher', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._start_error is not None:
+            # Falha na inicialização da Application (ex: token inválido, getMe falhou)
+            self._thread.join(timeout=5)
+            self._thread = None
+            raise self._start_error
+        logger.info(f"🧵 Dispatcher iniciado com {self.workers} workers (fila máx. {self.max_queue})")
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.queue = asyncio.Queue()
+        try:
+            self.loop.run_until_complete(self.application.initialize())
+        except Exception as e:
+            self._start_error = e
+            self.loop.close()
+            return
+        finally:
+            # start() nunca fica bloqueado, mesmo se a inicialização falhar
+            self._ready.set()
+        self._tasks = [self.loop.create_task(self._worker(i)) for i in range(self.workers)]
+        self.loop.run_forever()
+
+    def run(self, coro, timeout: float = None):
+        """Executa uma corrotina no loop do dispatcher e aguarda o resultado"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def submit(self, update, on_done=None):
+        """
+        Enfileira uma atualização sem bloquear
+        `on_done`, se informado, é chamado no loop ao fim do processamento
+        Lança QueueFullError se a fila atingiu o limite (backpressure)
+        """
+        with self._pending_lock:
+            if self._pending >= self.max_queue:
+                self.rejected += 1
+                raise QueueFullError(f"Fila de atualizações cheia ({self.max_queue})")
+            self._pending += 1
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (update, on_done))
+
+    async def process(self, update):
+        """Executa os handlers para uma atualização (com trace, se amostrada)"""
+        if not tracer.sample_rate:
+            return await self._process(update)
+        handle = tracer.begin(describe_update(update))
+        try:
+            return await self._process(update)
+        finally:
+            if handle:
+                tracer.finish(handle)
+
+    async def _process(self, update):
+        await self.application.process_update(update)
+        # Estado alterado pelos handlers (user_data, conversas) segue para a persistência
+        persistence = self.application.persistence
+        if persistence:
+            await self.application.update_persistence()
+            # Estado do usuário gravado antes da próxima atualização dele (em qualquer processo)
+            user_id = self._user_key(update)
+            if user_id is not None and hasattr(persistence, 'flush_user'):
+                await persistence.flush_user(user_id)
+
+    @staticmethod
+    def _user_key(update):
+        user = getattr(update, 'effective_user', None)
+        return user.id if user else None
+
+    async def _worker(self, worker_id: int):
+        """
+        Consome a fila e executa os handlers da Application
+        Se o usuário já tem uma atualização em processamento, a nova fica na
+        fila do usuário e é executada pelo mesmo worker, em seguida
+        """
+        while True:
+            item = await self.queue.get()
+            key = self._user_key(item[0])
+            if key is not None:
+                waiting = self._busy_users.get(key)
+                if waiting is not None:
+                    waiting.append(item)
+                    continue
+                self._busy_users[key] = deque()
+
+            while item is not None:
+                await self._run_item(worker_id, item)
+                item = None
+                if key is not None:
+                    waiting = self._busy_users[key]
+                    if waiting:
+                        item = waiting.popleft()
+                    else:
+                        del self._busy_users[key]
+
+    async def _run_item(self, worker_id: int, item):
+        update, on_done = item
+        try:
+            await self.process(update)
+        except Exception as e:
+            logger.error(f"Erro no worker {worker_id} ao processar atualização: {e}")
+        finally:
+            self.queue.task_done()
+            with self._pending_lock:
+                self._pending -= 1
+                self.processed += 1
+            if on_done is not None:
+                try:
+                    on_done()
+                except Exception as e:
+                    logger.error(f"Erro ao confirmar atualização processada: {e}")
+
+    def stop(self, timeout: float = 30):
+        """Aguarda a fila esvaziar e encerra o loop"""
+        if not self._thread:
+            return
+
+        async def _drain():
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Dispatcher encerrado com {self._pending} atualizações pendentes")
+            for task in self._tasks:
+                task.cancel()
+            await self.application.shutdown()
+
+        try:
+            self.run(_drain(), timeout + 5)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=5)
+            self._thread = None